@@ -1,9 +1,28 @@
 from django.contrib import admin
+from django.utils.html import format_html
+from .forms import CalcFloorForm, CalcWallForm
 from .models import Result
 
 
+PLAN_FORMS = {
+    'floor': CalcFloorForm,
+    'walls': CalcWallForm,
+}
+
+
 @admin.register(Result)
 class ResultAdmin(admin.ModelAdmin):
     list_display = ('name', 'ts')
+    list_filter = ('name',)
+    # COUNT(*) всей таблицы на каждой странице списка не нужен
+    show_full_result_count = False
     # fields = ('name', 'data', 'result', 'ip', 'ts')
-    readonly_fields = ('ts',)
+    readonly_fields = ('ts', 'plan')
+
+    def plan(self, obj):
+        # схема рисуется заново по данным расчета, даже если файл уже удален
+        form_class = PLAN_FORMS.get(obj.name)
+        url = form_class.plan_url_from_data(obj.data) if form_class and obj.data else None
+        if url is None:
+            return "-"
+        return format_html('<a href="{}">{}</a>', url, url)
@@ -1,12 +1,9 @@
 import sys
-from math import tan, tanh, sqrt, ceil
+from math import tan
 from django.conf import settings
-from .drawing import add_text_watermark
-
-
-LAYING_METHOD_DIRECT = 1
-LAYING_METHOD_DIRECT_CENTER = 2
-LAYING_METHOD_DIAGONAL = 3
+from .drawing import add_text_watermark, floor_scale, Canvas, Floor, Position
+from .layout import LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL
+from .timing import timed
 
 
 def check_with_delimiters(l, tl, d, c):
@@ -47,110 +44,18 @@ def add_background(color):
 
 # @add_background(color=(255, 255, 255, 255))
 @add_text_watermark(settings.DRAWING_WATERMARK_TEXT)
-def draw_floor(width, length, tile_width, tile_length, method=LAYING_METHOD_DIRECT):
+def draw_floor(layout):
     """X=length, Y=width
-    :param width: width of floor (mm)
-    :param length: length of floor (mm)
-    :param method: mothod of tile laying.
+    :param layout: layout of the floor.
+    :type layout: Layout
     :return: PIL.Image
     """
-    scale_factor = 9  # TODO: need compute this
-
-    size = (sys.maxsize, sys.maxsize)
-    while any(s > 1000 for s in size):
-        scale_factor += 1
-        size = (int(length/scale_factor), int(width/scale_factor))  # scale 10sm=100mm : 1px.
-
-    tile_size = (int(tile_length/scale_factor), int(tile_width/scale_factor))
-
-    center_x = size[0] / 2
-    center_y = size[1] / 2
-
-    image = Image.new('RGBA', size, (255, 255, 255, 255))
-    draw = ImageDraw.Draw(image)
+    sf, size = floor_scale(layout)
 
-    line_color = (255, 0, 0, 255)
-    line_width = 1
-
-    # рисуем периметр
-    draw.line((0, 0, size[0] - 1, 0), fill=line_color, width=line_width)
-    draw.line((0, size[1] - 1, size[0] - 1, size[1] - 1), fill=line_color, width=line_width)
-
-    draw.line((0, 0, 0, size[1] - 1), fill=line_color, width=line_width)
-    draw.line((size[0] - 1, 0, size[0] - 1, size[1] - 1), fill=line_color, width=line_width)
-
-    if method == LAYING_METHOD_DIRECT:
-        # рисуем плитки по length
-        curr_x = 0
-        while curr_x < size[0]:
-            draw.line((curr_x, 0, curr_x, size[1]-1), fill=line_color, width=line_width)
-            curr_x += tile_size[0]
-        # рисуем плитки по width
-        curr_y = 0
-        while curr_y < size[1]:
-            draw.line((0, curr_y, size[0]-1, curr_y), fill=line_color, width=line_width)
-            curr_y += tile_size[1]
-    elif method == LAYING_METHOD_DIRECT_CENTER:  # TODO: simplify - start from outside.
-        # рисуем полосы по length (x)
-        curr_x = size[0]/2 + tile_size[0]/2
-        draw.line((curr_x, 0, curr_x, size[1]-1), fill=line_color, width=line_width)
-        while curr_x >= 0:
-            curr_x -= tile_size[0]
-            draw.line((curr_x, 0, curr_x, size[1] - 1), fill=line_color, width=line_width)
-
-        curr_x = size[0]/2 + tile_size[0]/2
-        draw.line((curr_x, 0, curr_x, size[1] - 1), fill=line_color, width=line_width)
-        while curr_x <= size[0]:
-            curr_x += tile_size[0]
-            draw.line((curr_x, 0, curr_x, size[1] - 1), fill=line_color, width=line_width)
-
-        # рисуем полосы по width (y)
-        curr_y = size[1] / 2 + tile_size[1] / 2
-        draw.line((0, curr_y, size[0] - 1, curr_y), fill=line_color, width=line_width)
-        while curr_y >= 0:
-            curr_y -= tile_size[1]
-            draw.line((0, curr_y, size[0] - 1, curr_y), fill=line_color, width=line_width)
-
-        curr_y = size[1] / 2 + tile_size[1] / 2
-        draw.line((0, curr_y, size[0] - 1, curr_y), fill=line_color, width=line_width)
-        while curr_y <= size[1]:
-            curr_y += tile_size[0]
-            draw.line((0, curr_y, size[0] - 1, curr_y), fill=line_color, width=line_width)
-    elif method == LAYING_METHOD_DIAGONAL:
-        # представим наклонную грань плитки гипотенузой прамоугольного треугольника.
-        # находим длину прилежащего катета через угол (45) и длину противолежащего.
-        b = center_y
-        alpha = 45.0
-        a = b * tanh(alpha)
-
-        # находим диагональ плитки
-        if tile_width == tile_length:
-            d = sqrt(2) * tile_width
-        else:
-            d = sqrt(tile_length**2 + tile_width**2)
-        d /= scale_factor
-        d05 = d/2
-
-        # находим выступ за границами объекта для начала рисования наклонных линий:
-        # сдвигаемся от центра на полплитки + суммарную длину диагоналей целых плиток,
-        # добавляем длину прилежащего катета (a).
-        m = ((ceil((center_x-d05)/d) * d) + d05) - center_x
-        m = -(m+d*2)
-        curr_x = m
-
-        while curr_x < size[0] or curr_x-a < size[0]:
-            draw.line((curr_x-a, 0, curr_x+a, size[1]-1), fill=line_color, width=line_width)
-            draw.line((curr_x + a, 0, curr_x - a, size[1] - 1), fill=line_color, width=line_width)
-            curr_x += d
-
-        # curr_x = m
-        # while curr_x < size[0] or curr_x - a < size[0]:
-        #     draw.line((curr_x + a, 0, curr_x - a, size[1] - 1), fill=line_color, width=line_width)
-        #     curr_x += d
-    else:
-        raise Exception("Unknown drawing method")
+    canvas = Canvas(size.width, size.height, scale_factor=sf)
+    Floor(layout).draw(canvas, Position())
 
-    return image
+    return canvas.im
 
 
 @add_text_watermark(settings.DRAWING_WATERMARK_TEXT)
@@ -229,15 +134,31 @@ def draw_walls(width, length, height, tile_length, tile_height, door_width=None,
     return image
 
 
-def save_image(image, path):
+@timed('encode')
+def save_image(image, path, filename=None):
+    """Сохраняет изображение в PNG.
+    Файл пишется во временный и затем переименовывается,
+    чтобы параллельный запрос не получил недописанный файл.
+    :param image: PIL.Image
+    :param path: directory to save.
+    :param filename: name of file, random if not set.
+    :return: name of the saved file.
+    """
     import uuid
     import os
 
-    filename = str(uuid.uuid4()) + ".png"
+    if filename is None:
+        filename = str(uuid.uuid4()) + ".png"
 
     fullname = os.path.join(path, filename)
-
-    image.save(fullname, "PNG")
+    tmpname = "{}.{}.tmp".format(fullname, uuid.uuid4().hex)
+
+    image.save(
+        tmpname, "PNG",
+        compress_level=settings.DRAWING_PNG_COMPRESS_LEVEL,
+        optimize=settings.DRAWING_PNG_OPTIMIZE
+    )
+    os.replace(tmpname, fullname)
 
     return filename
 
@@ -0,0 +1,53 @@
+"""Number of calculations for the banner of every page.
+
+COUNT(*) of the table of results is a scan of the whole table, so the
+number is taken from the estimate of the planner (pg_class.reltuples)
+when the table is big, and is cached in the worker for RESULTS_COUNT_TTL
+seconds, so a page costs at most one cheap query per TTL.
+"""
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Result
+
+
+_cache = {'value': None, 'expires': 0}
+
+
+def estimate_count(model):
+    """Estimated number of rows of the model's table (PostgreSQL only).
+    :return: number or None if it's unknown.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [model._meta.db_table]
+        )
+        row = cursor.fetchone()
+
+    # -1 - таблица еще не анализировалась
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+def results_count():
+    """Number of results, exact for small tables, estimated for big ones.
+    :rtype: int
+    """
+    now = time.time()
+    if _cache['value'] is not None and now < _cache['expires']:
+        return _cache['value']
+
+    value = estimate_count(Result)
+    if value is None or value < settings.RESULTS_COUNT_EXACT_BELOW:
+        value = Result.objects.count()
+
+    _cache['value'] = value
+    _cache['expires'] = now + settings.RESULTS_COUNT_TTL
+    return value
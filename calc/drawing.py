@@ -1,31 +1,19 @@
-#!/usr/bin/env python
-
-import os
 from abc import ABCMeta, abstractmethod
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from copy import deepcopy
-from math import ceil, floor
+from math import floor
+from .watermark import apply_watermark
+from .layout import CUT_LO, CUT_HI
+from .timing import stage, timed
+
+from django.conf import settings
 
-if __name__ == "__main__":
-    # DRAWING
-    DRAWING_WATERMARK_TEXT = "www.tcutter.ru"
-    DRAWING_WATERMARK_FONT = "/home/zeez/work/cutter/static/fonts/arial.ttf"
-else:
-    from django.conf import settings
-    DRAWING_WATERMARK_TEXT = settings.DRAWING_WATERMARK_TEXT
-    DRAWING_WATERMARK_FONT = settings.DRAWING_WATERMARK_FONT
+DRAWING_WATERMARK_TEXT = settings.DRAWING_WATERMARK_TEXT
+DRAWING_WATERMARK_FONT = settings.DRAWING_WATERMARK_FONT
 
 color = (120, 120, 120, 255)
 color_cutted = (255, 0, 0, 255)
-
-
-__WATERMARK_FONT_SIZE = 60
-
-def get_font(size):
-    return ImageFont.truetype(
-        DRAWING_WATERMARK_FONT,
-        size=size
-    )
+tile_fill = "#b9cbda"
 
 
 def add_text_watermark(text):
@@ -33,29 +21,8 @@ def add_text_watermark(text):
     def decorator(func):
         def wrapper(*args):
             image = func(*args)
-
-            watermark = Image.new('RGBA', size=image.size, color=0)
-            # watermark = Image.new('RGBA', size=(image.width, 64), color=0)
-            draw = ImageDraw.Draw(watermark)
-            font = get_font(60)
-            tw = None
-            th = None
-            while True:
-                tw, th = draw.textsize(text, font=font)
-                if tw+10 < image.size[0] and th+10 < image.size[1]:
-                    break
-                font = get_font(font.size-2)
-
-            draw.text(
-                (image.width/2 - tw/2, image.height/2 - th/2),
-                text,
-                fill=(0, 0, 0, 128),
-                font=font
-            )
-
-            # image.paste(watermark, box=(0, 15), mask=watermark)
-            return Image.alpha_composite(image, watermark)
-            # return image
+            with stage('watermark'):
+                return apply_watermark(image, text, DRAWING_WATERMARK_FONT)
 
         return wrapper
     return decorator
@@ -103,6 +70,28 @@ class Size:
         return "{}x{}".format(self.width, self.height)
 
 
+def fit_scale_factor(w, h, max_size):
+    """Scale factor (px in mm) for drawing object of max_size on canvas w x h.
+    :type max_size: Size
+    :rtype: float
+    """
+    sf = 1.0
+    while True:
+        change = False
+        if max_size.width * sf > w or max_size.height * sf > h:
+            sf *= 0.9
+            change = True
+
+        if max_size.width * (sf * 1.0625) <= w and max_size.height * (sf * 1.0625) <= h:
+            sf *= 1.0625
+            change = True
+
+        if not change:
+            break
+
+    return sf
+
+
 class Canvas:
     def __init__(self, w, h, scale_factor=None, max_size=None):
         """
@@ -117,22 +106,7 @@ class Canvas:
         if scale_factor:
             self._scale_factor = scale_factor
         elif max_size:
-            sf = 1.0
-            while True:
-                change = False
-                if max_size.width * sf > self._width or max_size.height * sf > self._height:
-                    sf *= 0.9
-                    change = True
-
-                if max_size.width * (sf * 1.0625) <= self._width and max_size.height * (sf * 1.0625) <= self._height:
-                    sf *= 1.0625
-                    change = True
-
-                if not change:
-                    break
-
-            self._scale_factor = sf
-            print("Scale factor auto set to: %f" % sf)
+            self._scale_factor = fit_scale_factor(self._width, self._height, max_size)
         else:
             raise Exception("need scale_factor or max_size")
 
@@ -158,6 +132,28 @@ class Canvas:
         return int(self._scale_factor * value)
 
 
+def draw_tile_shape(d, x0, y0, x1, y1, cut_top=False, cut_left=False, cut_right=False, cut_bottom=False):
+    """Filled tile, cut sides are red.
+    :type d: ImageDraw
+    """
+    d.polygon([(x0, y0), (x1, y0), (x1, y1), (x0, y1)], fill=tile_fill)
+
+    Object._draw_line(d, x0, y0, x1, y0, color=color_cutted if cut_top else color)
+    Object._draw_line(d, x0, y1, x0, y0, color=color_cutted if cut_left else color)
+    Object._draw_line(d, x1, y0, x1, y1, color=color_cutted if cut_right else color)
+    Object._draw_line(d, x1, y1, x0, y1, color=color_cutted if cut_bottom else color)
+
+
+def draw_diamond_shape(d, cx, cy, rx, ry, cut=False):
+    """Tile turned by 45° inscribed in the rectangle with center cx, cy.
+    :type d: ImageDraw
+    """
+    d.polygon(
+        [(cx, cy - ry), (cx + rx, cy), (cx, cy + ry), (cx - rx, cy)],
+        fill=tile_fill, outline=color_cutted if cut else color
+    )
+
+
 class Tile(Object):
     def __init__(self, w, h, start_x=None, start_y=None, max_x=None, max_y=None):
         super(Tile, self).__init__()
@@ -191,37 +187,13 @@ class Tile(Object):
         #     print("[WRN]: tile width <= 0")
         #     return
 
-        # fill shape
-        d.polygon([
-            (sp.x, sp.y),
-            (sp.x + wpix, sp.y),
-            (sp.x + wpix, sp.y + hpix),
-            (sp.x, sp.y + hpix)
-        ], fill="#b9cbda")
-
-        # top line
-        if self.start_y is None:
-            self._draw_line(d, sp.x, sp.y, sp.x + wpix, sp.y, color=color)
-        else:
-            self._draw_line(d, sp.x, sp.y, sp.x + wpix, sp.y, color=color_cutted)
-
-        # left line
-        if self.start_x is None:
-            self._draw_line(d, sp.x, sp.y + hpix, sp.x, sp.y, color=color)
-        else:
-            self._draw_line(d, sp.x, sp.y + hpix, sp.x, sp.y, color=color_cutted)
-
-        # right line
-        if self.max_x is None:
-            self._draw_line(d, sp.x + wpix, sp.y, sp.x + wpix, sp.y + hpix, color=color)
-        else:
-            self._draw_line(d, sp.x + wpix, sp.y, sp.x + wpix, sp.y + hpix, color=color_cutted)
-
-        # bottom line
-        if self.max_y is None:
-            self._draw_line(d, sp.x + wpix, sp.y + hpix, sp.x, sp.y + hpix, color=color)
-        else:
-            self._draw_line(d, sp.x + wpix, sp.y + hpix, sp.x, sp.y + hpix, color=color_cutted)
+        draw_tile_shape(
+            d, sp.x, sp.y, sp.x + wpix, sp.y + hpix,
+            cut_top=self.start_y is not None,
+            cut_left=self.start_x is not None,
+            cut_right=self.max_x is not None,
+            cut_bottom=self.max_y is not None
+        )
 
     def draw_contour_out(self, canvas, start_pos, length): pass
 
@@ -244,86 +216,149 @@ class Position:
         self.y = y
 
 
-class WallTilesOptions:
-    def __init__(self, w, h, d, sx=None, sy=None, mx=None, my=None):
-        """
-        :param w: tile width in mm
-        :param h: tile height in mm
-        :param d: delimiter in mm
-        :param sx: start from by X-coord in mm
-        :param sy: start from by Y-coord in mm
-        :param mx:
-        :param my:
-        """
-        self.width = w
-        self.height = h
-        self.delimiter = d
-        self.start_x = sx
-        self.start_y = sy
-        self.max_x = mx
-        self.max_y = my
+def draw_layout_tiles(canvas, layout, start_pos, x_from, x_to):
+    """Draw tiles of the layout between x_from and x_to (mm) starting from start_pos.
+    :type canvas: Canvas
+    :type layout: Layout
+    :type start_pos: Position
+    """
+    d = canvas.get_draw()
+    sp = start_pos
+
+    def px_x(x):
+        return sp.x + canvas.to_pixels(x - x_from)
+
+    def px_y(y):
+        return sp.y + canvas.to_pixels(y)
+
+    for grid in layout.grids:
+        cols, rows = grid.cols, grid.rows
+        ci, cj = cols.overlapping(x_from, x_to)
+        # плитки вне контура помещения не рисуются
+        row_ranges = layout.column_ranges(grid, x_from, x_to)
+
+        if grid.diamond:
+            for c in range(ci, cj):
+                cx = cols.origin[c] + cols.size/2
+                for r in range(len(rows)):
+                    if not any(i <= c < j for i, j in row_ranges[r]):
+                        continue
+                    cy = rows.origin[r] + rows.size/2
+                    draw_diamond_shape(
+                        d, px_x(cx), px_y(cy),
+                        canvas.to_pixels(cols.size/2), canvas.to_pixels(rows.size/2),
+                        cut=bool(cols.flags[c] or rows.flags[r])
+                    )
+            continue
+
+        for r in range(len(rows)):
+            y0, y1 = px_y(rows.start[r]), px_y(rows.end[r])
+            cut_top = bool(rows.flags[r] & CUT_LO)
+            cut_bottom = bool(rows.flags[r] & CUT_HI)
+
+            for i, j in row_ranges[r]:
+                for c in range(i, j):
+                    # плитка на стыке стен рисуется частями на обеих стенах
+                    start, end = cols.start[c], cols.end[c]
+                    draw_tile_shape(
+                        d, px_x(max(start, x_from)), y0, px_x(min(end, x_to)), y1,
+                        cut_top=cut_top,
+                        cut_left=bool(cols.flags[c] & CUT_LO) or start < x_from,
+                        cut_right=bool(cols.flags[c] & CUT_HI) or end > x_to,
+                        cut_bottom=cut_bottom
+                    )
 
+    # проемы (двери) без плитки
+    for x0, y0, x1, y1 in layout.openings:
+        if x1 <= x_from or x0 >= x_to:
+            continue
+        left, right = px_x(max(x0, x_from)), px_x(min(x1, x_to))
+        top, bottom = px_y(y0), px_y(y1)
+        d.polygon([(left, bottom), (left, top), (right, top), (right, bottom)], fill="#fff")
+
+        if x0 > 0:
+            Object._draw_line(d, left, bottom, left, top, color=color_cutted)
+        if x1 < layout.width:
+            Object._draw_line(d, right, bottom, right, top, color=color_cutted)
+        if y0 > 0:
+            Object._draw_line(d, left, top, right, top, color=color_cutted)
+        if y1 < layout.height:
+            Object._draw_line(d, left, bottom, right, bottom, color=color_cutted)
+
+
+def plan_points(vertices, to_pixels, size):
+    """Vertices of a polygon of the floor on the plan (px).
+    :param to_pixels: mm -> px.
+    :param size: Size of the plan (px), the right and the bottom edges are its last pixels.
+    """
+    return [(min(to_pixels(x), size.width - 1), min(to_pixels(y), size.height - 1)) for x, y in vertices]
 
-class Wall(Object):
-    def __init__(self, w, h, tile, options=None):
-        """
-        :param w:
-        :param h:
-        :param tile:
-        :type tile: WallTilesOptions
-        :param options:
-        """
-        super(Wall, self).__init__()
 
-        # Validation
+def draw_outline(canvas, points, start_pos, size):
+    """Clears the plan out of the outline of the room and draws the outline.
+    :param points: result of plan_points().
+    :type size: Size
+    """
+    sp = start_pos
+    mask = Image.new('1', (size.width, size.height), 1)
+    ImageDraw.Draw(mask).polygon(points, fill=0)
+    canvas.im.paste((255, 255, 255, 255), (sp.x, sp.y, sp.x + size.width, sp.y + size.height), mask)
 
-        if 'door_width' in options and options['door_width'] is not None:
-            assert options['door_width'] <= w
-        if 'door_height' in options and options['door_height'] is not None:
-            assert options['door_height'] <= h
+    d = canvas.get_draw()
+    d.line([(sp.x + x, sp.y + y) for x, y in points + points[:1]], fill=color_cutted, width=1)
 
-        if w <= 0:
-            raise Exception("w: invalid value")
-        if h <= 0:
-            raise Exception("h: invalid value")
 
-        # -----------------
+def draw_obstacles(canvas, polygons, start_pos, size):
+    """Clears the plan under the obstacles and draws their sides, like doors of walls.
+    :param polygons: list of results of plan_points().
+    :type size: Size
+    """
+    sp = start_pos
+    mask = Image.new('1', (size.width, size.height), 0)
+    md = ImageDraw.Draw(mask)
+    for points in polygons:
+        md.polygon(points, fill=1)
+    canvas.im.paste((255, 255, 255, 255), (sp.x, sp.y, sp.x + size.width, sp.y + size.height), mask)
 
-        self.height = h
-        self.width = w
+    d = canvas.get_draw()
+    for points in polygons:
+        d.line([(sp.x + x, sp.y + y) for x, y in points + points[:1]], fill=color_cutted, width=1)
 
-        self._tile_opt = tile
-        d = self._tile_opt.delimiter
-        tw = self._tile_opt.width
-        twd = tw+d  # длина плитки с последующим! разделителем
-        th = self._tile_opt.height
-        # thd = th+d
-        tsx = (self._tile_opt.start_x or 0)
-        clear_width = self.width - (tsx + d)
 
-        self._tile_opt.max_x = None
-        ceil_num = ceil(clear_width/twd)
+class Wall(Object):
+    def __init__(self, layout, x_from, x_to, options=None):
+        """Part of the unrolled walls layout.
+        :param layout:
+        :type layout: Layout
+        :param x_from: start of the wall (mm)
+        :param x_to: end of the wall (mm)
+        :param options:
+        """
+        super(Wall, self).__init__()
 
-        if ceil_num * twd > clear_width:
-            self._tile_opt.max_x = tw - ((ceil_num * twd) - clear_width)
+        if x_to - x_from <= 0:
+            raise Exception("w: invalid value")
+        if layout.height <= 0:
+            raise Exception("h: invalid value")
 
-        self._tile_opt.max_y = None
+        self._layout = layout
+        self.x_from = x_from
+        self.x_to = x_to
+        self.width = x_to - x_from
+        self.height = layout.height
 
         self._opt = (options or {})
 
-    def get_tile_options(self):
-        return self._tile_opt
-
     def get_size(self):
         return Size(self.width, self.height)
 
-    def draw(self, canvas, start_pos, y_direction=-1):
+    @timed('wall')
+    def draw(self, canvas, start_pos):
         """
         :param canvas:
         :type canvas: Canvas
         :param start_pos:
         :type start_pos: Position
-        :param y_direction:  1-сверху вниз/-1-снизу вверх
         :return:
         """
         d = canvas.get_draw()
@@ -344,135 +379,8 @@ class Wall(Object):
                length = int(self._opt['contour_out']['length'])
             self.draw_contour_out(canvas, start_pos, length)  # TODO: away from here...
 
-        # Рисуем плитки
-        tile_wpix = canvas.to_pixels(self._tile_opt.width)
-        tile_hpix = canvas.to_pixels(self._tile_opt.height)
-        tile_dpix = canvas.to_pixels(self._tile_opt.delimiter) or 1
-
-        tile = Tile(self._tile_opt.width, self._tile_opt.height)
-
-        local = Position()
-        first_x = True
-        first_y = True
-        tiles_count = 0
-
-        is_door_draw = 'door_width' in self._opt and 'door_height' in self._opt \
-                       and self._opt['door_width'] is not None and self._opt['door_height'] is not None
-        center = Position(sp.x + wpix / 2, sp.y + hpix / 2)  # цетр стены с учетом началного положения
-
-        if is_door_draw:
-            door_size = Size(
-                canvas.to_pixels(self._opt['door_width']),
-                canvas.to_pixels(self._opt['door_height'])
-            )
-            door_pos = Position(center.x - (door_size.width/2), sp.y + hpix - door_size.height)
-
-        while True:
-            local.y += tile_dpix  # ряд начинается с разделителя
-
-            start_y = None
-            max_y = None
-
-            if local.y + tile_hpix > hpix - tile_dpix:  # целая плитка не входит
-                if y_direction == 1:  # подрезка снизу
-                    max_y = (hpix - tile_dpix) - local.y
-                elif y_direction == -1:  # подрезка сверху
-                    start_y = (local.y + tile_hpix) - (hpix - tile_dpix)
-                else:
-                    raise Exception("invalid y_direction")
-
-            while True:
-                local.x += tile_dpix  # ряд начинается с разделителя
-
-                start_x = None
-                max_x = None
-
-                # если в настройках стены есть сдвиги добавляем их первому ряду плиток
-                if self._tile_opt.start_x and first_x:
-                    start_x = canvas.to_pixels(self._tile_opt.start_x)
-                if self._tile_opt.start_y and first_y:
-                    start_y = canvas.to_pixels(self._tile_opt.start_y)
-
-                tmp = (local.x + tile_wpix + tile_dpix)-wpix
-                if tmp > 0:
-                    max_x = tile_wpix - ((local.x + tile_wpix + tile_dpix) - wpix)
-
-                tile.start_x = start_x
-                tile.start_y = start_y
-                tile.max_x = max_x
-                tile.max_y = max_y
-
-                if y_direction == 1:
-                    pos = Position(
-                        sp.x + local.x,
-                        sp.y + local.y
-                    )
-                elif y_direction == -1:
-                    pos = Position(
-                        sp.x + local.x,
-                        sp.y + hpix - (local.y + tile_hpix)
-                    )
-                else:
-                    raise Exception("invalid y_direction")
-
-                tile_pos = PositionalObject(tile, pos)
-                if not is_door_draw or not tile_pos.is_in_area(door_pos, door_size, canvas):
-                    tile_pos.draw(canvas)
-
-                if tile.start_x is None:  # если плитка не подрезка с предыдущей стены
-                    tiles_count += 1
-
-                if max_x is not None and max_x > 0:
-                    local.x += tile_dpix
-                    local.x += max_x - (start_x or 0)
-                    self._tile_opt.max_x = max_x / canvas._scale_factor  # запомним подрезку последней плитки
-                else:
-                    local.x += tile_wpix - (start_x or 0)
-
-                # if tile_dpix > 2:
-                #     x += tile_dpix-2
-                if local.x >= wpix:
-                    break
-
-                first_x = False
-
-            # ---------
-            local.x = 0
-            first_x = True
-
-            if start_y is not None:
-                local.y += tile_hpix  # -start_y
-            else:
-                local.y += tile_hpix
-
-            if local.y >= hpix:
-                break
-
-        # Draw the door
-        if 'door_width' in self._opt and 'door_height' in self._opt \
-                and self._opt['door_width'] is not None and self._opt['door_height'] is not None:
-            door_width_half_px = canvas.to_pixels(self._opt['door_width'])/2
-            door_height_px = canvas.to_pixels(self._opt['door_height'])
-
-            # Рисование двери заливкой
-            # draw = canvas.get_draw()
-            d.polygon([
-                (center.x-door_width_half_px, sp.y+hpix),
-                (center.x-door_width_half_px, sp.y+hpix-door_height_px),
-                (center.x+door_width_half_px, sp.y+hpix-door_height_px),
-                (center.x+door_width_half_px, sp.y+hpix),
-            ], fill="#fff")
-
-            # Рисование двери линиями
-            self._draw_line(d, center.x - door_width_half_px, sp.y + hpix,
-                            center.x - door_width_half_px, sp.y + hpix - door_height_px, color=color_cutted)
-            self._draw_line(d, center.x + door_width_half_px, sp.y + hpix,
-                            center.x + door_width_half_px, sp.y + hpix - door_height_px, color=color_cutted)
-            self._draw_line(d, center.x - door_width_half_px, sp.y + hpix - door_height_px,
-                            center.x + door_width_half_px, sp.y + hpix - door_height_px, color=color_cutted)
-
-        # TODO: other objects ...
-
+        # Рисуем плитки и двери
+        draw_layout_tiles(canvas, self._layout, sp, self.x_from, self.x_to)
 
         bound_box_in_canvas = (
             sp.x,  # start X
@@ -480,7 +388,6 @@ class Wall(Object):
             wpix,  # width
             hpix,  # height
         )
-        print("tiles count=%d" % tiles_count)
 
         return bound_box_in_canvas
 
@@ -503,6 +410,47 @@ class Wall(Object):
         self._draw_line(d, sp.x + wpix, sp.y + hpix, sp.x + wpix, sp.y + hpix + length)
 
 
+class Floor(Object):
+    def __init__(self, layout):
+        """
+        :param layout: floor layout, X=length, Y=width
+        :type layout: Layout
+        """
+        super(Floor, self).__init__()
+        self._layout = layout
+        self.width = layout.width
+        self.height = layout.height
+
+    def get_size(self):
+        return Size(self.width, self.height)
+
+    @timed('floor')
+    def draw(self, canvas, start_pos):
+        d = canvas.get_draw()
+        wpix = canvas.to_pixels(self.width)
+        hpix = canvas.to_pixels(self.height)
+        sp = start_pos
+
+        draw_layout_tiles(canvas, self._layout, sp, 0, self.width)
+
+        size = Size(wpix, hpix)
+        if self._layout.outline is not None:
+            draw_outline(canvas, plan_points(self._layout.outline.vertices, canvas.to_pixels, size), sp, size)
+        else:
+            # рисуем периметр
+            self._draw_line(d, sp.x, sp.y, sp.x + wpix - 1, sp.y, color=color_cutted)
+            self._draw_line(d, sp.x, sp.y + hpix - 1, sp.x + wpix - 1, sp.y + hpix - 1, color=color_cutted)
+            self._draw_line(d, sp.x, sp.y, sp.x, sp.y + hpix - 1, color=color_cutted)
+            self._draw_line(d, sp.x + wpix - 1, sp.y, sp.x + wpix - 1, sp.y + hpix - 1, color=color_cutted)
+
+        if self._layout.obstacles is not None:
+            draw_obstacles(canvas, [
+                plan_points(p.vertices, canvas.to_pixels, size) for p in self._layout.obstacles.polygons
+            ], sp, size)
+
+    def draw_contour_out(self, canvas, start_pos, length): pass
+
+
 class PositionalObject:
     def __init__(self, obj, pos):
         """
@@ -549,201 +497,90 @@ class Draw:
             obj.draw(canvas)
 
     def draw_wm(self, canvas):
-        image = canvas.im
-        text = DRAWING_WATERMARK_TEXT
-
-        watermark = Image.new('RGBA', size=image.size, color=0)
-        # watermark = Image.new('RGBA', size=(image.width, 64), color=0)
-        draw = ImageDraw.Draw(watermark)
-        font = get_font(60)
-        tw = None
-        th = None
-        while True:
-            tw, th = draw.textsize(text, font=font)
-            if tw + 10 < image.size[0] and th + 10 < image.size[1]:
-                break
-            font = get_font(font.size - 2)
-
-        draw.text(
-            (image.width / 2 - tw / 2, image.height / 2 - th / 2),
-            text,
-            fill=(0, 0, 0, 128),
-            font=font
-        )
+        with stage('watermark'):
+            canvas.im = apply_watermark(canvas.im, DRAWING_WATERMARK_TEXT, DRAWING_WATERMARK_FONT)
 
-        # image.paste(watermark, box=(0, 15), mask=watermark)
-        canvas.im = Image.alpha_composite(image, watermark)
 
+FLOOR_MAX_SIZE_PX = 1000
 
-def draw_bathroom(l, w, h, d, tw, th, door_size=None):
-    """ Возможно следует добавить расчет "максимум целых плиток"
-    :param l:
-    :param w:
-    :param h:
-    :param d:
-    :param tw:
-    :param th:
-    :return:
+
+def floor_scale(layout):
+    """Scale factor of the floor plan: 1px for 10mm or less, not more than 1000px by a side.
+    :type layout: Layout
+    :return: (scale factor, Size of canvas in px)
     """
-    draw = Draw()
+    # с целой части отношения, а не с 10: у огромных помещений миллионы шагов
+    scale = max(10, int(max(layout.width, layout.height) // FLOOR_MAX_SIZE_PX))
+    while any(s / scale > FLOOR_MAX_SIZE_PX for s in (layout.width, layout.height)):
+        scale += 1
+    sf = 1.0 / scale
+
+    return sf, Size(int(layout.width * sf), int(layout.height * sf))
+
+
+WALLS_WIDTH_PX = 1280
+WALLS_HEIGHT_PX = 720
+
 
-    WIDTH_HD = 1280
-    HEIGHT_HD = 720
+def walls_frame(layout):
+    """Placement of the unrolled walls on the canvas.
+    :type layout: Layout
+    :return: (scale factor, list of (x_from, x_to) of walls, start Position,
+              distance between walls (px), length of outer contour (px), padding (px))
+    """
+    edges = [0] + layout.seams + [layout.width]
+    walls = list(zip(edges, edges[1:]))
+    l = walls[0][1] - walls[0][0]
 
     contour_length = l/100.0 * 3.0  # 3%
-    wall_del_px = contour_length * 3  # расстояние между краями схем стен
-    padding_px = l/100.0 * 8.0
+    wall_del = contour_length * 3  # расстояние между краями схем стен
+    padding = l/100.0 * 8.0
 
     # найдем ожидаемые размеры (в мм) которые может занять схема
     max_size = Size(
-        width=((w+l)*2) + (wall_del_px * 3) + (padding_px * 2),
-        height=h + (contour_length*2)
+        width=layout.width + (wall_del * 3) + (padding * 2),
+        height=layout.height + (contour_length*2)
     )
+    sf = fit_scale_factor(WALLS_WIDTH_PX, WALLS_HEIGHT_PX, max_size)
 
-    print(max_size)
+    def to_pixels(value):
+        return int(sf * value)
 
-    canvas = Canvas(
-        WIDTH_HD, HEIGHT_HD,
-        max_size=max_size
+    start_pos = Position(
+        to_pixels(padding),
+        WALLS_HEIGHT_PX/2 - to_pixels(max_size.height)/2
     )
 
+    return sf, walls, start_pos, to_pixels(wall_del), to_pixels(contour_length), to_pixels(padding)
+
+
+def draw_bathroom(layout):
+    """ Возможно следует добавить расчет "максимум целых плиток"
+    :param layout: layout of the unrolled walls.
+    :type layout: Layout
+    :return: Canvas
+    """
+    draw = Draw()
+
+    sf, walls, draw_offset, wall_del_px, contour_px, padding_px = walls_frame(layout)
+    canvas = Canvas(WALLS_WIDTH_PX, WALLS_HEIGHT_PX, scale_factor=sf)
+
     options = {
         'contour_out': {
-                'length': canvas.to_pixels(contour_length)
+                'length': contour_px
             }
     }
 
-    wall_del_px = canvas.to_pixels(wall_del_px)
-    # print("wall del px=", wall_del_px)
-    padding_px = canvas.to_pixels(padding_px)
-    # print("padding px=", padding_px)
+    for x_from, x_to in walls:
+        wall = Wall(layout, x_from, x_to, options=options)
+        draw.draw(canvas, [PositionalObject(wall, Position(draw_offset.x, draw_offset.y))])
+        draw_offset.x += canvas.to_pixels(wall.width) + wall_del_px
 
-    draw_offset = Position(
-        # WIDTH_HD/2 - canvas.to_pixels(max_size.width)/2,
-        padding_px,
-        HEIGHT_HD/2 - canvas.to_pixels(max_size.height)/2
-    )
-
-    # print(canvas.to_pixels(max_size.width) + padding_px)
-
-    wall = Wall(l, h, tile=WallTilesOptions(tw, th, d, sx=None), options=options)
-    draw.draw(canvas, [PositionalObject(wall, draw_offset)])
-    wo = wall.get_tile_options()
-    # print("Wall#1:\n\tsx={} sy={} mx={} my={}".format(wo.start_x, wo.start_y, wo.max_x, wo.max_y))
-
-    tile_start_from_x = wall.get_tile_options().max_x
-    draw_offset.x += canvas.to_pixels(wall.width) + wall_del_px
-    wall = Wall(w, h, tile=WallTilesOptions(tw, th, d, sx=tile_start_from_x), options=options)
-    draw.draw(canvas, [PositionalObject(wall, draw_offset)])
-    wo = wall.get_tile_options()
-    # print("Wall#2:\n\tsx={} sy={} mx={} my={}".format(wo.start_x, wo.start_y, wo.max_x, wo.max_y))
-
-    tile_start_from_x = wall.get_tile_options().max_x
-    draw_offset.x += canvas.to_pixels(wall.width) + wall_del_px
-    if door_size is not None:
-        options['door_width'] = door_size.width
-        options['door_height'] = door_size.height
-    wall = Wall(l, h, tile=WallTilesOptions(tw, th, d, sx=tile_start_from_x), options=options)
-    draw.draw(canvas, [PositionalObject(wall, draw_offset)])
-    wo = wall.get_tile_options()
-    # print("Wall#3:\n\tsx={} sy={} mx={} my={}".format(wo.start_x, wo.start_y, wo.max_x, wo.max_y))
-
-    tile_start_from_x = wall.get_tile_options().max_x
-    draw_offset.x += canvas.to_pixels(wall.width) + wall_del_px
-    options['door_width'] = None
-    options['door_height'] = None
-    wall = Wall(w, h, tile=WallTilesOptions(tw, th, d, sx=tile_start_from_x), options=options)
-    draw.draw(canvas, [PositionalObject(wall, draw_offset)])
-    wo = wall.get_tile_options()
-    # print("Wall#4:\n\tsx={} sy={} mx={} my={}".format(wo.start_x, wo.start_y, wo.max_x, wo.max_y))
-
-    # FIXME: little hack!!!
-    real_width = draw_offset.x + canvas.to_pixels(wall.width) + padding_px
-    if real_width < max_size.width:
-        canvas.im = canvas.im.crop((0, 0, real_width, HEIGHT_HD))
-    canvas.im.resize((WIDTH_HD, HEIGHT_HD))
-
-    # print(real_width)
+    real_width = draw_offset.x - wall_del_px + padding_px
+    if real_width < WALLS_WIDTH_PX:
+        canvas.im = canvas.im.crop((0, 0, real_width, WALLS_HEIGHT_PX))
 
     draw.draw_wm(canvas)
 
     return canvas
 
-
-def main():
-    d = 1.5
-    l = 3950
-    w = 2460
-    h = 2450
-    tw = 400
-    th = 280
-
-    canvas = draw_bathroom(l, w, h, d, tw, th, Size(600, 2100))
-
-    canvas.save_to_file("/home/zeez/tmp/wall.png")
-
-    return 0
-
-
-def test():
-    d = 1.5
-    l = 3950
-    w_start = 5000
-    l_start = 5000
-    h_start = 5000
-
-    w_min = 50
-    l_min = 50
-    h_min = 50
-
-    tw_start = 400
-    th_start = 280
-    tw_min = 50
-    th_min = 50
-
-    save_path = "/home/zeez/tmp/test/"
-    if not os.path.exists(save_path):
-        os.system("mkdir -p %s" % save_path)
-    else:
-        os.system("rm {}/*".format(save_path))
-
-    import random
-
-    l = l_start
-    w = w_start
-    h = h_start
-    tw = tw_start
-    th = th_start
-
-    while l >= l_min:
-        while w >= w_min:
-            while h >= h_min:
-                while tw >= tw_min:
-                    while th >= th_min:
-                        print("Start calc for l={},w={},h={},d={},tw={},th={} ...".format(l, w, h, d, tw, th))
-                        canvas = draw_bathroom(l, w, h, d, tw, th)
-                        print("\tOK")
-                        filename = "{l}-{w}-{h}_{d}_{tw}-{th}".format(l=l, w=w, h=h, d=d, tw=tw, th=th)
-                        #print("Save to file {} ...".format(os.path.join(save_path, filename)))
-                        #canvas.save_to_file(os.path.join(save_path, filename))
-                        #print("\tSaved")
-
-                        th -= random.randint(10, 100)
-
-                    tw -= random.randint(10, 100)
-                    th = th_start
-
-                h -= random.randint(50, 200)
-                tw = tw_start
-
-            w -= random.randint(50, 200)
-            h = h_start
-
-        l -= random.randint(50, 200)
-        w = w_start
-
-    return 0
-
-if __name__ == "__main__":
-    # test()
-    main()
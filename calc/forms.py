@@ -1,13 +1,18 @@
 from django import forms
-from math import sqrt, ceil, floor
-from django.conf import settings
+from math import ceil
 from django.utils.translation import ugettext_lazy as _
 from django.forms.utils import ErrorList
-import os
 
 from .algorithms import check_with_delimiters, \
     LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL, \
-    draw_floor, save_image, calc_cost, draw_walls
+    calc_cost, draw_walls
+from .jobs import submit_render, RenderQueueFull
+from .layout import LayoutError, Outline, Obstacles, door_rect, opening_rects, OUTLINE_MAX_VERTICES, OBSTACLES_MAX, OPENINGS_MAX
+from .offcuts import plan_offcuts
+from .render_cache import get_layout, floor_params, walls_params, plan_url, \
+    parse_vertices, format_vertices, parse_obstacles, format_obstacles, parse_openings, format_openings, \
+    IMAGE_FORMAT_PNG, IMAGE_FORMAT_SVG
+from .timing import stage
 
 
 LAYING_METHODS = (
@@ -16,6 +21,17 @@ LAYING_METHODS = (
     (LAYING_METHOD_DIAGONAL, _("Диагональный"))
 )
 
+IMAGE_FORMATS = (
+    (IMAGE_FORMAT_PNG, _("Картинка (PNG)")),
+    (IMAGE_FORMAT_SVG, _("Векторная (SVG)")),
+)
+
+
+def validate_positive(value):
+    # у помещения нулевого размера нет ни плиток, ни схемы
+    if value is not None and value <= 0:
+        raise forms.ValidationError(_("Значение должно быть больше нуля"))
+
 
 class CalcForm(forms.Form):
     """
@@ -24,8 +40,10 @@ class CalcForm(forms.Form):
     :key tile_width: Width of the one tile (mm).
     :key tile_length: Length of the one tile (mm).
     """
-    length = forms.FloatField(min_value=0.0, max_value=1000000.0, required=True, label=_("Длина помещения (m)"))
-    width = forms.FloatField(min_value=0.0, max_value=1000000.0, required=True, label=_("Ширина помещения (m)"))
+    length = forms.FloatField(min_value=0.0, max_value=1000000.0, required=True, validators=[validate_positive],
+                              label=_("Длина помещения (m)"))
+    width = forms.FloatField(min_value=0.0, max_value=1000000.0, required=True, validators=[validate_positive],
+                             label=_("Ширина помещения (m)"))
 
     tile_length = forms.IntegerField(min_value=1, max_value=10000, required=True, label=_("Длина плитки (mm)"))
     tile_width = forms.IntegerField(min_value=1, max_value=10000, required=True, label=_("Ширина плитки (mm)"))
@@ -38,65 +56,16 @@ class CalcForm(forms.Form):
 
     reserve = forms.FloatField(min_value=0.0, max_value=100.0, label=_("Запас (%)"))
 
-    @staticmethod
-    def _calc_direct(w, l, tw, tl, dl):  # TODO: move in to algorithms; Use direction of start.
-        # NOTE: между первой плиткой и стенкой разделитель (w-dl)
-        width_cnt = ceil((w-dl) / (tw+dl))
-        length_cnt = ceil((l-dl) / (tl+dl))
+    image_format = forms.ChoiceField(IMAGE_FORMATS, required=False, initial=IMAGE_FORMAT_PNG,
+                                     label=_("Формат схемы"))
 
-        return int(width_cnt * length_cnt)
+    # clean() computes the layout for calc() and drawing,
+    # rooms counted by the vectorized kernels (quote --counts) don't need it
+    with_layout = True
 
-    @staticmethod
-    def _calc_direct_center(w, l, tw, tl, dl):  # TODO: move in to algorithms
-        twd = tw + dl
-        tld = tl + dl
-
-        half_w = (w/2) - (tw/2 + dl)
-        half_l = (l/2) - (tl/2 + dl)
-
-        cnt_w = ceil(half_w/twd) * 2 + 1
-        cnt_l = ceil(half_l/tld) * 2 + 1
-
-        return int(cnt_w * cnt_l)
-
-    @staticmethod
-    def _calc_diagonal(w, l, tw, tl, dl):  # TODO: move in to algorithms
-        """
-        :param w:
-        :param l:
-        :param tw:
-        :param tl:
-        :param dl: delimiter size (mm).
-        :return:
-
-        d: diagonal of tile (mm).
-        """
-        if tw == tl:
-            d = sqrt(2) * tw
-        else:
-            # d = sqrt(tl**2 + tw**2)
-            raise Exception(_("Не поддерживается"))
-
-        d05 = d / 2
-        dd = sqrt(2) * dl  # delimiter diagonal
-        d3 = d + dd  # tile diagonal + delimiter
-
-        half_w = (w/2) - (d05+dd)
-        half_l = (l/2) - (d05+dd)
-
-        # количество плиток в ширину по центральному ряду (нечетные ряды)
-        width_cnt = ceil(half_w/d3) * 2 + 1
-
-        # количество плиток в ширину по четным рядам
-        width_even_cnt = ceil(((w/2)-(dd/2)) / d3) * 2
-
-        # количество плиток в длину по центральному ряду (нечетные ряды)
-        length_cnt = ceil(half_l/d3) * 2 + 1
-
-        # количество плиток в длину по четным рядам
-        length_even_cnt = ceil(((l/2) - (dd/2)) / d3) * 2
-
-        return int((width_cnt * length_cnt) + (width_even_cnt * length_even_cnt))
+    def full_clean(self):
+        with stage('validate'):
+            super(CalcForm, self).full_clean()
 
     def get_data(self):
         return {
@@ -111,49 +80,235 @@ class CalcForm(forms.Form):
             'reserve': self.cleaned_data['reserve'],
         }
 
-    def calc(self):
+    def get_render_params(self):
+        """Normalized parameters of the plan (mm).
+        :rtype: dict
+        """
         raise NotImplementedError
 
+    def clean_layout(self):
+        """Computes the layout of tiles once, calc() and drawing use it."""
+        if self._errors:
+            return
+
+        self.render_params = self.get_render_params()
+        if not self.with_layout:
+            return
+        try:
+            with stage('layout'):
+                self.layout = get_layout(self.render_kind, self.render_params)
+        except LayoutError:
+            raise forms.ValidationError(_("Слишком много плиток для расчета"))
+
+    def render_plan(self):
+        """Puts drawing of the plan into the queue of jobs.
+        Sets plan_filename - name of the image file for render_status().
+        :return: url of the image (it may be not ready yet) or None if the queue is full.
+        """
+        image_format = self.cleaned_data['image_format'] or IMAGE_FORMAT_PNG
+        try:
+            with stage('render'):
+                self.plan_filename, _ready = submit_render(
+                    self.render_kind, self.render_params, self.layout, image_format=image_format
+                )
+        except RenderQueueFull:
+            return None
+        return plan_url(self.render_kind, self.render_params, image_format)
+
+    @classmethod
+    def plan_url_from_data(cls, data):
+        """URL of the plan of a saved calculation (Result.data), it is drawn again if needed.
+        :return: url or None if the data is not valid any more.
+        """
+        form = cls(data)
+        if not form.is_valid():
+            return None
+        return plan_url(form.render_kind, form.render_params, form.cleaned_data['image_format'] or IMAGE_FORMAT_PNG)
+
+    @classmethod
+    def from_render_params(cls, params):
+        """Form of the parameters of a plan, so a plan requested by its URL
+        is checked by the same rules as the input of the calculator.
+        :param params: result of get_render_params()
+        """
+        data = {name: params[name] / 1000.0 for name in ('length', 'width')}
+        data.update({name: params[name] for name in ('tile_length', 'tile_width', 'delimiter')})
+        data['reserve'] = 0.0
+        data.update(cls._render_data(params))
+        return cls(data)
+
+    @staticmethod
+    def _render_data(params):
+        """Fields of the form of the kind from its parameters of the plan."""
+        raise NotImplementedError
+
+    def calc(self, render=True):
+        """
+        :param render: draw the plan of tiles.
+        :return: (result, cost, img_url, reserve, total_area, cut, plan)
+        """
+        raise NotImplementedError
+
+    def results(self, render=True):
+        """Results of calc() by names, as they are shown and saved.
+        :param render: draw the plan of tiles.
+        :rtype: dict
+        """
+        result, cost, image, reserve, total_area, cut, plan = self.calc(render=render)
+        return {
+            'result': result, 'cost': cost, 'draw': image, 'reserve': reserve, 'total_area': total_area,
+            'total': result + reserve, 'cut': cut, 'buy': plan.tiles, 'waste_area': round(plan.waste_area, 2)
+        }
+
 
 class CalcFloorForm(CalcForm):
     method = forms.ChoiceField(LAYING_METHODS, required=True, label="Способ укладки")
+
+    outline = forms.CharField(
+        max_length=20000, required=False,
+        label=_("Контур помещения (mm)"),
+        help_text=_("Углы помещения по порядку, если оно не прямоугольное: x,y; x,y; ..."),
+        widget=forms.TextInput(attrs={'placeholder': "0,0; 4000,0; 4000,2000; 2000,2000; 2000,3000; 0,3000"})
+    )
+
+    obstacles = forms.CharField(
+        max_length=100000, required=False,
+        label=_("Препятствия (mm)"),
+        help_text=_("Шкафы, ванны, колонны - по одному в строке: углы x,y; x,y; ... "
+                    "или два противоположных угла прямоугольника"),
+        widget=forms.Textarea(attrs={'rows': 3, 'placeholder': "0,0; 600,1700\n3000,1000; 3300,1300"})
+    )
+
+    render_kind = 'floor'
     # TODO: start_method - 1. from center, 2. from angle
 
     field_order = [
-        'length', 'width', 'height',
+        'length', 'width', 'outline', 'obstacles', 'height',
         'tile_length', 'tile_width', 'delimiter',
         'method',
         'price',
         'reserve',
+        'image_format',
     ]
 
+    def __init__(self, *args, **kw):
+        super(CalcFloorForm, self).__init__(*args, **kw)
+        # размеры задаются контуром, если он указан
+        self.fields['length'].required = False
+        self.fields['width'].required = False
+
+    def clean_outline(self):
+        data = self.cleaned_data['outline']
+        if not data:
+            return None
+        try:
+            vertices = parse_vertices(data)
+        except ValueError:
+            raise forms.ValidationError(_("Укажите углы помещения в виде: x,y; x,y; ..."))
+        if len(vertices) > OUTLINE_MAX_VERTICES:
+            raise forms.ValidationError(_("Слишком много углов помещения"))
+        try:
+            Outline(vertices)
+        except LayoutError:
+            raise forms.ValidationError(_("Углы помещения не образуют многоугольник"))
+        return vertices
+
+    def clean_obstacles(self):
+        data = self.cleaned_data['obstacles']
+        if not data:
+            return None
+        try:
+            polygons = parse_obstacles(data)
+        except ValueError:
+            raise forms.ValidationError(_("Укажите углы препятствий в виде: x,y; x,y; ..."))
+        if len(polygons) > OBSTACLES_MAX or any(len(p) > OUTLINE_MAX_VERTICES for p in polygons):
+            raise forms.ValidationError(_("Слишком много препятствий"))
+        try:
+            for vertices in polygons:
+                Outline(vertices)
+        except LayoutError:
+            raise forms.ValidationError(_("Углы препятствия не образуют многоугольник"))
+        return polygons or None
+
+    def check_obstacles(self, cleaned_data):
+        """Obstacles are inside the room and don't overlap each other.
+        :return: error message or None.
+        """
+        obstacles = cleaned_data.get('obstacles')
+        length, width = cleaned_data.get('length'), cleaned_data.get('width')
+        if not obstacles or None in (length, width):
+            return None
+
+        # без контура помещение - прямоугольник от (0, 0), X - по длине
+        length, width = length * 1000.0, width * 1000.0
+        room = Outline(cleaned_data.get('outline') or [(0, 0), (length, 0), (length, width), (0, width)])
+        obstacles = Obstacles(obstacles, length, width)
+
+        outside = obstacles.outside(room)
+        if outside:
+            return _("Препятствие {} выходит за пределы помещения").format(outside[0] + 1)
+        overlapping = obstacles.overlapping()
+        if overlapping:
+            return _("Препятствия {} и {} пересекаются").format(*(n + 1 for n in overlapping[0]))
+        return None
+
     def clean(self):
         cleaned_data = super(CalcFloorForm, self).clean()
-        method = int(cleaned_data.get('method'))
+
+        outline = cleaned_data.get('outline')
+        if outline:
+            # размеры прямоугольника, в который вписан контур
+            xs, ys = [x for x, _y in outline], [y for _x, y in outline]
+            cleaned_data['length'] = (max(xs) - min(xs)) / 1000.0
+            cleaned_data['width'] = (max(ys) - min(ys)) / 1000.0
+        elif 'outline' in cleaned_data:
+            for name in ('length', 'width'):
+                if cleaned_data.get(name) is None and name not in self._errors:
+                    self._errors[name] = ErrorList([self.fields[name].error_messages['required']])
+
+        method = cleaned_data.get('method')
         tile_width = cleaned_data.get('tile_width')
         tile_length = cleaned_data.get('tile_length')
 
-        if method == LAYING_METHOD_DIAGONAL and not tile_width == tile_length:
+        if method is not None and int(method) == LAYING_METHOD_DIAGONAL and not tile_width == tile_length:
             raise forms.ValidationError("Рассчет 'Диагонального' метода только для квадратных плиток!")
 
-    def calc(self):
-        width_mm = self.cleaned_data['width'] * 1000.0
-        length_mm = self.cleaned_data['length'] * 1000.0
-        method = int(self.cleaned_data['method'])
-        tile_width = self.cleaned_data['tile_width']
-        tile_length = self.cleaned_data['tile_length']
-        delimiter = self.cleaned_data['delimiter']
+        error = self.check_obstacles(cleaned_data)
+        if error:
+            self._errors["obstacles"] = ErrorList([error])
+
+        self.clean_layout()
+
+    def get_render_params(self):
+        return floor_params(
+            self.cleaned_data['width'] * 1000.0,
+            self.cleaned_data['length'] * 1000.0,
+            self.cleaned_data['tile_width'],
+            self.cleaned_data['tile_length'],
+            self.cleaned_data['delimiter'],
+            self.cleaned_data['method'],
+            self.cleaned_data['outline'],
+            self.cleaned_data['obstacles']
+        )
+
+    @staticmethod
+    def _render_data(params):
+        return {
+            'method': params['method'],
+            'outline': format_vertices(params['outline']) if params['outline'] else None,
+            'obstacles': format_obstacles(params['obstacles']) if params['obstacles'] else None,
+        }
+
+    def calc(self, render=True):
         price = self.cleaned_data['price']
         reserve_percent = self.cleaned_data['reserve']
 
-        if method == LAYING_METHOD_DIRECT:
-            result = self._calc_direct(width_mm, length_mm, tile_width, tile_length, delimiter)
-        elif method == LAYING_METHOD_DIRECT_CENTER:
-            result = self._calc_direct_center(width_mm, length_mm, tile_width, tile_length, delimiter)
-        elif method == LAYING_METHOD_DIAGONAL:
-            result = self._calc_diagonal(width_mm, length_mm, tile_width, tile_length, delimiter)
-        else:
-            raise Exception("Unsupported method {}".format(method))
+        # количество плиток и подрезок по раскладке, которую будем рисовать
+        result = self.layout.count()
+        cut = self.layout.cut_count()
+        # сколько плиток купить, если обрезки использовать повторно
+        with stage('offcuts'):
+            plan = plan_offcuts(self.layout)
 
         reserve = ceil(result / 100.0 * reserve_percent)
 
@@ -161,23 +316,29 @@ class CalcFloorForm(CalcForm):
         if price:
             cost = calc_cost(result + reserve, price)
 
-        total_area = round((width_mm * length_mm)/10**6, 2)
+        # площадь контура, если помещение не прямоугольное, без препятствий
+        total_area = round(self.layout.area(), 2)
 
-        im = draw_floor(width_mm, length_mm, tile_width, tile_length, method)
-        filename = save_image(im, settings.MEDIA_ROOT)
-        img_url = os.path.join(settings.MEDIA_URL, filename)
+        img_url = self.render_plan() if render else None
 
-        return result, cost, img_url, reserve, total_area
+        return result, cost, img_url, reserve, total_area, cut, plan
 
     def get_data(self):
         data = super(CalcFloorForm, self).get_data()
-        data.update({'method': self.cleaned_data['method']})
+        outline = self.cleaned_data['outline']
+        obstacles = self.cleaned_data['obstacles']
+        data.update({
+            'method': self.cleaned_data['method'],
+            'outline': format_vertices(outline) if outline else None,
+            'obstacles': format_obstacles(obstacles) if obstacles else None,
+        })
         return data
 
 
 class CalcWallForm(CalcForm):
 
-    height = forms.FloatField(min_value=0.0, max_value=1000000.0, required=True, label=_("Высота помещения (m)"))
+    height = forms.FloatField(min_value=0.0, max_value=1000000.0, required=True, validators=[validate_positive],
+                              label=_("Высота помещения (m)"))
 
     door_width = forms.FloatField(
         max_value=10.0, min_value=0.0, required=False,
@@ -190,6 +351,15 @@ class CalcWallForm(CalcForm):
         widget=forms.NumberInput(attrs={'placeholder': _("Необязательно")})
     )
     # door_position = forms.FloatField(max_value=10.0, min_value=0.0, required=False, label="Положение двери (m)")
+    openings = forms.CharField(
+        max_length=10000, required=False,
+        label=_("Проемы (mm)"),
+        help_text=_("Двери, окна, ниши - по одному в строке: номер стены (1-4), отступ от начала стены, "
+                    "ширина, высота, высота от пола (для окон)"),
+        widget=forms.Textarea(attrs={'rows': 3, 'placeholder': "1, 500, 800, 2000\n2, 700, 1200, 1400, 900"})
+    )
+
+    render_kind = 'walls'
 
     field_order = [
         'length', 'width', 'height',
@@ -197,7 +367,9 @@ class CalcWallForm(CalcForm):
         'method',
         'price',
         'reserve',
-        'door_width', 'door_height'
+        'door_width', 'door_height',
+        'openings',
+        'image_format',
     ]
 
     def __init__(self, *args, **kw):
@@ -206,56 +378,120 @@ class CalcWallForm(CalcForm):
 
     def clean_door_height(self):
         data = self.cleaned_data['door_height']
-        if data is not None and data > self.cleaned_data['height']:
+        height = self.cleaned_data.get('height')
+        if data is not None and height is not None and data > height:
             raise forms.ValidationError(_("Высота двери не может быть больше высоты помещения"))
         return data
 
     def clean_door_width(self):
         data = self.cleaned_data['door_width']
-        if data is not None and data > min(self.cleaned_data['width'], self.cleaned_data['length']):
+        width, length = self.cleaned_data.get('width'), self.cleaned_data.get('length')
+        if data is not None and width is not None and length is not None and data > min(width, length):
             raise forms.ValidationError(_("Ширина двери не может быть больше стен помещения"))
         return data
 
+    def clean_openings(self):
+        data = self.cleaned_data['openings']
+        if not data:
+            return None
+        try:
+            openings = parse_openings(data)
+        except ValueError:
+            raise forms.ValidationError(_("Укажите проемы в виде: стена, отступ, ширина, высота, высота от пола"))
+        if len(openings) > OPENINGS_MAX:
+            raise forms.ValidationError(_("Слишком много проемов"))
+        return openings or None
+
+    def check_openings(self, cleaned_data):
+        """Openings are inside their walls and don't overlap each other and the door.
+        :return: error message or None.
+        """
+        length, width, height = (cleaned_data.get(name) for name in ('length', 'width', 'height'))
+        openings = cleaned_data.get('openings')
+        if not openings or None in (length, width, height):
+            return None
+        length, width, height = length * 1000.0, width * 1000.0, height * 1000.0
+
+        walls = (length, width, length, width)
+        for wall, offset, opening_width, opening_height, bottom in openings:
+            if opening_width <= 0 or opening_height <= 0:
+                return _("Укажите ширину и высоту проема на стене {}").format(wall + 1)
+            if offset + opening_width > walls[wall] or bottom + opening_height > height:
+                return _("Проем не помещается на стене {}").format(wall + 1)
+
+        rects = opening_rects(length, width, height, openings)
+        door_width, door_height = cleaned_data.get('door_width'), cleaned_data.get('door_height')
+        if door_width and door_height:
+            rects.append(door_rect(length, width, height, door_width * 1000.0, door_height * 1000.0))
+
+        rects.sort()
+        for n, (x0, y0, x1, y1) in enumerate(rects):
+            # отсортированы по X: пересечься могут только следующие, начатые до конца этого
+            for ox0, oy0, ox1, oy1 in rects[n + 1:]:
+                if ox0 >= x1:
+                    break
+                if oy0 < y1 and y0 < oy1:
+                    return _("Проемы не должны пересекаться")
+        return None
+
     def clean(self):
         cleaned_data = super(CalcWallForm, self).clean()
-        if cleaned_data['door_height'] is not None and cleaned_data['door_width'] is None:
+        if cleaned_data.get('door_height') is not None and cleaned_data.get('door_width') is None:
             self._errors["door_width"] = ErrorList([_("Укажите ширину двери")])
 
-        if cleaned_data['door_width'] is not None and cleaned_data['door_height'] is None:
+        if cleaned_data.get('door_width') is not None and cleaned_data.get('door_height') is None:
             self._errors["door_height"] = ErrorList([_("Укажите высоту двери")])
 
-        return cleaned_data
-
-    def calc(self):
-        width_mm = self.cleaned_data['width'] * 1000.0
-        length_mm = self.cleaned_data['length'] * 1000.0
-        height_mm = self.cleaned_data['height'] * 1000.0
+        error = self.check_openings(cleaned_data)
+        if error:
+            self._errors["openings"] = ErrorList([error])
 
-        # method = int(self.cleaned_data['method'])
+        self.clean_layout()
 
-        tile_width = self.cleaned_data['tile_width']
-        tile_length = self.cleaned_data['tile_length']
-        delimiter = self.cleaned_data['delimiter']
-        price = self.cleaned_data['price']
-        reserve_percent = self.cleaned_data['reserve']
+        return cleaned_data
 
+    def get_render_params(self):
         door_width_mm = self.cleaned_data['door_width']
         door_height_mm = self.cleaned_data['door_height']
         if door_width_mm is not None and door_height_mm is not None:
             door_width_mm *= 1000.0
             door_height_mm *= 1000.0
 
-        perimeter_mm = (width_mm + length_mm) * 2.0
+        return walls_params(
+            self.cleaned_data['length'] * 1000.0,
+            self.cleaned_data['width'] * 1000.0,
+            self.cleaned_data['height'] * 1000.0,
+            self.cleaned_data['tile_length'],
+            self.cleaned_data['tile_width'],
+            self.cleaned_data['delimiter'],
+            door_width_mm, door_height_mm,
+            self.cleaned_data['openings']
+        )
+
+    @staticmethod
+    def _render_data(params):
+        door_width, door_height = params['door_width'], params['door_height']
+        return {
+            'height': params['height'] / 1000.0,
+            'door_width': door_width / 1000.0 if door_width is not None else None,
+            'door_height': door_height / 1000.0 if door_height is not None else None,
+            'openings': format_openings(params['openings']) if params['openings'] else None,
+        }
+
+    def calc(self, render=True):
+        price = self.cleaned_data['price']
+        reserve_percent = self.cleaned_data['reserve']
+
         # NOTE: наверное не стоит добавлять ширину разделителя в длину периметра
         # т.к. будет расход на пил. С другой стороны если плитку не пилять
         # а режут (плиткорезом) то расхода нет.
 
-        # result = self._calc_direct(height_mm, perimeter_mm, tile_width, tile_length, delimiter)
-        result = self._calc_direct_with_door(
-            length_mm, width_mm, height_mm,
-            tile_length, tile_width, delimiter,
-            door_width_mm, door_height_mm
-        )
+        # количество плиток и подрезок по раскладке, которую будем рисовать
+        result = self.layout.count()
+        cut = self.layout.cut_count()
+        # сколько плиток купить, если обрезки использовать повторно
+        with stage('offcuts'):
+            plan = plan_offcuts(self.layout)
 
         reserve = ceil(result / 100.0 * reserve_percent)
 
@@ -263,44 +499,22 @@ class CalcWallForm(CalcForm):
         if price:
             cost = calc_cost(result + reserve, price)
 
-        total_area = round((((width_mm + length_mm) * 2) * height_mm) / 10**6, 2)
+        # площадь стен без двери и проемов
+        total_area = round(self.layout.area(), 2)
 
-        from .drawing import draw_bathroom, Canvas, Size
         # im = draw_walls(width_mm, length_mm, height_mm, tile_length, tile_width, door_width_mm, door_height_mm)
-        door_size = None
-        if door_width_mm is not None and door_height_mm is not None:
-            door_size = Size(door_width_mm, door_height_mm)
-        canvas = draw_bathroom(length_mm, width_mm, height_mm, delimiter, tile_length, tile_width, door_size)
-        filename = save_image(canvas.im, settings.MEDIA_ROOT)
-        img_url = os.path.join(settings.MEDIA_URL, filename)
-
-        return result, cost, img_url, reserve, total_area
+        img_url = self.render_plan() if render else None
 
-    @staticmethod
-    def _calc_direct_with_door(l, w, h, tw, th, dl, door_width=None, door_height=None):  # TODO: move in to algorithms; Use direction of start.
-        p = (l+w) * 2
-        # NOTE: между первой плиткой и стенкой разделитель (p-dl), (h-dl)
-        width_cnt = ceil((p-dl) / (tw+dl))
-        height_cnt = ceil((h-dl) / (th+dl))
-        tiles_in_door = 0
-
-        if door_width and door_height:
-            start_door_w = l + w + l/2 - door_width/2
-            start_tile_in_door_w = ceil(start_door_w/tw) * tw  # начало первой плитки внутри двери
-            tcnt_w = 0
-            while start_tile_in_door_w + ((tcnt_w+1) * tw) <= start_door_w + door_width:
-                tcnt_w += 1
-            if tcnt_w > 0:
-                tiles_in_door = int(tcnt_w * floor(door_height/th))
-
-        return int(width_cnt * height_cnt) - tiles_in_door
+        return result, cost, img_url, reserve, total_area, cut, plan
 
     def get_data(self):
         data = super(CalcWallForm, self).get_data()
+        openings = self.cleaned_data['openings']
         data.update({
             'height': self.cleaned_data['height'],
             'door_width': self.cleaned_data['door_width'],
-            'door_height': self.cleaned_data['door_height']
+            'door_height': self.cleaned_data['door_height'],
+            'openings': format_openings(openings) if openings else None,
         })
         return data
 
@@ -313,6 +527,10 @@ class CalcTileCostForm(forms.Form):
     price = forms.FloatField(min_value=0.0, max_value=100000.0,
                              required=True, label=_("Стоимость плитки (руб/m²)"))
 
+    def full_clean(self):
+        with stage('validate'):
+            super(CalcTileCostForm, self).full_clean()
+
     def calc(self):
         tile_area_m = self.cleaned_data['tile_length'] * self.cleaned_data['tile_width'] / 10**6
         return tile_area_m, round(tile_area_m * self.cleaned_data['price'], 2)
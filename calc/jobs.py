@@ -0,0 +1,169 @@
+"""Background rendering of plans.
+
+Request workers return the numbers right away and put the drawing of the
+plan into a local pool of processes, the page fetches the image when it is
+ready (see plan_status view).
+
+- depth of the queue is limited by RENDER_QUEUE_MAX per request worker,
+  a new job is rejected with RenderQueueFull when the queue is full;
+- the layout computed by the request is pickled with the job, the pool
+  process doesn't compute it again;
+- a job is identified by the file name of the plan (hash of parameters),
+  the same plan is rendered once: inside the process by the table of
+  pending jobs, between processes by a lock file next to the image.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from . import timing
+from .media import touch, start_eviction
+from .metrics import RENDER_CACHE
+from .render_cache import get_or_render, render_filename, IMAGE_FORMAT_PNG
+
+
+logger = logging.getLogger(__name__)
+
+STATUS_READY = 'ready'
+STATUS_PENDING = 'pending'
+STATUS_MISSING = 'missing'
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+_executor = None
+_executor_pid = None
+_pending = {}  # filename: Future
+_lock = threading.Lock()
+
+
+def _get_executor():
+    """Pool of the current process, a forked process makes its own one."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(max_workers=settings.RENDER_WORKERS)
+        _executor_pid = os.getpid()
+        _pending.clear()
+    return _executor
+
+
+def _lock_name(path, filename):
+    return os.path.join(path, filename + ".lock")
+
+
+def _is_stale(lockname):
+    """A lock of the job which has died with its process."""
+    try:
+        return time.time() - os.path.getmtime(lockname) > settings.RENDER_JOB_TIMEOUT
+    except OSError:
+        return False
+
+
+def _acquire(lockname):
+    """Create the lock file of the job.
+    :return: False if the job is being done by another process.
+    """
+    for _ in range(2):
+        try:
+            os.close(os.open(lockname, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            if not _is_stale(lockname):
+                return False
+            _release(lockname)
+    return False
+
+
+def _release(lockname):
+    try:
+        os.remove(lockname)
+    except OSError:
+        pass
+
+
+def _render(kind, params, image_format, path, layout=None):
+    """Job of the pool process.
+    :param layout: layout of the request, it's pickled with the job and not computed again.
+    """
+    if settings.SERVER_TIMING:
+        timing.start()
+    try:
+        return get_or_render(kind, params, layout, path, image_format)
+    finally:
+        _release(_lock_name(path, render_filename(kind, params, image_format)))
+        timing.finish('job')
+
+
+def _done(filename, future):
+    with _lock:
+        _pending.pop(filename, None)
+
+    exc = future.exception()
+    if exc is not None:
+        logger.error("Rendering of %s failed: %r", filename, exc)
+
+
+def submit_render(kind, params, layout=None, path=None, image_format=IMAGE_FORMAT_PNG):
+    """Start rendering of the plan if it's not drawn and not rendering yet.
+    Without RENDER_WORKERS the plan is drawn in the request.
+    :param kind: 'floor' or 'walls'
+    :param params: result of floor_params() or walls_params()
+    :param layout: layout of params if it's already computed.
+    :return: (file name of the image, is it ready)
+    :raises RenderQueueFull: too many jobs of this process.
+    """
+    path = path or settings.MEDIA_ROOT
+    filename = render_filename(kind, params, image_format)
+    start_eviction()
+
+    if os.path.exists(os.path.join(path, filename)):
+        RENDER_CACHE.inc(calc=kind, result='hit')
+        touch(path, filename)
+        return filename, True
+
+    if not settings.RENDER_WORKERS:
+        return get_or_render(kind, params, layout, path, image_format), True
+
+    lockname = _lock_name(path, filename)
+    with _lock:
+        executor = _get_executor()
+        if filename in _pending:
+            return filename, False
+        if len(_pending) >= settings.RENDER_QUEUE_MAX:
+            raise RenderQueueFull()
+        if not _acquire(lockname):
+            # рисует другой процесс
+            return filename, False
+
+        try:
+            future = executor.submit(_render, kind, params, image_format, path, layout)
+        except Exception:
+            _release(lockname)
+            raise
+        _pending[filename] = future
+
+    future.add_done_callback(lambda f: _done(filename, f))
+    return filename, False
+
+
+def render_status(filename, path=None):
+    """
+    :param filename: file name of the plan.
+    :return: one of STATUS_*
+    """
+    path = path or settings.MEDIA_ROOT
+
+    if os.path.exists(os.path.join(path, filename)):
+        return STATUS_READY
+
+    lockname = _lock_name(path, filename)
+    if os.path.exists(lockname) and not _is_stale(lockname):
+        return STATUS_PENDING
+
+    return STATUS_MISSING
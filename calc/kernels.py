@@ -0,0 +1,135 @@
+"""NumPy versions of the tile counting of rectangular rooms.
+
+Every function takes arrays (or scalars) of parameters, broadcasts them
+against each other and returns an int64 array of counts, so millions of
+rooms are counted without a Python loop. The reference is Layout.count()
+(calc/layout.py) of floor_layout() and walls_layout() without outlines,
+obstacles and openings: like the layout, the kernels don't round up a
+number of tiles which is an integer up to the float error (COUNT_TOLERANCE).
+"""
+import numpy as np
+
+from .layout import LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL, COUNT_TOLERANCE
+
+
+# Count of the rooms which can not be calculated (diagonal laying of not square tiles)
+INVALID_COUNT = -1
+
+
+def _float(*args):
+    return np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in args])
+
+
+def _ceil(steps):
+    """Same as layout.band_count(), without the limit by 0."""
+    return np.ceil(steps - COUNT_TOLERANCE)
+
+
+def count_direct(w, l, tw, tl, dl):
+    """Same as floor_layout(..., LAYING_METHOD_DIRECT).count().
+    :param w: width of rooms (mm).
+    :param l: length of rooms (mm).
+    :param tw: width of tiles (mm).
+    :param tl: length of tiles (mm).
+    :param dl: delimiters (mm).
+    :rtype: numpy.ndarray of int64
+    """
+    w, l, tw, tl, dl = _float(w, l, tw, tl, dl)
+    # NOTE: между первой плиткой и стенкой разделитель (w-dl)
+    width_cnt = _ceil((w-dl) / (tw+dl))
+    length_cnt = _ceil((l-dl) / (tl+dl))
+
+    return (width_cnt * length_cnt).astype(np.int64)
+
+
+def count_direct_center(w, l, tw, tl, dl):
+    """Same as floor_layout(..., LAYING_METHOD_DIRECT_CENTER).count().
+    :rtype: numpy.ndarray of int64
+    """
+    w, l, tw, tl, dl = _float(w, l, tw, tl, dl)
+    twd = tw + dl
+    tld = tl + dl
+
+    half_w = (w/2) - (tw/2 + dl)
+    half_l = (l/2) - (tl/2 + dl)
+
+    cnt_w = _ceil(half_w/twd) * 2 + 1
+    cnt_l = _ceil(half_l/tld) * 2 + 1
+
+    return (cnt_w * cnt_l).astype(np.int64)
+
+
+def count_diagonal(w, l, tw, tl, dl):
+    """Same as floor_layout(..., LAYING_METHOD_DIAGONAL).count().
+    :return: counts, INVALID_COUNT for not square tiles.
+    :rtype: numpy.ndarray of int64
+    """
+    w, l, tw, tl, dl = _float(w, l, tw, tl, dl)
+    d = np.sqrt(2) * tw
+    d05 = d / 2
+    dd = np.sqrt(2) * dl  # delimiter diagonal
+    d3 = d + dd  # tile diagonal + delimiter
+
+    half_w = (w/2) - (d05+dd)
+    half_l = (l/2) - (d05+dd)
+
+    # нечетные ряды (через центр) и четные ряды
+    width_cnt = _ceil(half_w/d3) * 2 + 1
+    width_even_cnt = _ceil(((w/2)-(dd/2)) / d3) * 2
+    length_cnt = _ceil(half_l/d3) * 2 + 1
+    length_even_cnt = _ceil(((l/2) - (dd/2)) / d3) * 2
+
+    result = ((width_cnt * length_cnt) + (width_even_cnt * length_even_cnt)).astype(np.int64)
+    return np.where(tw == tl, result, INVALID_COUNT)
+
+
+def count_floor(w, l, tw, tl, dl, method):
+    """Count of every room by its laying method.
+    :param method: LAYING_METHOD_* of rooms.
+    :return: counts, INVALID_COUNT for unsupported methods.
+    :rtype: numpy.ndarray of int64
+    """
+    method = np.asarray(method)
+    return np.select(
+        [method == LAYING_METHOD_DIRECT, method == LAYING_METHOD_DIRECT_CENTER, method == LAYING_METHOD_DIAGONAL],
+        [count_direct(w, l, tw, tl, dl), count_direct_center(w, l, tw, tl, dl), count_diagonal(w, l, tw, tl, dl)],
+        INVALID_COUNT
+    )
+
+
+def count_walls(l, w, h, tw, th, dl, door_width=0, door_height=0):
+    """Same as walls_layout(l, w, h, tw, th, dl, door_width, door_height).count().
+    :param l: length of rooms (mm).
+    :param w: width of rooms (mm).
+    :param h: height of rooms (mm).
+    :param tw: length of tiles along walls (mm).
+    :param th: height of tiles (mm).
+    :param dl: delimiters (mm).
+    :param door_width: (mm), 0 or NaN - no door.
+    :param door_height: (mm), 0 or NaN - no door.
+    :rtype: numpy.ndarray of int64
+    """
+    l, w, h, tw, th, dl, door_width, door_height = _float(l, w, h, tw, th, dl, door_width, door_height)
+
+    p = (l+w) * 2
+    width_cnt = _ceil((p-dl) / (tw+dl))
+    height_cnt = _ceil((h-dl) / (th+dl))
+
+    with np.errstate(invalid='ignore'):
+        has_door = (door_width != 0) & (door_height != 0) & ~np.isnan(door_width) & ~np.isnan(door_height)
+
+        start_door_w = l + w + l/2 - door_width/2
+        end_door_w = start_door_w + door_width
+        # колонки плиток, целиком попадающие в дверь
+        first_w = np.maximum(_ceil((start_door_w - dl) / (tw+dl)), 0)
+        last_w = np.minimum(np.floor((end_door_w - dl - tw) / (tw+dl) + COUNT_TOLERANCE), width_cnt - 1)
+        # ряды плиток от пола до верха двери
+        tcnt_h = np.where(
+            door_height >= h,
+            height_cnt,
+            np.minimum(np.floor((door_height - dl - th) / (th+dl) + COUNT_TOLERANCE) + 1, height_cnt)
+        )
+        tiles_in_door = np.maximum(last_w - first_w + 1, 0) * np.maximum(tcnt_h, 0)
+        tiles_in_door = np.where(has_door, tiles_in_door, 0)
+
+    return (width_cnt * height_cnt).astype(np.int64) - tiles_in_door.astype(np.int64)
@@ -0,0 +1,708 @@
+"""Geometry of tile laying.
+
+The layout is computed once per request (in mm), then tile counts,
+cut statistics and every renderer read from it.
+
+Tiles of a layout are grids: product of column and row bands.
+A band keeps origins of tiles, their extents cut by the edges of the room
+and cut flags in arrays, so memory grows with the number of rows and
+columns, not with the number of tiles.
+
+A room which is not a rectangle has an outline (polygon). Tiles are laid
+in its bounding rectangle and clipped by it row by row: the edges of the
+polygon crossing a row give intervals of X inside the room, so counting
+takes O(rows x edges) and doesn't depend on the number of columns.
+Obstacles on the floor (polygons in a uniform grid index) are cut out of
+the same intervals, a row looks only at the obstacles near it. Openings
+of walls (doors, windows, niches) are sorted rectangles cut out of the
+intervals of every row, O(rows x openings).
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from math import ceil, floor, sqrt
+
+
+LAYING_METHOD_DIRECT = 1
+LAYING_METHOD_DIRECT_CENTER = 2
+LAYING_METHOD_DIAGONAL = 3
+
+# Cut flags of a band
+CUT_LO = 1     # cut by the start edge (left/top)
+CUT_HI = 2     # cut by the end edge (right/bottom)
+CUT_SPLIT = 4  # split by the corner of walls
+
+# Protection from the layouts nobody can draw or lay
+LAYOUT_MAX_BANDS = 100000
+OUTLINE_MAX_VERTICES = 1000
+OBSTACLES_MAX = 1000
+OPENINGS_MAX = 100
+
+# Запас на ошибку вычислений с float (доля шага): плитка, которая начинается
+# на самом краю помещения с точностью до округления, не кладется
+COUNT_TOLERANCE = 1e-9
+# доля площади многоугольника, меньшие пересечения - ошибка округления
+AREA_TOLERANCE = 1e-6
+
+
+class LayoutError(ValueError):
+    pass
+
+
+class Bands:
+    """Tiles along one axis.
+    :ivar size: size of the whole tile (mm).
+    :ivar origin: start of the whole tile (mm).
+    :ivar start: start of the tile cut by the edge (mm).
+    :ivar end: end of the tile cut by the edge (mm).
+    :ivar flags: CUT_* flags.
+    """
+    __slots__ = ('size', 'origin', 'start', 'end', 'flags', '_uncut')
+
+    def __init__(self, size, origins, lo, hi):
+        """
+        :param size: tile size (mm).
+        :param origins: ascending starts of the whole tiles (mm).
+        :param lo: start edge of the room (mm).
+        :param hi: end edge of the room (mm).
+        """
+        self.size = size
+        self.origin = array('d', origins)
+        self.start = array('d')
+        self.end = array('d')
+        self.flags = array('b')
+
+        for o in self.origin:
+            flags = 0
+            if o < lo:
+                flags |= CUT_LO
+            if o + size > hi:
+                flags |= CUT_HI
+            self.start.append(max(o, lo))
+            self.end.append(min(o + size, hi))
+            self.flags.append(flags)
+
+        self._uncut = None
+
+    def __len__(self):
+        return len(self.origin)
+
+    def split(self, positions):
+        """Mark tiles crossed by positions (corners of walls) as cut."""
+        for pos in positions:
+            i = bisect_right(self.start, pos) - 1
+            if i >= 0 and self.start[i] < pos < self.end[i]:
+                self.flags[i] |= CUT_SPLIT
+        self._uncut = None
+
+    def uncut(self, i=0, j=None):
+        """Number of tiles without cuts in [i, j)."""
+        if self._uncut is None:
+            self._uncut = array('l', [0])
+            for f in self.flags:
+                self._uncut.append(self._uncut[-1] + (f == 0))
+        if j is None:
+            j = len(self)
+        return self._uncut[j] - self._uncut[i]
+
+    def inside(self, lo, hi):
+        """Indexes [i, j) of tiles which are entirely in [lo, hi] up to the float error."""
+        tolerance = COUNT_TOLERANCE * self.size
+        i = bisect_left(self.start, lo - tolerance)
+        j = bisect_right(self.end, hi + tolerance)
+        return i, max(i, j)
+
+    def overlapping(self, lo, hi):
+        """Indexes [i, j) of tiles which overlap (lo, hi) more than the float error."""
+        tolerance = COUNT_TOLERANCE * self.size
+        i = bisect_right(self.end, lo + tolerance)
+        j = bisect_left(self.start, hi - tolerance)
+        return i, max(i, j)
+
+    def overlapping_ranges(self, intervals):
+        """Indexes of tiles which overlap the intervals.
+        :param intervals: ascending disjoint (lo, hi).
+        :return: list of [i, j), a tile over the gap between intervals is taken once.
+        """
+        ranges = []
+        for lo, hi in intervals:
+            i, j = self.overlapping(lo, hi)
+            if ranges and i <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(j, ranges[-1][1]))
+            elif j > i:
+                ranges.append((i, j))
+        return ranges
+
+
+class Grid:
+    """Tiles in every crossing of columns and rows.
+    Diamond tiles (diagonal laying) are inscribed in these crossings.
+    """
+    __slots__ = ('cols', 'rows', 'diamond')
+
+    def __init__(self, cols, rows, diamond=False):
+        """
+        :type cols: Bands
+        :type rows: Bands
+        """
+        self.cols = cols
+        self.rows = rows
+        self.diamond = diamond
+
+    def count(self):
+        return len(self.cols) * len(self.rows)
+
+    def uncut(self):
+        return self.cols.uncut() * self.rows.uncut()
+
+
+def merge_intervals(intervals):
+    """Union of intervals.
+    :return: ascending disjoint (lo, hi) without empty ones.
+    """
+    result = []
+    for lo, hi in sorted(intervals):
+        if hi <= lo:
+            continue
+        if result and lo <= result[-1][1]:
+            if hi > result[-1][1]:
+                result[-1] = (result[-1][0], hi)
+        else:
+            result.append((lo, hi))
+    return result
+
+
+def intersect_intervals(first, second):
+    """Intersection of two ascending lists of disjoint intervals."""
+    result = []
+    i = j = 0
+    while i < len(first) and j < len(second):
+        lo = max(first[i][0], second[j][0])
+        hi = min(first[i][1], second[j][1])
+        if lo < hi:
+            result.append((lo, hi))
+        if first[i][1] < second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def subtract_intervals(first, second):
+    """first minus second, both are ascending lists of disjoint intervals."""
+    result = []
+    j = 0
+    for lo, hi in first:
+        while j < len(second) and second[j][1] <= lo:
+            j += 1
+        k = j
+        while k < len(second) and second[k][0] < hi:
+            if second[k][0] > lo:
+                result.append((lo, second[k][0]))
+            lo = max(lo, second[k][1])
+            k += 1
+        if lo < hi:
+            result.append((lo, hi))
+    return result
+
+
+class Outline:
+    """Polygon of the room, tiles out of it are not laid.
+    Edges must not cross each other, inside is found by the even-odd rule.
+    """
+    __slots__ = ('vertices', '_edges', '_edge_starts', '_ys')
+
+    def __init__(self, vertices):
+        """
+        :param vertices: list of (x, y) (mm), X - along the length, Y - along the width.
+        """
+        if len(vertices) < 3:
+            raise LayoutError("Outline needs at least 3 vertices")
+        if len(vertices) > OUTLINE_MAX_VERTICES:
+            raise LayoutError("Too many vertices of the outline: {}".format(len(vertices)))
+        self.vertices = [(float(x), float(y)) for x, y in vertices]
+
+        # (y0, y1, x at y0, dx/dy), горизонтальные ребра не пересекают ряды
+        edges = []
+        for (x0, y0), (x1, y1) in zip(self.vertices, self.vertices[1:] + self.vertices[:1]):
+            if y0 == y1:
+                continue
+            if y0 > y1:
+                x0, y0, x1, y1 = x1, y1, x0, y0
+            edges.append((y0, y1, x0, (x1 - x0) / (y1 - y0)))
+        edges.sort()
+        self._edges = edges
+        self._edge_starts = [e[0] for e in edges]
+        self._ys = sorted(set(y for _x, y in self.vertices))
+
+        if not self.area():
+            raise LayoutError("Outline has no area")
+
+    def edges(self):
+        """Closed list of sides: [(x0, y0, x1, y1)]."""
+        v = self.vertices
+        return [p + q for p, q in zip(v, v[1:] + v[:1])]
+
+    def area(self):
+        """(mm²)"""
+        v = self.vertices
+        return abs(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(v, v[1:] + v[:1]))) / 2
+
+    def bounds(self):
+        """(min x, min y, max x, max y) (mm)"""
+        xs = [x for x, _y in self.vertices]
+        ys = [y for _x, y in self.vertices]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def spans(self, y0, y1):
+        """Parts of the strip [y0, y1] inside the polygon.
+        The strip is split by vertices, between them the edges crossing it are
+        straight lines, pairs of them (sorted by X) bound the inside.
+        :return: (covered, touched) - ascending disjoint (x0, x1) inside the polygon
+            at every Y of the strip and at some Y of the strip.
+        """
+        cuts = [y0] + self._ys[bisect_right(self._ys, y0):bisect_left(self._ys, y1)] + [y1]
+        covered = None
+        touched = []
+        for ya, yb in zip(cuts, cuts[1:]):
+            if yb <= ya:
+                continue
+            mid = (ya + yb) / 2
+            crossing = sorted(
+                (x + (mid - ey0) * slope, x + (ya - ey0) * slope, x + (yb - ey0) * slope)
+                for ey0, ey1, x, slope in self._edges[:bisect_left(self._edge_starts, mid)]
+                if ey1 > mid
+            )
+            slab = []
+            for (_l, la, lb), (_r, ra, rb) in zip(crossing[::2], crossing[1::2]):
+                slab.append((max(la, lb), min(ra, rb)))
+                touched.append((min(la, lb), max(ra, rb)))
+            slab = merge_intervals(slab)
+            covered = slab if covered is None else intersect_intervals(covered, slab)
+        return covered or [], merge_intervals(touched)
+
+    def _intervals(self, y):
+        """Parts of the line at Y inside the polygon, Y must not be a Y of a vertex."""
+        crossing = sorted(
+            x + (y - ey0) * slope
+            for ey0, ey1, x, slope in self._edges[:bisect_left(self._edge_starts, y)]
+            if ey1 > y
+        )
+        return list(zip(crossing[::2], crossing[1::2]))
+
+    def overlap(self, other):
+        """Area of the intersection with another polygon (mm²).
+        Between vertices and crossings of edges of both polygons the sides
+        are straight, so the length of the intersection changes linearly
+        and it's taken at the middle of every strip.
+        """
+        x0, y0, x1, y1 = self.bounds()
+        ox0, oy0, ox1, oy1 = other.bounds()
+        lo, hi = max(y0, oy0), min(y1, oy1)
+        if hi <= lo or min(x1, ox1) <= max(x0, ox0):
+            return 0.0
+
+        ys = {lo, hi}
+        ys.update(y for y in self._ys + other._ys if lo < y < hi)
+        for ey0, ey1, x, slope in self._edges:
+            if ey1 <= lo or ey0 >= hi:
+                continue
+            for oey0, oey1, ox, oslope in other._edges:
+                if oey1 <= ey0 or oey0 >= ey1 or slope == oslope:
+                    continue
+                y = (ox - x + ey0 * slope - oey0 * oslope) / (slope - oslope)
+                if max(ey0, oey0, lo) < y < min(ey1, oey1, hi):
+                    ys.add(y)
+
+        ys = sorted(ys)
+        area = 0.0
+        for ya, yb in zip(ys, ys[1:]):
+            mid = (ya + yb) / 2
+            common = intersect_intervals(self._intervals(mid), other._intervals(mid))
+            area += (yb - ya) * sum(b - a for a, b in common)
+        return area
+
+
+class SpatialGrid:
+    """Uniform grid of square cells, a cell keeps the items which boxes overlap it.
+    A query looks only into the cells of its box, so it finds the items
+    nearby without looking at all of them.
+    """
+    __slots__ = ('cell', '_cells')
+
+    def __init__(self, boxes, cell):
+        """
+        :param boxes: list of (x0, y0, x1, y1) of items (mm).
+        :param cell: size of the cell (mm).
+        """
+        self.cell = cell
+        self._cells = defaultdict(list)  # (column, row): [number of item]
+        for n, box in enumerate(boxes):
+            for key in self._keys(*box):
+                self._cells[key].append(n)
+
+    def _keys(self, x0, y0, x1, y1):
+        for cx in range(int(floor(x0 / self.cell)), int(floor(x1 / self.cell)) + 1):
+            for cy in range(int(floor(y0 / self.cell)), int(floor(y1 / self.cell)) + 1):
+                yield cx, cy
+
+    def query(self, x0, y0, x1, y1):
+        """Numbers of items which boxes may overlap the box, ascending."""
+        found = set()
+        for key in self._keys(x0, y0, x1, y1):
+            items = self._cells.get(key)
+            if items:
+                found.update(items)
+        return sorted(found)
+
+
+class Obstacles:
+    """Fixtures on the floor without tiles: cabinets, tubs, columns, drains.
+    :ivar polygons: list of Outline.
+    """
+    __slots__ = ('polygons', '_boxes', '_index')
+
+    def __init__(self, polygons, width, height):
+        """
+        :param polygons: list of vertices [(x, y)] (mm), must be inside the room
+            and must not overlap (see outside() and overlapping()).
+        :param width: size of the room by X (mm).
+        :param height: size of the room by Y (mm).
+        """
+        if len(polygons) > OBSTACLES_MAX:
+            raise LayoutError("Too many obstacles: {}".format(len(polygons)))
+        self.polygons = [Outline(vertices) for vertices in polygons]
+        # в среднем одно препятствие на ячейку
+        cell = max(sqrt(width * height / max(len(polygons), 1)), 1.0)
+        self._boxes = [p.bounds() for p in self.polygons]
+        self._index = SpatialGrid(self._boxes, cell)
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def area(self):
+        """(mm²)"""
+        return sum(p.area() for p in self.polygons)
+
+    def near(self, x0, y0, x1, y1):
+        """Obstacles which boxes overlap the box.
+        :rtype: list of Outline
+        """
+        return [
+            self.polygons[n] for n in self._index.query(x0, y0, x1, y1)
+            if self._boxes[n][0] < x1 and self._boxes[n][2] > x0 and self._boxes[n][1] < y1 and self._boxes[n][3] > y0
+        ]
+
+    def overlapping(self):
+        """Pairs of numbers of the obstacles which overlap each other.
+        :rtype: list of (n, m), n < m
+        """
+        pairs = []
+        for n, box in enumerate(self._boxes):
+            polygon = self.polygons[n]
+            for m in self._index.query(*box):
+                if m <= n:
+                    continue
+                other = self.polygons[m]
+                if polygon.overlap(other) > AREA_TOLERANCE * min(polygon.area(), other.area()):
+                    pairs.append((n, m))
+        return pairs
+
+    def outside(self, room):
+        """Numbers of the obstacles which are not inside the room.
+        :type room: Outline
+        """
+        return [n for n, p in enumerate(self.polygons) if room.overlap(p) < p.area() * (1 - AREA_TOLERANCE)]
+
+    def spans(self, x0, y0, x1, y1):
+        """Parts of the strip [y0, y1] in [x0, x1] taken by the obstacles near it.
+        :return: (covered, touched) like Outline.spans()
+        """
+        covered, touched = [], []
+        for n in self._index.query(x0, y0, x1, y1):
+            box = self._boxes[n]
+            # в ячейке, но не в полосе
+            if box[3] <= y0 or box[1] >= y1:
+                continue
+            c, t = self.polygons[n].spans(y0, y1)
+            covered.extend(c)
+            touched.extend(t)
+        return merge_intervals(covered), merge_intervals(touched)
+
+
+class Layout:
+    """Tiles of the floor or of the unrolled walls.
+    X - along the length of the floor or along the perimeter of the walls,
+    Y - along the width of the floor or from the ceiling to the floor.
+    """
+    __slots__ = ('width', 'height', 'delimiter', 'grids', 'openings', 'seams', 'outline', 'obstacles', '_scans')
+
+    def __init__(self, width, height, delimiter, grids, openings=(), seams=(), outline=None, obstacles=None):
+        """
+        :param width: size by X (mm).
+        :param height: size by Y (mm).
+        :param grids: list of Grid.
+        :param openings: list of (x0, y0, x1, y1) without tiles (doors, windows), must not overlap.
+        :param seams: X of the corners of the walls (mm).
+        :param outline: Outline of the room inside the rectangle, None - the whole rectangle.
+        :param obstacles: Obstacles on the floor or None.
+        """
+        self.width = width
+        self.height = height
+        self.delimiter = delimiter
+        self.grids = list(grids)
+        self.openings = sorted(openings)
+        self.seams = list(seams)
+        self.outline = outline
+        self.obstacles = obstacles or None
+        self._scans = {}
+
+    def __getstate__(self):
+        # обходы сеток запомнены по id(), в другом процессе (задача рисования) они не действуют
+        return {name: getattr(self, name) for name in self.__slots__ if name != '_scans'}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._scans = {}
+
+    @property
+    def clipped(self):
+        """Tiles are clipped by the outline, openings or obstacles, they are counted row by row."""
+        return self.outline is not None or self.obstacles is not None or bool(self.openings)
+
+    def spans(self, y0, y1):
+        """Parts of the strip [y0, y1] (mm) where tiles are laid.
+        A tile touched by an opening or an obstacle is cut,
+        it is not laid if one of them covers it.
+        :return: (covered, touched) like Outline.spans()
+        """
+        if self.outline is None:
+            covered = touched = [(0, self.width)]
+        else:
+            covered, touched = self.outline.spans(y0, y1)
+
+        taken, blocked = [], []
+        # проемы отсортированы по X, объединение их интервалов - за один проход,
+        # край проема на краю ряда с точностью до округления
+        tolerance = COUNT_TOLERANCE * (y1 - y0)
+        for x0, oy0, x1, oy1 in self.openings:
+            if oy0 < y1 - tolerance and oy1 > y0 + tolerance:
+                blocked.append((x0, x1))
+                if oy0 <= y0 + tolerance and oy1 >= y1 - tolerance:
+                    taken.append((x0, x1))
+        if self.obstacles is not None:
+            obstacles_taken, obstacles_blocked = self.obstacles.spans(0, y0, self.width, y1)
+            taken.extend(obstacles_taken)
+            blocked.extend(obstacles_blocked)
+
+        if blocked:
+            covered = subtract_intervals(covered, merge_intervals(blocked))
+            touched = subtract_intervals(touched, merge_intervals(taken))
+        return covered, touched
+
+    def scan(self, grid):
+        """Tiles of the grid clipped by the outline, openings and obstacles row by row.
+        :return: (number of laid tiles, number of tiles without cuts)
+        """
+        result = self._scans.get(id(grid))
+        if result is None:
+            cols, rows = grid.cols, grid.rows
+            laid = whole = 0
+            for r in range(len(rows)):
+                covered, touched = self.spans(rows.start[r], rows.end[r])
+                laid += sum(j - i for i, j in cols.overlapping_ranges(touched))
+                if not rows.flags[r]:
+                    # целые - внутри контура на всю высоту ряда
+                    for x0, x1 in covered:
+                        whole += cols.uncut(*cols.inside(x0, x1))
+            result = self._scans[id(grid)] = (laid, whole)
+        return result
+
+    def column_ranges(self, grid, x_from=0, x_to=None):
+        """Tiles of every row of the grid to draw in [x_from, x_to] (mm).
+        :return: list (by rows) of lists of column indexes [i, j).
+        """
+        if x_to is None:
+            x_to = self.width
+        cols, rows = grid.cols, grid.rows
+        if not self.clipped:
+            ci, cj = cols.overlapping(x_from, x_to)
+            return [[(ci, cj)]] * len(rows)
+
+        clip = [(x_from, x_to)]
+        return [
+            cols.overlapping_ranges(intersect_intervals(self.spans(rows.start[r], rows.end[r])[1], clip))
+            for r in range(len(rows))
+        ]
+
+    def count(self):
+        """Number of tiles to buy."""
+        if self.clipped:
+            return sum(self.scan(grid)[0] for grid in self.grids)
+        return sum(grid.count() for grid in self.grids)
+
+    def cut_count(self):
+        """Number of tiles which have to be cut (by walls, corners, openings and obstacles)."""
+        if self.clipped:
+            return sum(laid - whole for laid, whole in map(self.scan, self.grids))
+        return sum(grid.count() - grid.uncut() for grid in self.grids)
+
+    def area(self):
+        """Area of the plane without openings and obstacles (m²),
+        obstacles are inside the room and don't overlap each other.
+        """
+        area = self.width * self.height if self.outline is None else self.outline.area()
+        if self.obstacles is not None:
+            area -= self.obstacles.area()
+        for x0, y0, x1, y1 in self.openings:
+            area -= (x1 - x0) * (y1 - y0)
+        return area / 10**6
+
+
+def _check(count):
+    if count > LAYOUT_MAX_BANDS:
+        raise LayoutError("Too many tiles in a row: {}".format(count))
+    return count
+
+
+def band_count(steps):
+    """Number of tiles to cover the steps, an integer up to the float error is not rounded up."""
+    return max(int(ceil(steps - COUNT_TOLERANCE)), 0)
+
+
+def corner_bands(length, tile, delimiter):
+    """Tiles from the start edge, every tile after a delimiter.
+    A tile is laid while its start is inside the room.
+    """
+    step = tile + delimiter
+    count = _check(band_count((length - delimiter) / step))
+    return Bands(tile, (delimiter + i * step for i in range(count)), 0, length)
+
+
+def center_bands(length, tile, delimiter, odd=True):
+    """Tiles from the center to both edges.
+    :param odd: the center tile is in the middle, otherwise a delimiter is.
+    """
+    step = tile + delimiter
+    center = length / 2
+
+    if odd:
+        side = band_count((center - (tile/2 + delimiter)) / step)
+        first = center + tile/2 + delimiter
+        origins = [center - tile/2]
+    else:
+        side = band_count((center - delimiter/2) / step)
+        first = center + delimiter/2
+        origins = []
+    _check(side * 2 + len(origins))
+
+    right = [first + i * step for i in range(side)]
+    left = [2 * center - o - tile for o in reversed(right)]
+
+    return Bands(tile, left + origins + right, 0, length)
+
+
+def floor_layout(width, length, tile_width, tile_length, delimiter, method, outline=None, obstacles=None):
+    """
+    :param width: width of floor (mm), Y
+    :param length: length of floor (mm), X
+    :param tile_width: (mm)
+    :param tile_length: (mm)
+    :param delimiter: (mm)
+    :param method: method of tile laying.
+    :param outline: vertices [(x, y)] of the floor (mm) in the rectangle length x width,
+        tiles are laid from the edges of the rectangle.
+    :param obstacles: list of vertices [(x, y)] of fixtures on the floor (mm).
+    :rtype: Layout
+    """
+    outline = Outline(outline) if outline else None
+    obstacles = Obstacles(obstacles, length, width) if obstacles else None
+
+    if method == LAYING_METHOD_DIRECT:
+        grids = [Grid(
+            corner_bands(length, tile_length, delimiter),
+            corner_bands(width, tile_width, delimiter)
+        )]
+    elif method == LAYING_METHOD_DIRECT_CENTER:
+        grids = [Grid(
+            center_bands(length, tile_length, delimiter),
+            center_bands(width, tile_width, delimiter)
+        )]
+    elif method == LAYING_METHOD_DIAGONAL:
+        if tile_width != tile_length:
+            raise LayoutError("Diagonal method is for square tiles only")
+        # плитки повернуты на 45°: размер по осям - диагональ плитки,
+        # четные ряды сдвинуты на половину диагонали
+        d = sqrt(2) * tile_width
+        dd = sqrt(2) * delimiter
+        grids = [
+            Grid(center_bands(length, d, dd), center_bands(width, d, dd), diamond=True),
+            Grid(center_bands(length, d, dd, odd=False), center_bands(width, d, dd, odd=False), diamond=True),
+        ]
+    else:
+        raise LayoutError("Unsupported method {}".format(method))
+
+    return Layout(length, width, delimiter, grids, outline=outline, obstacles=obstacles)
+
+
+def wall_starts(length, width):
+    """X of the starts of the 4 walls on the unrolled walls (mm)."""
+    return [0, length, length + width, length * 2 + width]
+
+
+def door_rect(length, width, height, door_width, door_height):
+    """Rectangle of the door in the middle of the third wall (mm)."""
+    start_door = length + width + length/2 - door_width/2
+    return start_door, height - door_height, start_door + door_width, height
+
+
+def opening_rects(length, width, height, openings):
+    """Rectangles of the openings on the unrolled walls.
+    :param openings: list of (wall, offset, width, height, bottom) like walls_layout() takes.
+    :return: list of (x0, y0, x1, y1) (mm), Y from the ceiling.
+    :raises LayoutError: no such wall.
+    """
+    if len(openings) > OPENINGS_MAX:
+        raise LayoutError("Too many openings: {}".format(len(openings)))
+    starts = wall_starts(length, width)
+    rects = []
+    for wall, offset, opening_width, opening_height, bottom in openings:
+        if wall not in range(len(starts)):
+            raise LayoutError("No wall {}".format(wall))
+        x0 = starts[int(wall)] + offset
+        rects.append((x0, height - bottom - opening_height, x0 + opening_width, height - bottom))
+    return rects
+
+
+def walls_layout(length, width, height, tile_length, tile_width, delimiter, door_width=None, door_height=None,
+                 openings=None):
+    """Walls unrolled from the first corner, the door is in the middle of the third wall.
+    Tiles are laid from the floor, the top row is cut.
+    :param tile_length: size of tile along walls (mm).
+    :param tile_width: height of tile (mm).
+    :param openings: list of (wall, offset, width, height, bottom) of doors, windows and niches:
+        number of the wall 0..3, offset from the start of the wall, sizes and height above the floor (mm).
+    :rtype: Layout
+    """
+    perimeter = (length + width) * 2
+    seams = wall_starts(length, width)[1:]
+
+    cols = corner_bands(perimeter, tile_length, delimiter)
+    cols.split(seams)
+
+    # ряды считаются от пола, Y направлена от потолка
+    from_floor = corner_bands(height, tile_width, delimiter)
+    rows = Bands(
+        tile_width,
+        (height - o - tile_width for o in reversed(from_floor.origin)),
+        0, height
+    )
+
+    rects = []
+    if door_width and door_height:
+        rects.append(door_rect(length, width, height, door_width, door_height))
+
+    rects.extend(opening_rects(length, width, height, openings or ()))
+
+    return Layout(perimeter, height, delimiter, [Grid(cols, rows)], rects, seams)
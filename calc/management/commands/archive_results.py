@@ -0,0 +1,82 @@
+"""Moving of old results into archive files.
+
+    python manage.py archive_results --days 365
+
+Results older than the given number of days are written into a gzipped
+JSON Lines file and deleted from the table by chunks: every chunk is
+written to disk before its rows are deleted in a short transaction, so
+the table is never locked for long and an interrupted run loses nothing.
+"""
+import gzip
+import json
+import os
+import time
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from calc.models import Result
+
+
+class Command(BaseCommand):
+    help = "Move results older than --days into gzipped JSON Lines files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.RESULTS_RETENTION_DAYS,
+                            help="keep results of the last days")
+        parser.add_argument('--dir', default=settings.RESULTS_ARCHIVE_DIR, help="directory of archive files")
+        parser.add_argument('--chunk', type=int, default=5000, help="rows per transaction")
+        parser.add_argument('--pause', type=float, default=0.1, help="pause between chunks (seconds)")
+        parser.add_argument('--dry-run', action='store_true', help="only count the rows to archive")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        old = Result.objects.filter(ts__lt=before)
+
+        if options['dry_run']:
+            self.stdout.write("Results older than {}: {}".format(before.isoformat(), old.count()))
+            return
+
+        os.makedirs(options['dir'], exist_ok=True)
+        filename = os.path.join(
+            options['dir'],
+            "results-{}-{}.jsonl.gz".format(before.strftime('%Y%m%d'), timezone.now().strftime('%Y%m%d%H%M%S%f'))
+        )
+
+        total = 0
+        # 'x' - никогда не перезаписывать существующий архив
+        with open(filename, 'xb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            while True:
+                rows = list(
+                    old.order_by('id').values('id', 'name', 'data', 'result', 'ip', 'ts')[:options['chunk']]
+                )
+                if not rows:
+                    break
+
+                for row in rows:
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8'))
+                    archive.write(b'\n')
+                # строки удаляются только после записи на диск
+                archive.flush(zlib.Z_SYNC_FLUSH)
+                raw.flush()
+                os.fsync(raw.fileno())
+
+                with transaction.atomic():
+                    Result.objects.filter(id__in=[row['id'] for row in rows]).delete()
+
+                total += len(rows)
+                self.stdout.write("Archived {} results".format(total))
+                if options['pause']:
+                    time.sleep(options['pause'])
+
+        if not total:
+            os.remove(filename)
+            self.stdout.write("Nothing to archive")
+            return
+
+        self.stdout.write("Archived {} results into {}".format(total, filename))
@@ -0,0 +1,249 @@
+"""Microbenchmarks of calculators and renderers.
+
+    python manage.py bench --output bench.json
+    python manage.py bench --baseline bench.json
+
+Every case runs over a matrix of room and tile sizes. For every case the
+best and the median wall time of --repeat runs, the peak of memory and
+the number of memory blocks left allocated by a run (caches, leaks) are
+reported. Memory is measured by tracemalloc, so buffers of Pillow and
+NumPy allocated in C are not seen by it, the peak of raster renderers is
+the size of their NumPy arrays. With --baseline the results are compared with the saved ones
+and the command fails if a case became slower than --tolerance allows.
+"""
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from math import ceil, sqrt
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calc.algorithms import draw_floor, save_image
+from calc.drawing import draw_bathroom, add_text_watermark, DRAWING_WATERMARK_TEXT
+from calc.kernels import count_floor, count_walls
+from calc.layout import floor_layout, walls_layout, \
+    LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL
+from calc.offcuts import plan_offcuts
+from calc.raster import raster_floor, raster_bathroom
+from calc.svg import svg_floor, svg_walls
+
+
+# (name, room (mm), tile (mm))
+ROOMS = [
+    ('small', (2000, 3000, 2500), 300),
+    ('medium', (5000, 8000, 3000), 200),
+    ('large', (20000, 30000, 3000), 100),
+]
+
+QUICK_ROOMS = ROOMS[:2]
+
+METHODS = [
+    ('direct', LAYING_METHOD_DIRECT),
+    ('center', LAYING_METHOD_DIRECT_CENTER),
+    ('diagonal', LAYING_METHOD_DIAGONAL),
+]
+
+DELIMITER = 2
+DOOR = (900, 2100)
+# окна на трех стенах (стена, отступ, ширина, высота, высота от пола), помещаются в самую маленькую комнату
+OPENINGS = [(0, 500, 1000, 1200, 900), (1, 300, 800, 1200, 900), (3, 600, 600, 600, 1200)]
+
+
+WAREHOUSE = [(0, 0), (200000, 0), (200000, 80000), (120000, 80000), (100000, 150000), (0, 150000)]
+
+
+def _outline_count(outline, method):
+    layout = floor_layout(150000, 200000, 300, 300, DELIMITER, method, outline)
+    return layout.count(), layout.cut_count()
+
+
+def _fixtures(width, length, n, size=600):
+    """n square fixtures evenly over the floor."""
+    side = int(ceil(sqrt(n)))
+    step_x, step_y = length / side, width / side
+    return [
+        [(x, y), (x + size, y), (x + size, y + size), (x, y + size)]
+        for x, y in ((step_x * (i % side) + step_x / 3, step_y * (i // side) + step_y / 3) for i in range(n))
+    ]
+
+
+def _obstacles_count(width, length, obstacles):
+    layout = floor_layout(width, length, 300, 300, DELIMITER, LAYING_METHOD_DIRECT, obstacles=obstacles)
+    return layout.count(), layout.cut_count()
+
+
+def cases(rooms):
+    """
+    :return: list of (name, function to measure)
+    """
+    result = []
+
+    def add(name, func):
+        result.append((name, func))
+
+    for room_name, (width, length, height), tile in rooms:
+        for method_name, method in METHODS:
+            layout = floor_layout(width, length, tile, tile, DELIMITER, method)
+            key = "{}/{}".format(room_name, method_name)
+            add("floor_layout/" + key, lambda m=method: floor_layout(width, length, tile, tile, DELIMITER, m))
+            add("draw_floor/" + key, lambda l=layout: draw_floor(l))
+            add("raster_floor/" + key, lambda l=layout: raster_floor(l, palette=True))
+            add("svg_floor/" + key, lambda l=layout: ''.join(svg_floor(l)))
+            add("plan_offcuts/floor/" + key, lambda l=layout: plan_offcuts(l))
+
+        for door_name, door in (('no_door', (None, None)), ('door', DOOR), ('openings', DOOR + (OPENINGS,))):
+            layout = walls_layout(length, width, height, tile, tile, DELIMITER, *door)
+            key = "{}/{}".format(room_name, door_name)
+            add("walls_layout/" + key, lambda d=door: walls_layout(length, width, height, tile, tile, DELIMITER, *d))
+            add("draw_bathroom/" + key, lambda l=layout: draw_bathroom(l))
+            add("raster_bathroom/" + key, lambda l=layout: raster_bathroom(l, palette=True))
+            add("svg_walls/" + key, lambda l=layout: ''.join(svg_walls(l)))
+            add("plan_offcuts/walls/" + key, lambda l=layout: plan_offcuts(l))
+
+        # счетчики форм: раскладка и число плиток по ней
+        for method_name, method in METHODS:
+            add("floor_count/{}/{}".format(room_name, method_name),
+                lambda m=method: floor_layout(width, length, tile, tile, DELIMITER, m).count())
+        add("walls_count/{}/door".format(room_name),
+            lambda: walls_layout(length, width, height, tile, tile, DELIMITER, *DOOR).count())
+
+    # склад в форме буквы L со скошенным углом, контур обрезает ряды плиток
+    for method_name, method in METHODS:
+        key = "warehouse/{}".format(method_name)
+        add("outline_count/" + key, lambda m=method: _outline_count(WAREHOUSE, m))
+        layout = floor_layout(150000, 200000, 300, 300, DELIMITER, method, WAREHOUSE)
+        add("raster_floor/outline/" + key, lambda l=layout: raster_floor(l, palette=True))
+        add("plan_offcuts/outline/" + key, lambda l=layout: plan_offcuts(l))
+
+    # зал с сотнями колонн и стеллажей: время должно расти медленнее их числа
+    for n in (10, 100, 1000):
+        obstacles = _fixtures(60000, 60000, n)
+        add("obstacles_count/{}".format(n), lambda o=obstacles: _obstacles_count(60000, 60000, o))
+
+    # план обрезков растущих помещений: время зависит от числа разных кусков, а не плиток
+    for size in (50, 100):
+        mm = size * 1000.0
+        layout = floor_layout(mm, mm * 1.3, 300, 300, DELIMITER, LAYING_METHOD_DIRECT_CENTER)
+        add("plan_offcuts/floor/{}m".format(size), lambda l=layout: plan_offcuts(l))
+        layout = walls_layout(mm, mm * 0.7, 3000, 300, 210, DELIMITER, *DOOR)
+        add("plan_offcuts/walls/{}m".format(size), lambda l=layout: plan_offcuts(l))
+
+    # картинки для водяного знака и кодирования
+    layout = walls_layout(3000, 2000, 2500, 300, 300, DELIMITER, *DOOR)
+    rgba = raster_bathroom(layout)
+    palette = raster_bathroom(layout, palette=True)
+    add("add_text_watermark/walls", lambda: add_text_watermark(DRAWING_WATERMARK_TEXT)(lambda: rgba)())
+
+    def encode(image, **options):
+        image.save(io.BytesIO(), "PNG", **options)
+
+    for level in (1, 6, 9):
+        add("png_encode/rgba/level{}".format(level), lambda lvl=level: encode(rgba, compress_level=lvl))
+        add("png_encode/palette/level{}".format(level), lambda lvl=level: encode(palette, compress_level=lvl))
+
+    tmp = tempfile.gettempdir()
+    add("save_image/palette", lambda: os.remove(os.path.join(tmp, save_image(palette, tmp))))
+
+    # векторные расчеты на массивах комнат
+    import numpy as np
+    rng = np.random.RandomState(0)
+    n = 100000
+    w, l, h = rng.uniform(1000, 20000, n), rng.uniform(1000, 20000, n), rng.uniform(2000, 3500, n)
+    tw = rng.randint(50, 600, n).astype(np.float64)
+    method = rng.randint(1, 4, n)
+    add("count_floor/100k", lambda: count_floor(w, l, tw, tw, DELIMITER, method))
+    add("count_walls/100k", lambda: count_walls(l, w, h, tw, tw, DELIMITER, DOOR[0], DOOR[1]))
+
+    return result
+
+
+def measure(func, repeat, min_time):
+    """
+    :return: dict of best and median time (ms), memory peak (KB) and blocks left allocated.
+    """
+    func()  # прогрев: шрифты, кэши
+
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat or (time.perf_counter() - started < min_time and len(times) < repeat * 100):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        func()
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    blocks = sum(max(stat.count_diff, 0) for stat in after.compare_to(before, 'lineno'))
+
+    return {
+        'best_ms': round(min(times), 4),
+        'median_ms': round(statistics.median(times), 4),
+        'runs': len(times),
+        'peak_kb': round(peak / 1024, 1),
+        'blocks': blocks,
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmarks of calculators and renderers, comparison with a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="save results as JSON")
+        parser.add_argument('--baseline', help="JSON of a previous run to compare with")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="allowed slowdown against the baseline (0.25 = 25%%)")
+        parser.add_argument('--repeat', type=int, default=5, help="min number of runs of a case")
+        parser.add_argument('--min-time', type=float, default=0.2, help="min time of a case (seconds)")
+        parser.add_argument('--filter', '-k', default='', help="run cases which names contain the text")
+        parser.add_argument('--quick', action='store_true', help="without large rooms")
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, func in cases(QUICK_ROOMS if options['quick'] else ROOMS):
+            if options['filter'] not in name:
+                continue
+            results[name] = measure(func, options['repeat'], options['min_time'])
+            r = results[name]
+            self.stdout.write("{:<48} {:>10.3f} ms {:>10.3f} ms {:>10.1f} KB {:>8} blocks".format(
+                name, r['best_ms'], r['median_ms'], r['peak_kb'], r['blocks']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'cases': results,
+                }, f, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)['cases']
+
+        regressions = []
+        for name, r in sorted(results.items()):
+            base = baseline.get(name)
+            if base is None:
+                continue
+            # лучшее время меньше зависит от шума машины, чем медиана
+            ratio = r['best_ms'] / base['best_ms'] if base['best_ms'] else 1.0
+            if ratio > 1 + tolerance:
+                regressions.append("{}: {:.3f} ms -> {:.3f} ms (x{:.2f})".format(
+                    name, base['best_ms'], r['best_ms'], ratio))
+
+        if regressions:
+            raise CommandError("Slower than the baseline:\n" + "\n".join(regressions))
+        self.stdout.write("No regressions against {}".format(path))
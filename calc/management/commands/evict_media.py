@@ -0,0 +1,25 @@
+"""Deletion of least recently used plan images over the limits of media.
+
+    python manage.py evict_media --dry-run
+
+Same as the background eviction of workers (calc/media.py), but without
+the limit of files per run.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from calc.media import evict
+
+
+class Command(BaseCommand):
+    help = "Delete least recently used plan images over MEDIA_MAX_BYTES and MEDIA_MAX_FILES"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.MEDIA_ROOT, help="directory of images")
+        parser.add_argument('--limit', type=int, help="max files to delete")
+        parser.add_argument('--dry-run', action='store_true', help="only count the files to delete")
+
+    def handle(self, *args, **options):
+        deleted, freed, files, size = evict(options['path'], limit=options['limit'], dry_run=options['dry_run'])
+        self.stdout.write("{}: {} files, {} bytes. Left: {} files, {} bytes".format(
+            "Would delete" if options['dry_run'] else "Deleted", deleted, freed, files, size))
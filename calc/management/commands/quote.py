@@ -0,0 +1,286 @@
+"""Bulk quoting of rooms from CSV or JSON Lines.
+
+    python manage.py quote rooms.csv --output quotes.jsonl
+
+Every row has "name" (floor or walls), the fields of the form of the
+calculator (CalcFloorForm, CalcWallForm) and an optional "id" which is
+copied to the output. Plans are not drawn and results are not saved.
+
+With --counts only the numbers of tiles are calculated (no cut, buy and
+waste_area): rectangular rooms of a batch are validated by the forms
+without the layout and counted at once by the vectorized kernels
+(calc/kernels.py), other rooms are calculated as without it.
+
+Rows are read and sent to the pool of processes by batches, at most two
+batches are in work, so memory does not depend on the size of the input.
+"""
+import csv
+import io
+import json
+import os
+import sys
+from math import ceil
+from multiprocessing import Pool
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from calc.algorithms import calc_cost
+from calc.forms import CalcFloorForm, CalcWallForm
+from calc.kernels import count_floor, count_walls
+
+
+QUOTE_FORMS = {
+    'floor': CalcFloorForm,
+    'walls': CalcWallForm,
+}
+
+# поля помещений, которые ядра не считают
+NOT_RECTANGULAR_FIELDS = ('outline', 'obstacles', 'openings')
+
+OUTPUT_FIELDS = ['id', 'name', 'result', 'reserve', 'total', 'cost', 'total_area', 'cut', 'buy', 'waste_area', 'errors']
+
+
+def quote_row(row):
+    """Calculate one row of the input.
+    :param row: (number of line, dict of fields)
+    :return: dict of the output
+    """
+    line, data = row
+    output = {'line': line, 'id': data.get('id'), 'name': data.get('name')}
+    try:
+        form = _valid_form(data, output)
+        if form is None:
+            return output
+        results = form.results(render=False)
+    except Exception as e:
+        # строка, на которой расчет упал, не останавливает остальные
+        return _failed(output, e)
+
+    del results['draw']
+    output.update(results)
+    return output
+
+
+def _failed(output, error):
+    output['errors'] = {'__all__': ["Calculation failed: {}: {}".format(type(error).__name__, error)]}
+    return output
+
+
+def quote_rows(rows):
+    return [quote_row(row) for row in rows]
+
+
+def _valid_form(data, output, with_layout=True):
+    """
+    :return: the valid form of the row or None, then errors are in the output.
+    """
+    if '_error' in data:
+        output['errors'] = {'__all__': [data['_error']]}
+        return None
+
+    form_class = QUOTE_FORMS.get(data.get('name'))
+    if form_class is None:
+        output['errors'] = {'name': ["Unknown calculation, one of: {}".format(', '.join(sorted(QUOTE_FORMS)))]}
+        return None
+
+    form = form_class(_fields(data))
+    form.with_layout = with_layout
+    if not form.is_valid():
+        output['errors'] = {field: [str(e) for e in errors] for field, errors in form.errors.items()}
+        return None
+    return form
+
+
+def _fields(data):
+    # пустые ячейки CSV - не заданные значения
+    return {k: v for k, v in data.items() if v not in ('', None)}
+
+
+def quote_counts(batch):
+    """Calculate the numbers of tiles of the rows of a batch: result, reserve, total, cost, total_area.
+    :param batch: list of (number of line, dict of fields)
+    :return: list of dicts of the output in the order of the batch
+    """
+    outputs = []
+    rooms = {'floor': [], 'walls': []}  # name: [(output, form)]
+    for line, data in batch:
+        if any(name in _fields(data) for name in NOT_RECTANGULAR_FIELDS):
+            outputs.append(quote_row((line, data)))
+            continue
+        output = {'line': line, 'id': data.get('id'), 'name': data.get('name')}
+        outputs.append(output)
+        try:
+            form = _valid_form(data, output, with_layout=False)
+        except Exception as e:
+            _failed(output, e)
+            continue
+        if form is not None:
+            rooms[data['name']].append((output, form))
+
+    for name, counter in (('floor', _count_floors), ('walls', _count_walls)):
+        if not rooms[name]:
+            continue
+        counts, areas = counter([form.render_params for _output, form in rooms[name]])
+        for (output, form), count, area in zip(rooms[name], counts.tolist(), areas.tolist()):
+            reserve = ceil(count / 100.0 * form.cleaned_data['reserve'])
+            price = form.cleaned_data['price']
+            output.update({
+                'result': count, 'reserve': reserve, 'total': count + reserve,
+                'cost': calc_cost(count + reserve, price) if price else None,
+                'total_area': round(area, 2),
+            })
+    return outputs
+
+
+def _columns(params, *names):
+    return [np.array([p[name] or 0 for p in params], dtype=np.float64) for name in names]
+
+
+def _count_floors(params):
+    """
+    :param params: floor_params() of rectangular floors.
+    :return: (counts, areas (m²))
+    """
+    w, l, tw, tl, dl, method = _columns(params, 'width', 'length', 'tile_width', 'tile_length', 'delimiter', 'method')
+    return count_floor(w, l, tw, tl, dl, method), w * l / 10**6
+
+
+def _count_walls(params):
+    """
+    :param params: walls_params() without openings.
+    :return: (counts, areas without the door (m²))
+    """
+    l, w, h, tl, tw, dl, door_width, door_height = _columns(
+        params, 'length', 'width', 'height', 'tile_length', 'tile_width', 'delimiter', 'door_width', 'door_height'
+    )
+    door = np.where((door_width > 0) & (door_height > 0), door_width * door_height, 0)
+    return count_walls(l, w, h, tl, tw, dl, door_width, door_height), ((l + w) * 2 * h - door) / 10**6
+
+
+def read_csv(stream):
+    for line, row in enumerate(csv.DictReader(stream), start=2):
+        yield line, row
+
+
+def read_jsonl(stream):
+    for line, text in enumerate(stream, start=1):
+        text = text.strip()
+        if not text:
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            row = {'_error': "Invalid JSON: {}".format(e)}
+        if not isinstance(row, dict):
+            row = {'_error': "Row must be an object"}
+        yield line, row
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parts(batch, n):
+    """The batch split into at most n parts for the processes."""
+    size = max(-(-len(batch) // n), 1)
+    return [batch[i:i + size] for i in range(0, len(batch), size)]
+
+
+class JsonlWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, output):
+        self.stream.write(json.dumps(output, ensure_ascii=False))
+        self.stream.write('\n')
+
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.writer = csv.DictWriter(stream, OUTPUT_FIELDS, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, output):
+        if 'errors' in output:
+            output = dict(output, errors=json.dumps(output['errors'], ensure_ascii=False))
+        self.writer.writerow(output)
+
+
+def _format(path, fmt):
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    raise CommandError("Unknown format of {}, use --format".format(path))
+
+
+class Command(BaseCommand):
+    help = "Tile counts, reserve and cost of rooms from CSV or JSON Lines file, without drawing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="CSV or JSON Lines file, '-' for stdin")
+        parser.add_argument('--output', '-o', default='-', help="output file (.jsonl or .csv), '-' for stdout")
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help="format of the input")
+        parser.add_argument('--output-format', choices=('csv', 'jsonl'), help="format of the output")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="number of processes")
+        parser.add_argument('--batch', type=int, default=2000, help="rows per batch")
+        parser.add_argument('--counts', action='store_true',
+                            help="only numbers of tiles, rectangular rooms are counted by vectorized kernels")
+
+    def handle(self, *args, **options):
+        input_path, output_path = options['input'], options['output']
+        input_format = _format(input_path, options['format']) if input_path != '-' else (options['format'] or 'jsonl')
+        output_format = options['output_format'] or ('jsonl' if output_path == '-' else _format(output_path, None))
+
+        if input_path == '-':
+            source = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        else:
+            source = open(input_path, encoding='utf-8', newline='')
+
+        if output_path == '-':
+            target = sys.stdout
+        else:
+            target = open(output_path, 'w', encoding='utf-8', newline='')
+
+        reader = read_csv if input_format == 'csv' else read_jsonl
+        writer = (CsvWriter if output_format == 'csv' else JsonlWriter)(target)
+
+        quote = quote_counts if options['counts'] else quote_rows
+        total = failed = 0
+        try:
+            with Pool(options['workers']) as pool:
+                pending = None
+                # следующая пачка считается, пока пишется предыдущая
+                for batch in batches(reader(source), options['batch']):
+                    work = pool.map_async(quote, parts(batch, options['workers'] * 4))
+                    if pending is not None:
+                        total, failed = self._write(writer, pending.get(), total, failed)
+                    pending = work
+                if pending is not None:
+                    total, failed = self._write(writer, pending.get(), total, failed)
+        finally:
+            source.close()
+            if target is not sys.stdout:
+                target.close()
+
+        self.stderr.write("Rows: {}, with errors: {}".format(total, failed))
+
+    @staticmethod
+    def _write(writer, parts_outputs, total, failed):
+        for outputs in parts_outputs:
+            for output in outputs:
+                writer.write(output)
+                total += 1
+                failed += 'errors' in output
+        return total, failed
@@ -0,0 +1,271 @@
+"""Stress sweep of the plan renderers over sizes of rooms and tiles.
+
+    python manage.py sweep --steps 5 --output sweep.jsonl
+    python manage.py sweep --random 2000 --seed 1 --save-images /tmp/sweep/
+
+Cases (floors by every laying method, walls with and without a door) are
+drawn by the pool of processes. For every case time, memory and the
+outcome are recorded:
+
+- error: an exception of the renderer (asserts of Wall, empty canvas...);
+- timeout: the case was not drawn in --timeout seconds;
+- rejected: LayoutError, the form rejects such rooms too;
+- warnings: tiles smaller than a pixel at the scale of the plan;
+- outlier: time or memory more than --outlier times the median of the kind.
+
+The command fails if there are errors or timeouts.
+"""
+import json
+import math
+import os
+import random
+import resource
+import signal
+import statistics
+import time
+import tracemalloc
+from collections import Counter
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calc.algorithms import draw_floor
+from calc.drawing import draw_bathroom, floor_scale, walls_frame
+from calc.layout import floor_layout, walls_layout, LayoutError, \
+    LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL
+from calc.raster import raster_floor, raster_bathroom
+from calc.svg import svg_floor, svg_walls
+
+
+METHODS = (LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL)
+DOOR = (600, 2100)
+
+RENDERERS = {
+    'pil': (lambda layout: draw_floor(layout), lambda layout: draw_bathroom(layout).im),
+    'raster': (raster_floor, raster_bathroom),
+    'palette': (lambda layout: raster_floor(layout, palette=True),
+                lambda layout: raster_bathroom(layout, palette=True)),
+    'svg': (lambda layout: ''.join(svg_floor(layout)), lambda layout: ''.join(svg_walls(layout))),
+}
+
+
+class CaseTimeout(Exception):
+    pass
+
+
+def _alarm(signum, frame):
+    raise CaseTimeout()
+
+
+def geometric(lo, hi, steps):
+    """Sizes from hi down to lo with a constant ratio (mm)."""
+    if steps < 2:
+        return [hi]
+    ratio = (lo / hi) ** (1.0 / (steps - 1))
+    return [round(hi * ratio ** i, 1) for i in range(steps)]
+
+
+def grid_cases(room_sizes, tile_sizes, delimiter):
+    for l in room_sizes:
+        for w in room_sizes:
+            for tw in tile_sizes:
+                for th in tile_sizes:
+                    for method in METHODS:
+                        if method == LAYING_METHOD_DIAGONAL and tw != th:
+                            continue
+                        yield {'kind': 'floor', 'length': l, 'width': w, 'tile_width': tw, 'tile_length': th,
+                               'delimiter': delimiter, 'method': method}
+                    for h in room_sizes:
+                        for door in (None, DOOR):
+                            yield walls_case(l, w, h, tw, th, delimiter, door)
+
+
+def random_cases(n, room_range, tile_range, delimiter, seed):
+    rnd = random.Random(seed)
+
+    def size(lo, hi):
+        # равномерно по логарифму, чтобы маленькие размеры встречались так же часто
+        return round(math.exp(rnd.uniform(math.log(lo), math.log(hi))), 1)
+
+    for _ in range(n):
+        l, w, h = size(*room_range), size(*room_range), size(*room_range)
+        tw, th = size(*tile_range), size(*tile_range)
+        if rnd.random() < 0.5:
+            method = rnd.choice(METHODS)
+            if method == LAYING_METHOD_DIAGONAL:
+                th = tw
+            yield {'kind': 'floor', 'length': l, 'width': w, 'tile_width': tw, 'tile_length': th,
+                   'delimiter': delimiter, 'method': method}
+        else:
+            yield walls_case(l, w, h, tw, th, delimiter, DOOR if rnd.random() < 0.5 else None)
+
+
+def walls_case(l, w, h, tw, th, delimiter, door):
+    return {'kind': 'walls', 'length': l, 'width': w, 'height': h, 'tile_length': tw, 'tile_width': th,
+            'delimiter': delimiter, 'door_width': door and door[0], 'door_height': door and door[1]}
+
+
+def make_layout(case):
+    if case['kind'] == 'floor':
+        return floor_layout(case['width'], case['length'], case['tile_width'], case['tile_length'],
+                            case['delimiter'], case['method'])
+    return walls_layout(case['length'], case['width'], case['height'], case['tile_length'], case['tile_width'],
+                        case['delimiter'], case['door_width'], case['door_height'])
+
+
+def check_scale(case, layout):
+    """
+    :return: list of warnings about the plan.
+    """
+    if case['kind'] == 'floor':
+        sf = floor_scale(layout)[0]
+    else:
+        sf = walls_frame(layout)[0]
+
+    warnings = []
+    tile_px = min(case['tile_width'], case['tile_length']) * sf
+    if tile_px < 1:
+        warnings.append("tiles of {:.2f}px".format(tile_px))
+    return warnings
+
+
+def run_case(args):
+    """Job of the pool process.
+    :param args: (number, case, options)
+    :return: the case with the outcome.
+    """
+    number, case, options = args
+    result = dict(case, n=number, status='ok', warnings=[])
+
+    signal.signal(signal.SIGALRM, _alarm)
+    signal.alarm(options['timeout'])
+    if options['trace_memory']:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        layout = make_layout(case)
+        result['tiles'] = layout.count()
+        result['warnings'] = check_scale(case, layout)
+        floor_renderer, walls_renderer = RENDERERS[options['renderer']]
+        image = (floor_renderer if case['kind'] == 'floor' else walls_renderer)(layout)
+        if options['save_images'] and hasattr(image, 'save'):
+            image.save(os.path.join(options['save_images'], "{}-{}.png".format(number, case['kind'])))
+    except CaseTimeout:
+        result['status'] = 'timeout'
+    except LayoutError as e:
+        result['status'] = 'rejected'
+        result['error'] = str(e)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    finally:
+        signal.alarm(0)
+        result['ms'] = round((time.perf_counter() - started) * 1000, 2)
+        if options['trace_memory']:
+            result['peak_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+        # максимум процесса, растет только на самых тяжелых случаях
+        result['maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return result
+
+
+def mark_outliers(results, factor):
+    """Flag cases slower (or bigger) than factor * median of the cases of the same kind."""
+    for kind in ('floor', 'walls'):
+        done = [r for r in results if r['kind'] == kind and r['status'] == 'ok']
+        for field in ('ms', 'peak_kb'):
+            values = [r[field] for r in done if field in r]
+            if len(values) < 10:
+                continue
+            limit = statistics.median(values) * factor
+            for r in done:
+                if r.get(field, 0) > limit:
+                    r.setdefault('outlier', []).append(field)
+
+
+def _case_str(r):
+    params = ('length', 'width', 'height', 'tile_length', 'tile_width', 'delimiter', 'method', 'door_width')
+    return "{} {}".format(r['kind'], ' '.join("{}={}".format(k, r[k]) for k in params if r.get(k) is not None))
+
+
+class Command(BaseCommand):
+    help = "Draws plans over a sweep of room and tile sizes, reports errors, timeouts and outliers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', type=int, default=4, help="sizes per dimension of the grid")
+        parser.add_argument('--random', type=int, default=0, help="random cases instead of the grid")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--room-min', type=float, default=50)
+        parser.add_argument('--room-max', type=float, default=5000)
+        parser.add_argument('--tile-min', type=float, default=50)
+        parser.add_argument('--tile-max', type=float, default=400)
+        parser.add_argument('--delimiter', type=float, default=1.5)
+        parser.add_argument('--renderer', choices=sorted(RENDERERS), default='pil')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="number of processes")
+        parser.add_argument('--timeout', type=int, default=30, help="max seconds of a case")
+        parser.add_argument('--outlier', type=float, default=5.0, help="outlier: more than so many medians")
+        parser.add_argument('--trace-memory', action='store_true', help="peak of Python memory of every case")
+        parser.add_argument('--save-images', help="directory for the images")
+        parser.add_argument('--output', '-o', help="JSON Lines of every case")
+
+    def handle(self, *args, **options):
+        if options['random']:
+            cases = random_cases(options['random'], (options['room_min'], options['room_max']),
+                                 (options['tile_min'], options['tile_max']), options['delimiter'], options['seed'])
+        else:
+            cases = grid_cases(geometric(options['room_min'], options['room_max'], options['steps']),
+                               geometric(options['tile_min'], options['tile_max'], options['steps']),
+                               options['delimiter'])
+
+        if options['save_images']:
+            os.makedirs(options['save_images'], exist_ok=True)
+
+        job_options = {k: options[k] for k in ('renderer', 'timeout', 'trace_memory', 'save_images')}
+        jobs = ((n, case, job_options) for n, case in enumerate(cases))
+
+        started = time.time()
+        with Pool(options['workers']) as pool:
+            results = list(pool.imap_unordered(run_case, jobs, chunksize=4))
+        results.sort(key=lambda r: r['n'])
+        mark_outliers(results, options['outlier'])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                for r in results:
+                    f.write(json.dumps(r))
+                    f.write('\n')
+
+        self.report(results, time.time() - started)
+
+        failed = sum(r['status'] in ('error', 'timeout') for r in results)
+        if failed:
+            raise CommandError("{} cases failed".format(failed))
+
+    def report(self, results, elapsed):
+        statuses = Counter(r['status'] for r in results)
+        self.stdout.write("Cases: {} in {:.1f}s, {}".format(
+            len(results), elapsed, ', '.join("{}: {}".format(k, v) for k, v in sorted(statuses.items()))))
+
+        for kind in ('floor', 'walls'):
+            times = [r['ms'] for r in results if r['kind'] == kind and r['status'] == 'ok']
+            if times:
+                self.stdout.write("{}: median {:.1f} ms, max {:.1f} ms".format(
+                    kind, statistics.median(times), max(times)))
+
+        errors = Counter(r['error'] for r in results if r['status'] == 'error')
+        for error, count in errors.most_common():
+            example = next(r for r in results if r.get('error') == error)
+            self.stdout.write("ERROR x{}: {}\n    e.g. {}".format(count, error, _case_str(example)))
+
+        for r in results:
+            if r['status'] == 'timeout':
+                self.stdout.write("TIMEOUT: {}".format(_case_str(r)))
+
+        warnings = [r for r in results if r['warnings']]
+        if warnings:
+            self.stdout.write("Warnings: {} cases, e.g. {}: {}".format(
+                len(warnings), _case_str(warnings[0]), '; '.join(warnings[0]['warnings'])))
+
+        for r in sorted((r for r in results if 'outlier' in r), key=lambda r: -r['ms'])[:10]:
+            self.stdout.write("OUTLIER ({}): {:.1f} ms: {}".format(', '.join(r['outlier']), r['ms'], _case_str(r)))
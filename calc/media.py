@@ -0,0 +1,224 @@
+"""Size limit of the plan images in MEDIA_ROOT.
+
+Every use of an image (a cache hit of the renderer) touches its mtime,
+hits of LRU of the worker do it once per MEDIA_MIN_AGE, so mtime is about
+the time it was last served by the calculator. When images
+take more than MEDIA_MAX_BYTES or MEDIA_MAX_FILES, the least recently
+used ones are deleted, except:
+
+- images used during the last MEDIA_MIN_AGE seconds (pages may still load them);
+- images of results of the last MEDIA_KEEP_REFERENCED_DAYS days (Result.result['draw']).
+
+Eviction runs in a background thread of every worker once per
+MEDIA_EVICT_INTERVAL seconds, deletes at most MEDIA_EVICT_BATCH files per
+run and only one process does it at a time (flock), so a worker never
+stops for a long scan. 'manage.py evict_media' runs it at once.
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .metrics import MEDIA_EVICTED, MEDIA_EVICTED_BYTES
+from .models import Result
+
+
+logger = logging.getLogger(__name__)
+
+MEDIA_EXTENSIONS = ('.png', '.svg')
+# недописанные файлы упавших процессов
+TMP_MAX_AGE = 3600
+
+
+def touch(path, filename):
+    """Mark the image as just used."""
+    try:
+        os.utime(os.path.join(path, filename))
+    except OSError:
+        pass
+
+
+def scan(path):
+    """
+    :return: (list of (mtime, size, filename) of images, list of old temporary files)
+    """
+    images = []
+    stale_tmp = []
+    now = time.time()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if entry.name.endswith(MEDIA_EXTENSIONS):
+                images.append((st.st_mtime, st.st_size, entry.name))
+            elif entry.name.endswith('.tmp') and now - st.st_mtime > TMP_MAX_AGE:
+                stale_tmp.append(entry.name)
+    return images, stale_tmp
+
+
+def draw_filename(draw):
+    """File name of the image by Result.result['draw']: url of MEDIA_ROOT or of plan_image view.
+    :return: file name or None.
+    """
+    from django.http import QueryDict
+    from .render_cache import parse_plan_query, render_filename
+
+    path, _, query = draw.partition('?')
+    if not query:
+        return os.path.basename(path)
+
+    kind, _, image_format = os.path.basename(path).partition('.')
+    try:
+        return render_filename(kind, parse_plan_query(kind, QueryDict(query)), image_format)
+    except ValueError:
+        return None
+
+
+def referenced_files(days):
+    """File names of images of the results of the last days."""
+    since = timezone.now() - timedelta(days=days)
+    names = set()
+    for result in Result.objects.filter(ts__gte=since).values_list('result', flat=True).iterator():
+        draw = result.get('draw') if isinstance(result, dict) else None
+        if draw:
+            names.add(draw_filename(draw))
+    return names
+
+
+def select_victims(images, max_bytes, max_files, keep, min_mtime):
+    """Least recently used images to delete to fit into the limits.
+    :param images: list of (mtime, size, filename)
+    :param keep: file names which must not be deleted.
+    :param min_mtime: images used after it are not deleted.
+    :return: list of (mtime, size, filename)
+    """
+    total_bytes = sum(size for _mtime, size, _name in images)
+    total_files = len(images)
+
+    victims = []
+    for image in sorted(images):
+        if (not max_bytes or total_bytes <= max_bytes) and (not max_files or total_files <= max_files):
+            break
+        mtime, size, name = image
+        if mtime >= min_mtime:
+            # дальше только более свежие
+            break
+        if name in keep:
+            continue
+        victims.append(image)
+        total_bytes -= size
+        total_files -= 1
+    return victims
+
+
+def evict(path=None, limit=None, dry_run=False):
+    """Delete least recently used images over the limits.
+    :param limit: max number of files to delete, all if None.
+    :return: (deleted files, freed bytes, images left, bytes left)
+    """
+    path = path or settings.MEDIA_ROOT
+    images, stale_tmp = scan(path)
+
+    for name in stale_tmp:
+        if not dry_run:
+            _remove(path, name)
+
+    over = (settings.MEDIA_MAX_BYTES and sum(i[1] for i in images) > settings.MEDIA_MAX_BYTES) or \
+        (settings.MEDIA_MAX_FILES and len(images) > settings.MEDIA_MAX_FILES)
+    victims = []
+    if over:
+        keep = referenced_files(settings.MEDIA_KEEP_REFERENCED_DAYS) if settings.MEDIA_KEEP_REFERENCED_DAYS else set()
+        victims = select_victims(
+            images, settings.MEDIA_MAX_BYTES, settings.MEDIA_MAX_FILES,
+            keep, time.time() - settings.MEDIA_MIN_AGE
+        )[:limit]
+
+    deleted = freed = 0
+    for _mtime, size, name in victims:
+        if dry_run or _remove(path, name):
+            deleted += 1
+            freed += size
+    if not dry_run:
+        MEDIA_EVICTED.inc(deleted)
+        MEDIA_EVICTED_BYTES.inc(freed)
+
+    return deleted, freed, len(images) - deleted, sum(i[1] for i in images) - freed
+
+
+def _remove(path, name):
+    try:
+        os.remove(os.path.join(path, name))
+        return True
+    except OSError:
+        return False
+
+
+class _Lock:
+    """Non-blocking lock between processes.
+    :raises OSError: the lock is taken by another process.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            raise
+
+    def release(self):
+        self._file.close()
+
+
+def evict_once():
+    """A run of the background eviction, skipped if another process does it."""
+    path = settings.MEDIA_ROOT
+    try:
+        lock = _Lock(os.path.join(path, '.evict.lock'))
+    except OSError:
+        return None
+    try:
+        return evict(path, limit=settings.MEDIA_EVICT_BATCH)
+    finally:
+        lock.release()
+
+
+_thread = None
+_thread_pid = None
+_thread_lock = threading.Lock()
+
+
+def _run():
+    while True:
+        time.sleep(settings.MEDIA_EVICT_INTERVAL)
+        try:
+            stats = evict_once()
+            if stats and stats[0]:
+                logger.info("Evicted %d images, %d bytes", stats[0], stats[1])
+        except Exception:
+            logger.exception("Eviction of media failed")
+        finally:
+            connection.close()
+
+
+def start_eviction():
+    """Start the background eviction in this process if it's on and not started."""
+    global _thread, _thread_pid
+    if not settings.MEDIA_EVICT_INTERVAL or (_thread_pid == os.getpid() and _thread.is_alive()):
+        return
+    with _thread_lock:
+        if _thread_pid == os.getpid() and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_run, name="MediaEviction", daemon=True)
+        _thread_pid = os.getpid()
+        _thread.start()
@@ -0,0 +1,316 @@
+"""Counters and histograms in Prometheus text format, summed over processes.
+
+Every process (gunicorn workers, processes of the render pool) adds its
+values into its own file in METRICS_DIR mapped into memory, so writing
+is a change of a double in the page cache, without locks between
+processes. The /metrics view reads the files of all processes and sums
+them, files of exited processes are kept, so counters don't go back.
+The directory is cleared at the start of gunicorn (cutter/gunicorn.conf.py).
+
+Without METRICS_DIR the metrics are not collected.
+
+File of a process: [uint32 used bytes][uint32 0] and entries
+[uint32 key length][key, padded to 8 bytes][float64 value],
+the key is JSON of [metric name, {label: value}].
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+
+
+METRICS_FILE_SIZE = 64 * 1024
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_HEADER = struct.Struct('<II')
+_KEY_LENGTH = struct.Struct('<I')
+_VALUE = struct.Struct('<d')
+
+
+def _padded(n):
+    return n + (-n % 8)
+
+
+def _read_entries(data):
+    """
+    :param data: bytes of a file.
+    :return: iterator of (key, value position, value)
+    """
+    if len(data) < _HEADER.size:
+        return
+    used, _ = _HEADER.unpack_from(data, 0)
+    pos = _HEADER.size
+    while pos < used:
+        length, = _KEY_LENGTH.unpack_from(data, pos)
+        key = data[pos + _KEY_LENGTH.size:pos + _KEY_LENGTH.size + length].decode('utf-8')
+        pos += _padded(_KEY_LENGTH.size + length)
+        value, = _VALUE.unpack_from(data, pos)
+        yield key, pos, value
+        pos += _VALUE.size
+
+
+class MmapValues:
+    """Values of the current process in a file mapped into memory."""
+
+    def __init__(self, filename):
+        self._file = open(filename, 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._file.truncate(METRICS_FILE_SIZE)
+            size = METRICS_FILE_SIZE
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+        self._positions = {}
+        self._used, _ = _HEADER.unpack_from(self._map, 0)
+        if self._used == 0:
+            self._used = _HEADER.size
+            _HEADER.pack_into(self._map, 0, self._used, 0)
+        for key, pos, _value in _read_entries(self._map):
+            self._positions[key] = pos
+
+    def _position(self, key):
+        pos = self._positions.get(key)
+        if pos is not None:
+            return pos
+
+        encoded = key.encode('utf-8')
+        entry = _padded(_KEY_LENGTH.size + len(encoded)) + _VALUE.size
+        if self._used + entry > len(self._map):
+            size = len(self._map)
+            while self._used + entry > size:
+                size *= 2
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+
+        start = self._used
+        _KEY_LENGTH.pack_into(self._map, start, len(encoded))
+        self._map[start + _KEY_LENGTH.size:start + _KEY_LENGTH.size + len(encoded)] = encoded
+        pos = start + entry - _VALUE.size
+        _VALUE.pack_into(self._map, pos, 0.0)
+        # запись становится видна читателям только после заполнения
+        self._used += entry
+        _HEADER.pack_into(self._map, 0, self._used, 0)
+
+        self._positions[key] = pos
+        return pos
+
+    def add(self, key, amount):
+        pos = self._position(key)
+        value, = _VALUE.unpack_from(self._map, pos)
+        _VALUE.pack_into(self._map, pos, value + amount)
+
+
+_values = None
+_values_pid = None
+_lock = threading.Lock()
+
+
+def _after_fork():
+    # процессы пула рисования порождаются из воркера, в котором потоки
+    # ResultWriter и MediaEviction могли держать замок в момент fork
+    global _values, _values_pid, _lock
+    _lock = threading.Lock()
+    _values = _values_pid = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _add(key, amount):
+    global _values, _values_pid
+    if not settings.METRICS_DIR:
+        return
+    with _lock:
+        # у порожденного процесса свой файл
+        if _values is None or _values_pid != os.getpid():
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            _values = MmapValues(os.path.join(settings.METRICS_DIR, "{}.db".format(os.getpid())))
+            _values_pid = os.getpid()
+        _values.add(key, amount)
+
+
+def _key(name, labels):
+    return json.dumps([name, labels], sort_keys=True)
+
+
+REGISTRY = {}  # name: metric
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        REGISTRY[name] = self
+
+    def inc(self, amount=1, **labels):
+        if not settings.METRICS_DIR:
+            return
+        _add(_key(self.name, labels), amount)
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float('inf'),)
+        REGISTRY[name] = self
+
+    def observe(self, value, **labels):
+        if not settings.METRICS_DIR:
+            return
+        # в файле счетчик каждой корзины, накопленные суммы считаются при выводе
+        le = next(b for b in self.buckets if value <= b)
+        _add(_key(self.name + '_bucket', dict(labels, le=_format_value(le))), 1)
+        _add(_key(self.name + '_sum', labels), value)
+        _add(_key(self.name + '_count', labels), 1)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+REQUESTS = Counter('cutter_requests_total', "Requests of calculators.", ('calc', 'method'))
+REQUEST_SECONDS = Histogram('cutter_request_seconds', "Time of requests of calculators.", ('calc',))
+RENDER_SECONDS = Histogram('cutter_render_seconds', "Time of drawing and saving of plans.", ('calc', 'format'))
+IMAGE_BYTES = Counter('cutter_image_bytes_total', "Bytes of plan images written.", ('calc', 'format'))
+RENDER_CACHE = Counter('cutter_render_cache_total', "Lookups of plan images: hit - already drawn.", ('calc', 'result'))
+FONT_SEARCHES = Counter('cutter_watermark_font_searches_total', "Searches of the watermark font size.")
+FONT_ITERATIONS = Counter('cutter_watermark_font_iterations_total', "Text measurements of the font size searches.")
+DB_WRITE_SECONDS = Histogram('cutter_db_write_seconds', "Time of saving of results.", ('mode',))
+MEDIA_EVICTED = Counter('cutter_media_evicted_total', "Plan images deleted by the size limit of media.")
+MEDIA_EVICTED_BYTES = Counter('cutter_media_evicted_bytes_total', "Bytes of plan images deleted by the size limit of media.")
+STAGE_SECONDS = Histogram('cutter_stage_seconds', "Time of the stages of requests and of render jobs (calc/timing.py).",
+                          ('stage',))
+RESULTS = Counter('cutter_results_total', "Results by the way they ended: written, dropped, failed.", ('status',))
+
+
+def observe_request(calc):
+    """Decorator of the view of the calculator."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with REQUEST_SECONDS.time(calc=calc):
+                response = view(request, *args, **kwargs)
+            REQUESTS.inc(calc=calc, method=request.method)
+            return response
+        return wrapper
+    return decorator
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        k, str(v).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+    ) for k, v in sorted(labels.items())) + '}'
+
+
+def collect(path=None):
+    """Values of all processes summed.
+    :return: {(sample name, labels as sorted tuple): value}
+    """
+    path = path or settings.METRICS_DIR
+    samples = {}
+    if not path or not os.path.isdir(path):
+        return samples
+
+    for filename in os.listdir(path):
+        if not filename.endswith('.db'):
+            continue
+        try:
+            with open(os.path.join(path, filename), 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        for key, _pos, value in _read_entries(data):
+            name, labels = json.loads(key)
+            sample = (name, tuple(sorted(labels.items())))
+            samples[sample] = samples.get(sample, 0.0) + value
+    return samples
+
+
+def exposition(samples):
+    """Prometheus text format of collect() result."""
+    by_metric = {}
+    for (name, labels), value in samples.items():
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in REGISTRY:
+                metric = name[:-len(suffix)]
+                break
+        else:
+            metric = name
+        by_metric.setdefault(metric, []).append((name, dict(labels), value))
+
+    lines = []
+    for metric in sorted(by_metric):
+        registered = REGISTRY.get(metric)
+        if registered is not None:
+            lines.append("# HELP {} {}".format(metric, registered.documentation))
+            lines.append("# TYPE {} {}".format(metric, registered.type))
+
+        rows = by_metric[metric]
+        if isinstance(registered, Histogram):
+            rows = _cumulative(rows, registered)
+        else:
+            rows = sorted(rows, key=lambda row: (row[0], sorted(row[1].items())))
+
+        for name, labels, value in rows:
+            lines.append("{}{} {}".format(name, _labels(labels), _format_value(value)))
+
+    return "\n".join(lines) + "\n"
+
+
+def _cumulative(rows, histogram):
+    """Counts of buckets into cumulative ones, every series gets all buckets.
+    :return: rows of series: buckets by growing 'le', _sum, _count.
+    """
+    series = {}  # labels: {'le': count, '_sum': value, '_count': value}
+    for name, labels, value in rows:
+        if name.endswith('_bucket'):
+            field = labels.pop('le')
+        else:
+            field = name[len(histogram.name):]
+        series.setdefault(tuple(sorted(labels.items())), {})[field] = value
+
+    result = []
+    for labels in sorted(series):
+        values = series[labels]
+        total = 0.0
+        for le in histogram.buckets:
+            total += values.get(_format_value(le), 0.0)
+            result.append((histogram.name + '_bucket', dict(labels, le=_format_value(le)), total))
+        result.append((histogram.name + '_sum', dict(labels), values.get('_sum', 0.0)))
+        result.append((histogram.name + '_count', dict(labels), values.get('_count', 0.0)))
+    return result
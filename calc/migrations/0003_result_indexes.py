@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calc', '0002_auto_20161104_1514'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='result',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['ts'], name='calc_result_ts_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['name', 'ts'], name='calc_result_name_ts_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import BrinIndex
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -10,5 +11,12 @@ class Result(models.Model):
     ip = models.GenericIPAddressField(verbose_name=_("Client IP"))
     ts = models.DateTimeField(verbose_name=_("Timestamp"), auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # строки добавляются по времени: BRIN на ts в сотни раз меньше B-tree
+            BrinIndex(fields=['ts'], name='calc_result_ts_brin'),
+            models.Index(fields=['name', 'ts'], name='calc_result_name_ts_idx'),
+        ]
+
     def __str__(self):
         return self.name
@@ -0,0 +1,403 @@
+"""Reuse of offcuts of cut tiles.
+
+Every cut tile of a layout leaves an offcut which often fits another
+cut place: the rest of the tile at the corner of walls, the top row
+of a wall, the next edge of the floor. Cut pieces are packed into
+tiles by a shelf heuristic:
+
+- pieces are grouped by height, the highest groups are packed first;
+- a tile (or an offcut left by higher groups) is cut into strips of
+  the group height, pieces are put into strips by best fit decreasing;
+- the rest of strips and tiles becomes offcuts for the next groups.
+
+Pieces are kept as counts of distinct sizes, so the time depends on the
+number of different cuts (tens for a room), not on the number of tiles.
+Sizes are integer micrometers to keep the arithmetic exact.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, defaultdict
+from math import ceil
+
+from .layout import Outline, CUT_SPLIT
+
+
+def _um(value):
+    """mm -> integer micrometers"""
+    return int(round(value * 1000))
+
+
+def _add_piece(pieces, w, h, n=1):
+    """Count n pieces of the size (µm), a sliver of the float error (0 µm) is not a piece."""
+    if w and h:
+        pieces[w, h] += n
+
+
+class OffcutPlan:
+    """
+    :ivar tiles: number of tiles to buy.
+    :ivar whole: number of tiles laid without cuts.
+    :ivar pieces: number of cut pieces.
+    :ivar waste_area: area of the tiles to buy which is not laid (m²).
+    """
+    __slots__ = ('tiles', 'whole', 'pieces', 'waste_area')
+
+    def __init__(self, tiles, whole, pieces, waste_area):
+        self.tiles = tiles
+        self.whole = whole
+        self.pieces = pieces
+        self.waste_area = waste_area
+
+
+class _Strips:
+    """Multiset of strips by remaining length."""
+    __slots__ = ('lengths', 'count')
+
+    def __init__(self):
+        self.lengths = []  # ascending distinct lengths
+        self.count = Counter()
+
+    def add(self, length, n=1):
+        if length <= 0 or n <= 0:
+            return
+        if not self.count[length]:
+            insort(self.lengths, length)
+        self.count[length] += n
+
+    def take(self, length, n):
+        self.count[length] -= n
+        if not self.count[length]:
+            del self.count[length]
+            self.lengths.remove(length)
+
+    def best_fit(self, length):
+        """The shortest strip which length fits in or None."""
+        i = bisect_left(self.lengths, length)
+        if i < len(self.lengths):
+            return self.lengths[i]
+        return None
+
+    def items(self):
+        return ((length, self.count[length]) for length in self.lengths)
+
+
+def pack_pieces(pieces, tile_width, tile_height):
+    """Number of new tiles the pieces can be cut from.
+    :param pieces: Counter of (width, height): number of pieces, sizes in µm.
+    :param tile_width: (µm)
+    :param tile_height: (µm)
+    :rtype: int
+    """
+    tiles = 0
+    offcuts = Counter()  # (width, height): number
+
+    by_height = defaultdict(list)
+    for (w, h), n in pieces.items():
+        if n > 0 and w > 0 and h > 0:
+            by_height[h].append((w, n))
+
+    for h in sorted(by_height, reverse=True):
+        strips = _Strips()
+        per_tile = tile_height // h
+
+        # подходящие по высоте обрезки режем на полосы
+        rest = Counter()
+        for (ow, oh), n in offcuts.items():
+            k = oh // h
+            strips.add(ow, n * k)
+            if oh - k * h:
+                rest[ow, oh - k * h] += n
+        offcuts = rest
+
+        for w, n in sorted(by_height[h], reverse=True):
+            while n:
+                length = strips.best_fit(w)
+                if length is None:
+                    # новые плитки: полос хватает на все оставшиеся куски
+                    k = tile_width // w
+                    need = int(ceil(n / k))
+                    new = int(ceil(need / per_tile))
+                    tiles += new
+                    strips.add(tile_width, new * per_tile)
+                    if tile_height - per_tile * h:
+                        offcuts[tile_width, tile_height - per_tile * h] += new
+                    continue
+
+                k = length // w
+                used = min(strips.count[length], int(ceil(n / k)))
+                strips.take(length, used)
+                placed = min(n, used * k)
+                # все полосы, кроме последней, заполнены по k кусков
+                strips.add(length - k * w, used - 1)
+                strips.add(length - (placed - (used - 1) * k) * w)
+                n -= placed
+
+        for length, n in strips.items():
+            offcuts[length, h] += n
+
+    return tiles
+
+
+def _segments(bands, i, seams):
+    """Pieces of the tile i along the axis, a tile at the corner of walls is cut in parts."""
+    start, end = bands.start[i], bands.end[i]
+    if bands.flags[i] & CUT_SPLIT:
+        edges = [start] + [s for s in seams if start < s < end] + [end]
+        return list(zip(edges, edges[1:]))
+    return [(start, end)]
+
+
+def _subtract(x0, y0, x1, y1, opening):
+    """Rectangle minus opening, an L-shaped rest is replaced by its bounding box."""
+    ox0, oy0, ox1, oy1 = opening
+    if ox1 <= x0 or ox0 >= x1 or oy1 <= y0 or oy0 >= y1:
+        return [(x0, y0, x1, y1)]
+
+    covers_x = ox0 <= x0 and ox1 >= x1
+    covers_y = oy0 <= y0 and oy1 >= y1
+    if covers_x and covers_y:
+        return []
+    if covers_y:
+        parts = [(x0, y0, ox0, y1), (ox1, y0, x1, y1)]
+    elif covers_x:
+        parts = [(x0, y0, x1, oy0), (x0, oy1, x1, y1)]
+    else:
+        return [(x0, y0, x1, y1)]
+    return [p for p in parts if p[2] > p[0] and p[3] > p[1]]
+
+
+def _rect_grid_pieces(layout, grid, pieces):
+    """Add cut pieces of the grid of rectangular tiles.
+    :return: number of tiles laid without cuts.
+    """
+    cols, rows = grid.cols, grid.rows
+    W, H = _um(cols.size), _um(rows.size)
+
+    def band_sizes(bands, seams):
+        sizes = Counter()
+        whole = 0
+        for i in range(len(bands)):
+            if not bands.flags[i]:
+                whole += 1
+                continue
+            for a, b in _segments(bands, i, seams):
+                size = _um(b - a)
+                if size:
+                    sizes[size] += 1
+        return sizes, whole
+
+    col_sizes, whole_cols = band_sizes(cols, layout.seams)
+    row_sizes, whole_rows = band_sizes(rows, ())
+
+    for w, nw in col_sizes.items():
+        pieces[w, H] += nw * whole_rows
+        for h, nh in row_sizes.items():
+            pieces[w, h] += nw * nh
+    for h, nh in row_sizes.items():
+        pieces[W, h] += nh * whole_cols
+    whole = whole_cols * whole_rows
+
+    # плитки в проемах не кладутся, на краях проемов - подрезаются,
+    # плитка между соседними проемами режется по обоим
+    touched = defaultdict(list)  # (column, row): openings
+    for opening in layout.openings:
+        ci, cj = cols.overlapping(opening[0], opening[2])
+        ri, rj = rows.overlapping(opening[1], opening[3])
+        for i in range(ci, cj):
+            for j in range(ri, rj):
+                touched[i, j].append(opening)
+
+    for (i, j), openings in touched.items():
+        col_segments = _segments(cols, i, layout.seams)
+        y0, y1 = rows.start[j], rows.end[j]
+        if not cols.flags[i] and not rows.flags[j]:
+            whole -= 1
+        else:
+            for x0, x1 in col_segments:
+                _add_piece(pieces, _um(x1 - x0), _um(y1 - y0), -1)
+        for x0, x1 in col_segments:
+            parts = [(x0, y0, x1, y1)]
+            for opening in openings:
+                parts = [rest for part in parts for rest in _subtract(*part, opening)]
+            for px0, py0, px1, py1 in parts:
+                _add_piece(pieces, _um(px1 - px0), _um(py1 - py0))
+
+    return whole
+
+
+def _outline_grid_pieces(layout, grid, pieces):
+    """Add cut pieces of the grid clipped by the outline of the room and the obstacles, row by row.
+    A piece at a sloping side is taken as its bounding box, a diamond cut
+    by the outline or an obstacle takes the whole tile, a diamond cut only
+    by the edge of the rectangle is a piece of its depth (_diamond_grid_pieces()).
+    :return: (number of tiles laid without cuts,
+        area of the diamonds taken whole which is not laid (µm²))
+    """
+    cols, rows = grid.cols, grid.rows
+    W, H = _um(cols.size), _um(rows.size)
+    cut_cols = [c for c in range(len(cols)) if cols.flags[c]]
+    whole = 0
+    unused = 0
+    room = layout.outline or Outline([(0, 0), (layout.width, 0), (layout.width, layout.height), (0, layout.height)])
+
+    for r in range(len(rows)):
+        y0, y1 = rows.start[r], rows.end[r]
+        h = _um(y1 - y0)
+        if not h:
+            continue
+        covered, touched = layout.spans(y0, y1)
+
+        # внутри контура на всю высоту ряда режут только края прямоугольника
+        inner = []
+        for x0, x1 in covered:
+            i, j = cols.inside(x0, x1)
+            if j <= i:
+                continue
+            inner.append((i, j))
+            if not rows.flags[r]:
+                whole += cols.uncut(i, j)
+            elif grid.diamond:
+                _add_piece(pieces, h, H, cols.uncut(i, j))
+            else:
+                pieces[W, h] += cols.uncut(i, j)
+            for c in cut_cols[bisect_left(cut_cols, i):bisect_left(cut_cols, j)]:
+                if grid.diamond:
+                    depth = _um(cols.end[c] - cols.start[c])
+                    # угловой кусок берет целую плитку
+                    if depth:
+                        _add_piece(pieces, W if rows.flags[r] else depth, H)
+                    continue
+                for a, b in _segments(cols, c, layout.seams):
+                    _add_piece(pieces, _um(b - a), h)
+
+        # на сторонах контура и препятствий кусок - часть плитки, которая кладется, по X
+        starts = [a for a, _b in touched]
+        for i, j in cols.overlapping_ranges(touched):
+            for c in _ranges_minus(i, j, inner):
+                start, end = cols.start[c], cols.end[c]
+                parts = [(max(a, start), min(b, end))
+                         for a, b in touched[max(bisect_right(starts, start) - 1, 0):bisect_left(starts, end)]
+                         if b > start]
+                if not grid.diamond:
+                    for a, b in parts:
+                        _add_piece(pieces, _um(b - a), h)
+                elif parts:
+                    # каждая часть ромба - из целой плитки, остальное от этих плиток - в отходы
+                    _add_piece(pieces, W, H, len(parts))
+                    laid = _diamond_laid_area(room, layout.obstacles, cols, rows, c, r)
+                    unused += max(len(parts) * cols.size ** 2 / 2 - laid, 0) * 10**6
+
+    return whole, unused
+
+
+def _diamond_laid_area(room, obstacles, cols, rows, c, r):
+    """Area of the diamond (c, r) inside the room out of the obstacles (mm²).
+    :type room: Outline
+    :type obstacles: Obstacles or None
+    """
+    half = cols.size / 2
+    cx, cy = cols.origin[c] + half, rows.origin[r] + half
+    diamond = Outline([(cx, cy - half), (cx + half, cy), (cx, cy + half), (cx - half, cy)])
+    area = room.overlap(diamond)
+    if obstacles is not None:
+        # препятствия внутри помещения и не пересекаются
+        area -= sum(p.overlap(diamond) for p in obstacles.near(cx - half, cy - half, cx + half, cy + half))
+    return area
+
+
+def _ranges_minus(i, j, ranges):
+    """Indexes of [i, j) out of the ascending disjoint ranges."""
+    c = i
+    for a, b in ranges:
+        if b <= c:
+            continue
+        if a >= j:
+            break
+        for n in range(c, min(a, j)):
+            yield n
+        c = max(c, b)
+    for n in range(c, j):
+        yield n
+
+
+def _diamond_grid_pieces(grid, pieces):
+    """Add cut pieces of the grid of diamonds.
+    A diamond cut across one diagonal leaves a diamond cut across the same
+    diagonal from the other side, so the pieces are packed by their depth
+    along the diagonal like strips. Corner pieces take the whole tile.
+    :return: number of tiles laid without cuts.
+    """
+    cols, rows = grid.cols, grid.rows
+    D = _um(cols.size)
+
+    def depths(bands):
+        sizes = Counter()
+        whole = 0
+        for i in range(len(bands)):
+            if not bands.flags[i]:
+                whole += 1
+                continue
+            depth = _um(bands.end[i] - bands.start[i])
+            if depth:
+                sizes[depth] += 1
+        return sizes, whole
+
+    col_depths, whole_cols = depths(cols)
+    row_depths, whole_rows = depths(rows)
+
+    for d, n in col_depths.items():
+        pieces[d, D] += n * whole_rows
+    for d, n in row_depths.items():
+        pieces[d, D] += n * whole_cols
+    pieces[D, D] += sum(col_depths.values()) * sum(row_depths.values())
+
+    return whole_cols * whole_rows
+
+
+def _diamond_piece_area(depth, diagonal):
+    """Area of the diamond cut across the diagonal at the depth (µm²)."""
+    half = diagonal / 2
+    if depth <= half:
+        return depth ** 2
+    return diagonal ** 2 / 2 - (diagonal - depth) ** 2
+
+
+def _tile_area(width, height, diamond):
+    if diamond:
+        return _diamond_piece_area(width, width)
+    return width * height
+
+
+def plan_offcuts(layout):
+    """
+    :type layout: Layout
+    :rtype: OffcutPlan
+    """
+    tiles = whole = count = 0
+    waste = 0  # µm²
+
+    # куски режутся только из плиток своего размера
+    tile_pieces = defaultdict(Counter)
+    for grid in layout.grids:
+        key = (_um(grid.cols.size), _um(grid.rows.size), grid.diamond)
+        # у прямоугольных проемов стен куски считаются точнее, по прямоугольникам
+        if layout.outline is not None or layout.obstacles is not None:
+            grid_whole, unused = _outline_grid_pieces(layout, grid, tile_pieces[key])
+            whole += grid_whole
+            waste += unused
+        elif grid.diamond:
+            whole += _diamond_grid_pieces(grid, tile_pieces[key])
+        else:
+            whole += _rect_grid_pieces(layout, grid, tile_pieces[key])
+
+    tiles = whole
+    for (w, h, diamond), pieces in tile_pieces.items():
+        new = pack_pieces(pieces, w, h)
+        tiles += new
+        waste += new * _tile_area(w, h, diamond)
+
+        for (pw, ph), n in pieces.items():
+            count += n
+            waste -= n * (_diamond_piece_area(pw, w) if diamond else pw * ph)
+
+    return OffcutPlan(tiles, whole, count, max(waste, 0) / 10**12)
+
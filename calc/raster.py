@@ -0,0 +1,372 @@
+"""NumPy raster compositor of plans.
+
+Draws the same pictures as draw_floor() and draw_bathroom(), but without
+a Python loop over tiles: the canvas is an array of palette indexes,
+tiles of a grid are painted at once by broadcasting of row and column
+bands of the layout, and the image is made by one Image.fromarray() call.
+
+Coordinates are truncated to int like ImageDraw does.
+"""
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .drawing import floor_scale, walls_frame, plan_points, WALLS_WIDTH_PX, WALLS_HEIGHT_PX
+from .layout import CUT_LO, CUT_HI
+from .timing import stage
+from .watermark import get_watermark_alpha, WATERMARK_FILL
+
+
+# Palette indexes
+BACKGROUND = 0
+TILE = 1
+TILE_EDGE = 2
+TILE_CUT = 3
+CONTOUR = 4
+DOOR = 5
+
+PALETTE = np.array([
+    (255, 255, 255, 255),  # BACKGROUND
+    (185, 203, 218, 255),  # TILE: #b9cbda
+    (120, 120, 120, 255),  # TILE_EDGE
+    (255, 0, 0, 255),      # TILE_CUT
+    (80, 80, 80, 255),     # CONTOUR
+    (255, 255, 255, 255),  # DOOR
+], dtype=np.uint8)
+
+
+# Watermark is blended into the palette: every color has shades of
+# the watermark, so an indexed image needs len(PALETTE) * WATERMARK_LEVELS colors.
+WATERMARK_LEVELS = 8
+
+
+def to_image(canvas):
+    """
+    :param canvas: 2D array of palette indexes.
+    :rtype: PIL.Image
+    """
+    return Image.fromarray(PALETTE[canvas], 'RGBA')
+
+
+def to_palette_image(canvas, text=None, path=None):
+    """Indexed image without conversion to RGBA.
+    :param canvas: 2D array of palette indexes, the watermark is added into it.
+    :param text: watermark text.
+    :param path: watermark font.
+    :rtype: PIL.Image in 'P' mode
+    """
+    colors = PALETTE[:, :3].astype(np.float64)
+
+    if text:
+        with stage('watermark'):
+            height, width = canvas.shape
+            (x, y), alpha = get_watermark_alpha(text, path, (width, height))
+            max_alpha = WATERMARK_FILL[3]
+            if alpha is not None:
+                level = (alpha.astype(np.uint16) * (WATERMARK_LEVELS - 1) + max_alpha // 2) // max_alpha
+                # только под текстом, без копии всего холста
+                canvas[y:y + alpha.shape[0], x:x + alpha.shape[1]] += level.astype(np.uint8) * len(PALETTE)
+
+            # оттенки цветов под водяным знаком (черный с прозрачностью)
+            fill = np.array(WATERMARK_FILL[:3], dtype=np.float64)
+            shades = []
+            for n in range(WATERMARK_LEVELS):
+                a = n / (WATERMARK_LEVELS - 1) * max_alpha / 255.0
+                shades.append(colors * (1 - a) + fill * a)
+            colors = np.concatenate(shades)
+
+    image = Image.fromarray(canvas, 'P')
+    image.putpalette(np.rint(colors).astype(np.uint8).ravel().tolist())
+    return image
+
+
+def hline(canvas, y, x0, x1, color):
+    """Horizontal line with both ends included, clipped by canvas."""
+    y, x0, x1 = int(y), int(x0), int(x1)
+    if x0 > x1:
+        x0, x1 = x1, x0
+    if 0 <= y < canvas.shape[0]:
+        canvas[y, max(x0, 0):max(x1 + 1, 0)] = color
+
+
+def vline(canvas, x, y0, y1, color):
+    """Vertical line with both ends included, clipped by canvas."""
+    x, y0, y1 = int(x), int(y0), int(y1)
+    if y0 > y1:
+        y0, y1 = y1, y0
+    if 0 <= x < canvas.shape[1]:
+        canvas[max(y0, 0):max(y1 + 1, 0), x] = color
+
+
+def fill_rect(canvas, x0, y0, x1, y1, color):
+    x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
+    if x0 > x1:
+        x0, x1 = x1, x0
+    if y0 > y1:
+        y0, y1 = y1, y0
+    canvas[max(y0, 0):max(y1 + 1, 0), max(x0, 0):max(x1 + 1, 0)] = color
+
+
+def _band_index(length, starts, ends):
+    """Number of the band for every pixel of the axis or -1.
+    :param starts: ascending starts of bands (px), ends included.
+    """
+    pos = np.arange(length)
+    index = np.searchsorted(starts, pos, side='right') - 1
+    inside = index >= 0
+    inside[inside] = pos[inside] <= ends[index[inside]]
+    index[~inside] = -1
+    return index
+
+
+def _edge_color(cut):
+    return np.where(cut, TILE_CUT, TILE_EDGE).astype(np.uint8)
+
+
+def _own_lines(positions, colors, starts, size):
+    """Visible lines which belong to the last band drawn over their pixel.
+    draw_tile_shape() draws tile by tile, so a pixel gets the lines of the last tile over it, not the last line.
+    Tiles of a huge room are smaller than a pixel, so the canvas is painted once per pixel, not per tile.
+    :param positions: int array, a line of every band (px).
+    :param starts: ascending starts of bands (px).
+    :return: (positions, colors)
+    """
+    owner = np.searchsorted(starts, positions, side='right') - 1
+    own = (owner == np.arange(len(positions))) & (positions >= 0) & (positions < size)
+    return positions[own], colors[own]
+
+
+def paint_tiles(canvas, x0, x1, cut_left, cut_right, y0, y1, cut_top, cut_bottom):
+    """Paint grid of tiles like draw_tile_shape() does for every tile of the grid.
+    :param x0, x1: int arrays of ascending columns (px), ends included.
+    :param cut_left, cut_right: bool arrays of cut sides of columns.
+    :param y0, y1: int arrays of ascending rows (px), ends included.
+    :param cut_top, cut_bottom: bool arrays of cut sides of rows.
+    """
+    if not len(x0) or not len(y0):
+        return
+
+    height, width = canvas.shape
+    in_col = _band_index(width, x0, x1) >= 0
+    in_row = _band_index(height, y0, y1) >= 0
+
+    # fill shape
+    canvas[np.ix_(in_row, in_col)] = TILE
+
+    def paint_rows(ys, cut):
+        ys, colors = _own_lines(ys, _edge_color(cut), y0, height)
+        canvas[np.ix_(ys, in_col)] = colors[:, None]
+
+    def paint_cols(xs, cut):
+        xs, colors = _own_lines(xs, _edge_color(cut), x0, width)
+        canvas[np.ix_(in_row, xs)] = colors[None, :]
+
+    # lines in the order of draw_tile_shape(): the bottom line of a tile
+    # is over its sides, the top one is under them
+    paint_rows(y0, cut_top)
+    paint_cols(x0, cut_left)
+    paint_cols(x1, cut_right)
+    paint_rows(y1, cut_bottom)
+
+
+def paint_diamonds(canvas, cx, rx, cut_x, cy, ry, cut_y):
+    """Paint tiles turned by 45° inscribed in the crossings of columns and rows.
+    :param cx, cy: int arrays of ascending centers of columns and rows (px).
+    :param rx, ry: half of the diagonals (px).
+    :param cut_x, cut_y: bool arrays, tile is cut if its column or row is cut.
+    """
+    if not len(cx) or not len(cy):
+        return
+
+    height, width = canvas.shape
+
+    def distance(length, centers, radius):
+        """Distance to the center of the band relative to radius, inf out of bands."""
+        pos = np.arange(length)
+        index = _band_index(length, centers - radius, centers + radius)
+        dist = np.full(length, np.inf)
+        inside = index >= 0
+        dist[inside] = np.abs(pos[inside] - centers[index[inside]]) / max(radius, 1)
+        return dist, np.maximum(index, 0)
+
+    dx, ix = distance(width, cx, rx)
+    dy, iy = distance(height, cy, ry)
+
+    dist = dy[:, None] + dx[None, :]
+    inside = dist <= 1
+    # контур толщиной в 1px
+    edge = inside & (dist > 1 - 0.75 / max(rx, ry, 1))
+    cut = cut_y[iy][:, None] | cut_x[ix][None, :]
+
+    canvas[inside] = TILE
+    canvas[edge] = np.where(cut, TILE_CUT, TILE_EDGE)[edge]
+
+
+def paint_layout(canvas, layout, sf, x, y, x_from, x_to):
+    """Same as drawing.draw_layout_tiles().
+    :param sf: scale factor (px in mm).
+    :param x, y: position of x_from on the canvas (px).
+    """
+    x, y = int(x), int(y)
+
+    def px_x(values):
+        return x + ((np.asarray(values) - x_from) * sf).astype(np.int64)
+
+    def px_y(values):
+        return y + (np.asarray(values) * sf).astype(np.int64)
+
+    for grid in layout.grids:
+        cols, rows = grid.cols, grid.rows
+        ci, cj = cols.overlapping(x_from, x_to)
+
+        col_start = np.frombuffer(cols.start, dtype=np.float64)[ci:cj]
+        col_end = np.frombuffer(cols.end, dtype=np.float64)[ci:cj]
+        col_flags = np.frombuffer(cols.flags, dtype=np.int8)[ci:cj]
+        row_start = np.frombuffer(rows.start, dtype=np.float64)
+        row_end = np.frombuffer(rows.end, dtype=np.float64)
+        row_flags = np.frombuffer(rows.flags, dtype=np.int8)
+
+        if grid.diamond:
+            col_center = np.frombuffer(cols.origin, dtype=np.float64)[ci:cj] + cols.size/2
+            row_center = np.frombuffer(rows.origin, dtype=np.float64) + rows.size/2
+            paint_diamonds(
+                canvas,
+                px_x(col_center), int(cols.size/2 * sf), col_flags != 0,
+                px_y(row_center), int(rows.size/2 * sf), row_flags != 0
+            )
+            continue
+
+        # плитка на стыке стен рисуется частями на обеих стенах
+        paint_tiles(
+            canvas,
+            px_x(np.maximum(col_start, x_from)), px_x(np.minimum(col_end, x_to)),
+            ((col_flags & CUT_LO) != 0) | (col_start < x_from),
+            ((col_flags & CUT_HI) != 0) | (col_end > x_to),
+            px_y(row_start), px_y(row_end),
+            (row_flags & CUT_LO) != 0, (row_flags & CUT_HI) != 0
+        )
+
+    # проемы (двери) без плитки
+    for x0, y0, x1, y1 in layout.openings:
+        if x1 <= x_from or x0 >= x_to:
+            continue
+        left, right = px_x(max(x0, x_from)), px_x(min(x1, x_to))
+        top, bottom = px_y(y0), px_y(y1)
+        fill_rect(canvas, left, top, right, bottom, DOOR)
+
+        if x0 > 0:
+            vline(canvas, left, top, bottom, TILE_CUT)
+        if x1 < layout.width:
+            vline(canvas, right, top, bottom, TILE_CUT)
+        if y0 > 0:
+            hline(canvas, top, left, right, TILE_CUT)
+        if y1 < layout.height:
+            hline(canvas, bottom, left, right, TILE_CUT)
+
+
+def paint_outline(canvas, points):
+    """Same as drawing.draw_outline(): the mask of the polygon is drawn by PIL,
+    so pixels of its edges are the same.
+    :param points: result of drawing.plan_points().
+    """
+    height, width = canvas.shape
+    mask = Image.new('L', (width, height), 0)
+    d = ImageDraw.Draw(mask)
+    d.polygon(points, fill=1)
+    d.line(points + points[:1], fill=2, width=1)
+    mask = np.asarray(mask)
+
+    canvas[mask == 0] = BACKGROUND
+    canvas[mask == 2] = TILE_CUT
+
+
+def paint_obstacles(canvas, polygons):
+    """Same as drawing.draw_obstacles().
+    :param polygons: list of results of drawing.plan_points().
+    """
+    height, width = canvas.shape
+    mask = Image.new('L', (width, height), 0)
+    d = ImageDraw.Draw(mask)
+    for points in polygons:
+        d.polygon(points, fill=1)
+    for points in polygons:
+        d.line(points + points[:1], fill=2, width=1)
+    mask = np.asarray(mask)
+
+    canvas[mask == 1] = DOOR
+    canvas[mask == 2] = TILE_CUT
+
+
+def raster_bathroom(layout, palette=False, watermark=None):
+    """Same picture as draw_bathroom().
+    :type layout: Layout
+    :param palette: indexed 'P' image instead of 'RGBA'.
+    :param watermark: (text, font path) to blend into the indexed image.
+    :rtype: PIL.Image
+    """
+    sf, walls, sp, wall_del_px, contour_px, padding_px = walls_frame(layout)
+
+    def to_pixels(value):
+        return int(sf * value)
+
+    canvas = np.full((WALLS_HEIGHT_PX, WALLS_WIDTH_PX), BACKGROUND, dtype=np.uint8)
+    x, y = sp.x, sp.y
+    hpix = to_pixels(layout.height)
+
+    for x_from, x_to in walls:
+        wpix = to_pixels(x_to - x_from)
+
+        # общий контур стены
+        hline(canvas, y, x, x + wpix, CONTOUR)
+        vline(canvas, x + wpix, y, y + hpix, CONTOUR)
+        hline(canvas, y + hpix, x, x + wpix, CONTOUR)
+        vline(canvas, x, y, y + hpix, CONTOUR)
+
+        # внешний контур для размеров
+        for cx, cy, dx, dy in ((x, y, -1, -1), (x + wpix, y, 1, -1),
+                               (x, y + hpix, -1, 1), (x + wpix, y + hpix, 1, 1)):
+            hline(canvas, cy, cx, cx + dx * contour_px, CONTOUR)
+            vline(canvas, cx, cy, cy + dy * contour_px, CONTOUR)
+
+        paint_layout(canvas, layout, sf, x, y, x_from, x_to)
+        x += wpix + wall_del_px
+
+    real_width = x - wall_del_px + padding_px
+    if real_width < WALLS_WIDTH_PX:
+        canvas = canvas[:, :real_width]
+
+    if palette:
+        return to_palette_image(canvas, *(watermark or ()))
+    return to_image(canvas)
+
+
+def raster_floor(layout, palette=False, watermark=None):
+    """Same picture as draw_floor().
+    :type layout: Layout
+    :param palette: indexed 'P' image instead of 'RGBA'.
+    :param watermark: (text, font path) to blend into the indexed image.
+    :rtype: PIL.Image
+    """
+    sf, size = floor_scale(layout)
+
+    canvas = np.full((size.height, size.width), BACKGROUND, dtype=np.uint8)
+    paint_layout(canvas, layout, sf, 0, 0, 0, layout.width)
+
+    def to_pixels(value):
+        return int(sf * value)
+
+    if layout.outline is not None:
+        paint_outline(canvas, plan_points(layout.outline.vertices, to_pixels, size))
+    else:
+        # периметр
+        right, bottom = size.width - 1, size.height - 1
+        hline(canvas, 0, 0, right, TILE_CUT)
+        hline(canvas, bottom, 0, right, TILE_CUT)
+        vline(canvas, 0, 0, bottom, TILE_CUT)
+        vline(canvas, right, 0, bottom, TILE_CUT)
+
+    if layout.obstacles is not None:
+        paint_obstacles(canvas, [plan_points(p.vertices, to_pixels, size) for p in layout.obstacles.polygons])
+
+    if palette:
+        return to_palette_image(canvas, *(watermark or ()))
+    return to_image(canvas)
@@ -0,0 +1,479 @@
+"""Content-addressed cache of rendered plans.
+
+The name of a plan image is a hash of the normalized calculation
+parameters, so identical requests share one file in MEDIA_ROOT and
+a repeated request costs a single stat() instead of drawing and encoding.
+
+Plans are served by the plan_image view at a URL with the canonical
+parameters (plan_url()), the image is drawn again if it was deleted and
+its bytes are kept in LRU of the worker (plan_bytes).
+"""
+import hashlib
+import inspect
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+from .algorithms import draw_floor, save_image
+from .drawing import draw_bathroom, DRAWING_WATERMARK_TEXT, DRAWING_WATERMARK_FONT
+from .layout import floor_layout, walls_layout
+from .raster import raster_floor, raster_bathroom
+from .svg import svg_floor, svg_walls, save_svg
+from .media import touch
+from .metrics import RENDER_SECONDS, RENDER_CACHE, IMAGE_BYTES
+from .timing import stage
+from .watermark import apply_watermark
+
+
+# Increase after any change of the drawing code: old images will not be reused.
+RENDER_CACHE_VERSION = 2
+
+IMAGE_FORMAT_PNG = 'png'
+IMAGE_FORMAT_SVG = 'svg'
+IMAGE_FORMATS = (IMAGE_FORMAT_PNG, IMAGE_FORMAT_SVG)
+
+
+def _mm(value):
+    """Normalize length in mm, so 2500 and 2500.0000001 give the same key."""
+    if value is None:
+        return None
+    return round(float(value), 3)
+
+
+def _points(text):
+    points = []
+    for point in text.split(';'):
+        if not point.strip():
+            continue
+        x, y = (float(v) for v in point.split(','))
+        if not (math.isfinite(x) and math.isfinite(y)):
+            raise ValueError("vertex must be finite: {}".format(point))
+        points.append((x, y))
+    return points
+
+
+def parse_vertices(text):
+    """Vertices from "x,y; x,y; ..." (mm).
+    :return: list of (x, y)
+    :raises ValueError: not a list of at least 3 finite points.
+    """
+    vertices = _points(text)
+    if len(vertices) < 3:
+        raise ValueError("at least 3 vertices are required")
+    return vertices
+
+
+def format_vertices(vertices):
+    """Text of parse_vertices()."""
+    return ';'.join("{},{}".format(repr(x), repr(y)) for x, y in vertices)
+
+
+def parse_obstacles(text):
+    """Polygons from lines (or parts separated by "|") of parse_vertices(),
+    a rectangle may be given by two opposite corners: "x0,y0; x1,y1".
+    :return: list of lists of (x, y)
+    :raises ValueError:
+    """
+    polygons = []
+    for part in text.replace('\n', '|').split('|'):
+        if not part.strip():
+            continue
+        points = _points(part)
+        if len(points) == 2:
+            (x0, y0), (x1, y1) = points
+            points = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+        elif len(points) < 3:
+            raise ValueError("obstacle needs 2 corners or at least 3 vertices: {}".format(part))
+        polygons.append(points)
+    return polygons
+
+
+def format_obstacles(polygons):
+    """Text of parse_obstacles()."""
+    return '|'.join(format_vertices(vertices) for vertices in polygons)
+
+
+def parse_openings(text):
+    """Openings of walls from lines (or parts separated by "|") of
+    "wall, offset, width, height[, height above the floor]" (mm), walls are numbered from 1.
+    :return: list of (wall index, offset, width, height, bottom)
+    :raises ValueError:
+    """
+    openings = []
+    for part in text.replace('\n', '|').split('|'):
+        if not part.strip():
+            continue
+        values = [float(v) for v in part.split(',')]
+        if len(values) == 4:
+            values.append(0.0)
+        if len(values) != 5 or not all(math.isfinite(v) and v >= 0 for v in values):
+            raise ValueError("opening must be 4 or 5 non-negative numbers: {}".format(part))
+        wall = values[0]
+        if wall != int(wall) or not 1 <= wall <= 4:
+            raise ValueError("no wall {}".format(part))
+        openings.append((int(wall) - 1,) + tuple(values[1:]))
+    return openings
+
+
+def format_openings(openings):
+    """Text of parse_openings()."""
+    return '|'.join(
+        ','.join([str(int(wall) + 1)] + [repr(float(v)) for v in values]) for wall, *values in openings
+    )
+
+
+def _vertices(vertices, min_x, min_y):
+    """Normalize the polygon: moved by (-min_x, -min_y), without repeated vertices."""
+    result = []
+    for x, y in vertices:
+        point = [_mm(x - min_x), _mm(y - min_y)]
+        if not result or point != result[-1]:
+            result.append(point)
+    if len(result) > 1 and result[0] == result[-1]:
+        result.pop()
+    return result
+
+
+def floor_params(width, length, tile_width, tile_length, delimiter, method, outline=None, obstacles=None):
+    """
+    :param width: width of floor (mm)
+    :param length: length of floor (mm)
+    :param tile_width: (mm)
+    :param tile_length: (mm)
+    :param delimiter: (mm)
+    :param method: method of tile laying.
+    :param outline: vertices [(x, y)] of the floor which is not a rectangle (mm),
+        X - along the length, width and length are its bounding box then.
+    :param obstacles: list of vertices [(x, y)] of fixtures on the floor (mm),
+        in the same coordinates as the outline.
+    :return: normalized parameters of the floor plan.
+    :rtype: dict
+    """
+    min_x = min_y = 0
+    if outline:
+        min_x = min(x for x, _y in outline)
+        min_y = min(y for _x, y in outline)
+        outline = _vertices(outline, min_x, min_y)
+        length = max(x for x, _y in outline)
+        width = max(y for _x, y in outline)
+    else:
+        outline = None
+
+    if obstacles:
+        obstacles = [_vertices(vertices, min_x, min_y) for vertices in obstacles]
+    else:
+        obstacles = None
+
+    return {
+        'width': _mm(width),
+        'length': _mm(length),
+        'tile_width': int(tile_width),
+        'tile_length': int(tile_length),
+        'delimiter': _mm(delimiter),
+        'method': int(method),
+        'outline': outline,
+        'obstacles': obstacles,
+    }
+
+
+def walls_params(length, width, height, tile_length, tile_width, delimiter, door_width=None, door_height=None,
+                 openings=None):
+    """All values in mm. Door is ignored if one of its sizes is not set.
+    :param openings: list of (wall index, offset, width, height, bottom) of doors, windows, niches.
+    :return: normalized parameters of the walls plan.
+    :rtype: dict
+    """
+    if door_width is None or door_height is None:
+        door_width = door_height = None
+
+    if openings:
+        openings = sorted([int(wall)] + [_mm(v) for v in values] for wall, *values in openings)
+    else:
+        openings = None
+
+    return {
+        'length': _mm(length),
+        'width': _mm(width),
+        'height': _mm(height),
+        'tile_length': int(tile_length),
+        'tile_width': int(tile_width),
+        'delimiter': _mm(delimiter),
+        'door_width': _mm(door_width),
+        'door_height': _mm(door_height),
+        'openings': openings,
+    }
+
+
+def render_key(kind, params, image_format=IMAGE_FORMAT_PNG):
+    """Canonical hash of the plan parameters.
+    :param kind: 'floor' or 'walls'
+    :param params: result of floor_params() or walls_params()
+    :param image_format: one of IMAGE_FORMATS.
+    :rtype: str
+    """
+    payload = json.dumps(
+        [RENDER_CACHE_VERSION, settings.DRAWING_RENDERER, kind, params, image_format],
+        sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+LAYOUTS = {
+    'floor': floor_layout,
+    'walls': walls_layout,
+}
+
+PARAMS = {
+    'floor': floor_params,
+    'walls': walls_params,
+}
+
+CONTENT_TYPES = {
+    IMAGE_FORMAT_PNG: 'image/png',
+    IMAGE_FORMAT_SVG: 'image/svg+xml',
+}
+
+
+# параметры, которые не числа: (разбор, запись) в строке запроса
+QUERY_VALUES = {
+    'outline': (parse_vertices, format_vertices),
+    'obstacles': (parse_obstacles, format_obstacles),
+    'openings': (parse_openings, format_openings),
+}
+
+
+def _query_value(name, value):
+    if name in QUERY_VALUES:
+        return QUERY_VALUES[name][1](value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def plan_query(params):
+    """Canonical query string of the parameters: sorted, without unset values."""
+    return urlencode([
+        (name, _query_value(name, value))
+        for name, value in sorted(params.items()) if value is not None
+    ])
+
+
+def parse_plan_query(kind, query):
+    """Parameters of the plan from the query string.
+    :param kind: 'floor' or 'walls'
+    :param query: dict-like of strings (request.GET)
+    :return: result of floor_params() or walls_params()
+    :raises ValueError: unknown kind, missing or invalid values.
+    """
+    func = PARAMS.get(kind)
+    if func is None:
+        raise ValueError("unknown plan: {}".format(kind))
+
+    values = {}
+    for name, parameter in inspect.signature(func).parameters.items():
+        value = query.get(name)
+        if value in (None, ''):
+            if parameter.default is inspect.Parameter.empty:
+                raise ValueError("{} is required".format(name))
+            continue
+        if name in QUERY_VALUES:
+            values[name] = QUERY_VALUES[name][0](value)
+            continue
+        value = float(value)
+        if not math.isfinite(value) or value < 0:
+            raise ValueError("{} must be a non-negative number".format(name))
+        values[name] = value
+    return func(**values)
+
+
+def plan_url(kind, params, image_format=IMAGE_FORMAT_PNG):
+    """URL of the plan_image view, the same for the same plan."""
+    from django.core.urlresolvers import reverse
+    return "{}?{}".format(reverse('plan_image', args=[kind, image_format]), plan_query(params))
+
+
+def get_layout(kind, params):
+    """
+    :param kind: 'floor' or 'walls'
+    :param params: result of floor_params() or walls_params()
+    :rtype: Layout
+    """
+    return LAYOUTS[kind](**params)
+
+
+def render_floor(layout):
+    if settings.DRAWING_RENDERER == 'palette':
+        return raster_floor(layout, palette=True, watermark=(DRAWING_WATERMARK_TEXT, DRAWING_WATERMARK_FONT))
+    if settings.DRAWING_RENDERER == 'raster':
+        return apply_watermark(raster_floor(layout), DRAWING_WATERMARK_TEXT, DRAWING_WATERMARK_FONT)
+    return draw_floor(layout)
+
+
+def render_walls(layout):
+    if settings.DRAWING_RENDERER == 'palette':
+        return raster_bathroom(layout, palette=True, watermark=(DRAWING_WATERMARK_TEXT, DRAWING_WATERMARK_FONT))
+    if settings.DRAWING_RENDERER == 'raster':
+        return apply_watermark(raster_bathroom(layout), DRAWING_WATERMARK_TEXT, DRAWING_WATERMARK_FONT)
+    return draw_bathroom(layout).im
+
+
+RENDERERS = {
+    'floor': render_floor,
+    'walls': render_walls,
+}
+
+SVG_RENDERERS = {
+    'floor': svg_floor,
+    'walls': svg_walls,
+}
+
+
+def render_filename(kind, params, image_format=IMAGE_FORMAT_PNG):
+    """File name of the plan image."""
+    return "{}.{}".format(render_key(kind, params, image_format), image_format)
+
+
+def get_or_render(kind, params, layout=None, path=None, image_format=IMAGE_FORMAT_PNG):
+    """Return the name of the plan image, drawing it only if it does not exist yet.
+    :param kind: 'floor' or 'walls'
+    :param params: result of floor_params() or walls_params()
+    :param layout: layout of params if it's already computed.
+    :param path: directory of images, MEDIA_ROOT by default.
+    :param image_format: one of IMAGE_FORMATS.
+    :return: file name of the image in the path.
+    """
+    path = path or settings.MEDIA_ROOT
+    filename = render_filename(kind, params, image_format)
+
+    if os.path.exists(os.path.join(path, filename)):
+        RENDER_CACHE.inc(calc=kind, result='hit')
+        touch(path, filename)
+        return filename
+    RENDER_CACHE.inc(calc=kind, result='miss')
+
+    if layout is None:
+        layout = get_layout(kind, params)
+
+    with RENDER_SECONDS.time(calc=kind, format=image_format):
+        if image_format == IMAGE_FORMAT_SVG:
+            # документ пишется в файл по частям, без промежуточной картинки
+            with stage('draw'):
+                save_svg(SVG_RENDERERS[kind](layout), path, filename)
+        else:
+            with stage('draw'):
+                image = RENDERERS[kind](layout)
+            save_image(image, path, filename)
+
+    IMAGE_BYTES.inc(os.path.getsize(os.path.join(path, filename)), calc=kind, format=image_format)
+    return filename
+
+
+class BytesCache:
+    """LRU of images limited by their total size.
+    Hits of LRU don't open the file, so the time it was touched is kept with the bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()  # key: [value, touched]
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def touch_due(self, key, interval):
+        """Whether the file of the value must be touched: it wasn't during the interval (s).
+        The time is updated, so only one of concurrent hits touches the file.
+        """
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or now - item[1] < interval:
+                return False
+            item[1] = now
+            return True
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            # файл только что прочитан или нарисован и тронут
+            self._items[key] = [value, time.time()]
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _key, (old, _touched) = self._items.popitem(last=False)
+                self.size -= len(old)
+
+
+plan_bytes = BytesCache(settings.PLAN_CACHE_BYTES)
+
+
+def _lru_plan_bytes(kind, params, image_format, path):
+    """Bytes of the plan image from LRU, the file is touched for eviction once per MEDIA_MIN_AGE.
+    :return: (key, bytes or None)
+    """
+    key = render_key(kind, params, image_format)
+    content = plan_bytes.get(key)
+    if content is not None and plan_bytes.touch_due(key, settings.MEDIA_MIN_AGE):
+        touch(path or settings.MEDIA_ROOT, render_filename(kind, params, image_format))
+    return key, content
+
+
+def cached_plan_bytes(kind, params, image_format=IMAGE_FORMAT_PNG, path=None):
+    """Bytes of the plan image if it is already drawn: from LRU or from the file.
+    :return: bytes or None
+    """
+    key, content = _lru_plan_bytes(kind, params, image_format, path)
+    if content is not None:
+        return content
+
+    path = path or settings.MEDIA_ROOT
+    filename = render_filename(kind, params, image_format)
+    try:
+        with open(os.path.join(path, filename), 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    RENDER_CACHE.inc(calc=kind, result='hit')
+    touch(path, filename)
+
+    plan_bytes.put(key, content)
+    return content
+
+
+def get_plan_bytes(kind, params, image_format=IMAGE_FORMAT_PNG, path=None, layout=None):
+    """Bytes of the plan image: from LRU, from the file or drawn again.
+    :param layout: layout of params if it's already computed.
+    :raises LayoutError: too many tiles.
+    """
+    key, content = _lru_plan_bytes(kind, params, image_format, path)
+    if content is not None:
+        return content
+
+    path = path or settings.MEDIA_ROOT
+    for _ in range(2):
+        filename = get_or_render(kind, params, layout, path, image_format)
+        try:
+            with open(os.path.join(path, filename), 'rb') as f:
+                content = f.read()
+            break
+        except FileNotFoundError:
+            # удален ограничением размера медиа между проверкой и чтением
+            continue
+    else:
+        raise FileNotFoundError(filename)
+
+    plan_bytes.put(key, content)
+    return content
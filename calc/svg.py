@@ -0,0 +1,225 @@
+"""SVG plans.
+
+The same pictures as draw_floor() and draw_bathroom() written as a text
+document straight from the layout. Tiles of a grid are one rectangle
+filled with a pattern of the tile, so the size of the document grows with
+the number of walls and openings, not with the number of tiles.
+Coordinates are in px of the PNG plan, so both look the same.
+"""
+import os
+import uuid
+from bisect import bisect_right
+from xml.sax.saxutils import escape
+
+from .drawing import floor_scale, walls_frame, WALLS_WIDTH_PX, WALLS_HEIGHT_PX, \
+    DRAWING_WATERMARK_TEXT, DRAWING_WATERMARK_FONT
+from .layout import CUT_LO, CUT_HI
+from .watermark import fit_font_size
+
+
+COLOR_TILE = "#b9cbda"
+COLOR_TILE_EDGE = "#787878"
+COLOR_CUT = "#ff0000"
+COLOR_CONTOUR = "#505050"
+COLOR_DOOR = "#ffffff"
+
+
+def _f(value):
+    """Short number for the document."""
+    return "{:.2f}".format(value).rstrip('0').rstrip('.')
+
+
+def _line(x0, y0, x1, y1, color):
+    return '<line x1="{}" y1="{}" x2="{}" y2="{}" stroke="{}"/>\n'.format(
+        _f(x0), _f(y0), _f(x1), _f(y1), color)
+
+
+def _crosses(bands, pos):
+    """Whether a tile of the bands is cut by the line at pos (mm)."""
+    i = bisect_right(bands.origin, pos) - 1
+    return i >= 0 and bands.origin[i] < pos < bands.origin[i] + bands.size
+
+
+def _pattern(pattern_id, grid, delimiter, sf, x, y):
+    """Pattern of one tile with the delimiter.
+    :param x, y: position of the first tile (px).
+    """
+    cols, rows = grid.cols, grid.rows
+    w, h = cols.size * sf, rows.size * sf
+    step_x = (cols.size + delimiter) * sf
+    step_y = (rows.size + delimiter) * sf
+    if grid.diamond:
+        # у диагональной укладки шаг по осям - диагональ плитки с разделителем
+        step_x = step_y = (cols.size + delimiter * 2 ** 0.5) * sf
+        shape = '<polygon points="{},0 {},{} {},{} 0,{}"'.format(
+            _f(w/2), _f(w), _f(h/2), _f(w/2), _f(h), _f(h/2))
+    else:
+        # линия контура не должна обрезаться краем шаблона
+        shape = '<rect x="0.5" y="0.5" width="{}" height="{}"'.format(_f(max(w - 1, 0)), _f(max(h - 1, 0)))
+
+    return (
+        '<pattern id="{}" patternUnits="userSpaceOnUse" x="{}" y="{}" width="{}" height="{}">'
+        '{} fill="{}" stroke="{}" stroke-width="1"/></pattern>\n'
+    ).format(pattern_id, _f(x), _f(y), _f(step_x), _f(step_y), shape, COLOR_TILE, COLOR_TILE_EDGE)
+
+
+def _layout(layout, sf, x, y, x_from, x_to, prefix):
+    """Tiles of the part [x_from, x_to] of the layout, same as drawing.draw_layout_tiles()."""
+    def px_x(value):
+        return x + (value - x_from) * sf
+
+    def px_y(value):
+        return y + value * sf
+
+    left, right = px_x(x_from), px_x(x_to)
+    top, bottom = px_y(0), px_y(layout.height)
+
+    for n, grid in enumerate(layout.grids):
+        if not len(grid.cols) or not len(grid.rows):
+            continue
+        pattern_id = "{}-{}".format(prefix, n)
+        yield '<defs>' + _pattern(
+            pattern_id, grid, layout.delimiter, sf,
+            px_x(grid.cols.origin[0]), px_y(grid.rows.origin[0])
+        ) + '</defs>\n'
+        yield '<rect x="{}" y="{}" width="{}" height="{}" fill="url(#{})"/>\n'.format(
+            _f(left), _f(top), _f(right - left), _f(bottom - top), pattern_id)
+
+    # края с подрезанными плитками
+    grids = [g for g in layout.grids if len(g.cols) and len(g.rows)]
+    if any(g.rows.flags[0] & CUT_LO for g in grids):
+        yield _line(left, top, right, top, COLOR_CUT)
+    if any(g.rows.flags[-1] & CUT_HI for g in grids):
+        yield _line(left, bottom, right, bottom, COLOR_CUT)
+    if any(_crosses(g.cols, x_from) for g in grids):
+        yield _line(left, top, left, bottom, COLOR_CUT)
+    if any(_crosses(g.cols, x_to) for g in grids):
+        yield _line(right, top, right, bottom, COLOR_CUT)
+
+    # проемы (двери) без плитки
+    for x0, y0, x1, y1 in layout.openings:
+        if x1 <= x_from or x0 >= x_to:
+            continue
+        ol, or_ = px_x(max(x0, x_from)), px_x(min(x1, x_to))
+        ot, ob = px_y(y0), px_y(y1)
+        yield '<rect x="{}" y="{}" width="{}" height="{}" fill="{}"/>\n'.format(
+            _f(ol), _f(ot), _f(or_ - ol), _f(ob - ot), COLOR_DOOR)
+
+        if x0 > 0:
+            yield _line(ol, ot, ol, ob, COLOR_CUT)
+        if x1 < layout.width:
+            yield _line(or_, ot, or_, ob, COLOR_CUT)
+        if y0 > 0:
+            yield _line(ol, ot, or_, ot, COLOR_CUT)
+        if y1 < layout.height:
+            yield _line(ol, ob, or_, ob, COLOR_CUT)
+
+
+def _document(width, height, body):
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" viewBox="0 0 {0} {1}">\n'
+        '<rect width="100%" height="100%" fill="#ffffff"/>\n'
+    ).format(width, height)
+
+    for chunk in body:
+        yield chunk
+
+    # watermark
+    size = fit_font_size(DRAWING_WATERMARK_TEXT, DRAWING_WATERMARK_FONT, width, height)
+    yield (
+        '<text x="{}" y="{}" font-family="Arial, sans-serif" font-size="{}" '
+        'text-anchor="middle" dominant-baseline="central" fill="#000000" fill-opacity="0.5">{}</text>\n'
+    ).format(_f(width / 2), _f(height / 2), size, escape(DRAWING_WATERMARK_TEXT))
+    yield '</svg>\n'
+
+
+def svg_floor(layout):
+    """Same picture as draw_floor().
+    :type layout: Layout
+    :return: generator of parts of the document.
+    """
+    sf, size = floor_scale(layout)
+
+    def points(vertices):
+        return ' '.join("{},{}".format(
+            _f(min(x * sf + 0.5, size.width - 0.5)), _f(min(y * sf + 0.5, size.height - 0.5))
+        ) for x, y in vertices)
+
+    def body():
+        if layout.outline is None:
+            for chunk in _layout(layout, sf, 0, 0, 0, layout.width, 'floor'):
+                yield chunk
+            # периметр
+            yield '<rect x="0.5" y="0.5" width="{}" height="{}" fill="none" stroke="{}"/>\n'.format(
+                size.width - 1, size.height - 1, COLOR_CUT)
+        else:
+            # плитки прямоугольника обрезаны контуром помещения
+            outline = points(layout.outline.vertices)
+            yield '<defs><clipPath id="floor-outline"><polygon points="{}"/></clipPath></defs>\n'.format(outline)
+            yield '<g clip-path="url(#floor-outline)">\n'
+            for chunk in _layout(layout, sf, 0, 0, 0, layout.width, 'floor'):
+                yield chunk
+            yield '</g>\n'
+            yield '<polygon points="{}" fill="none" stroke="{}"/>\n'.format(outline, COLOR_CUT)
+
+        # препятствия без плитки
+        for polygon in (layout.obstacles.polygons if layout.obstacles is not None else ()):
+            yield '<polygon points="{}" fill="{}" stroke="{}"/>\n'.format(
+                points(polygon.vertices), COLOR_DOOR, COLOR_CUT)
+
+    return _document(size.width, size.height, body())
+
+
+def svg_walls(layout):
+    """Same picture as draw_bathroom().
+    :type layout: Layout
+    :return: generator of parts of the document.
+    """
+    sf, walls, sp, wall_del_px, contour_px, padding_px = walls_frame(layout)
+    hpix = layout.height * sf
+
+    x, y = sp.x, sp.y
+    positions = []
+    for x_from, x_to in walls:
+        positions.append(x)
+        x += int(sf * (x_to - x_from)) + wall_del_px
+    width = min(x - wall_del_px + padding_px, WALLS_WIDTH_PX)
+
+    def body():
+        for n, (x_from, x_to) in enumerate(walls):
+            x = positions[n]
+            wpix = (x_to - x_from) * sf
+
+            # общий контур стены
+            yield '<rect x="{}" y="{}" width="{}" height="{}" fill="none" stroke="{}"/>\n'.format(
+                _f(x), _f(y), _f(wpix), _f(hpix), COLOR_CONTOUR)
+
+            # внешний контур для размеров
+            for cx, cy, dx, dy in ((x, y, -1, -1), (x + wpix, y, 1, -1),
+                                   (x, y + hpix, -1, 1), (x + wpix, y + hpix, 1, 1)):
+                yield _line(cx, cy, cx + dx * contour_px, cy, COLOR_CONTOUR)
+                yield _line(cx, cy, cx, cy + dy * contour_px, COLOR_CONTOUR)
+
+            for chunk in _layout(layout, sf, x, y, x_from, x_to, 'wall{}'.format(n)):
+                yield chunk
+
+    return _document(width, WALLS_HEIGHT_PX, body())
+
+
+def save_svg(chunks, path, filename=None):
+    """Writes the document part by part, like algorithms.save_image() does.
+    :param chunks: iterable of str.
+    :return: name of the saved file.
+    """
+    if filename is None:
+        filename = str(uuid.uuid4()) + ".svg"
+
+    fullname = os.path.join(path, filename)
+    tmpname = "{}.{}.tmp".format(fullname, uuid.uuid4().hex)
+
+    with open(tmpname, 'w', encoding='utf-8') as f:
+        f.writelines(chunks)
+    os.replace(tmpname, fullname)
+
+    return filename
@@ -1,3 +1,660 @@
-from django.test import TestCase
+import json
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from unittest import mock
 
-# Create your tests here.
+from django.core.urlresolvers import reverse
+from django.http import QueryDict
+from django.test import SimpleTestCase, override_settings
+from PIL import ImageChops
+
+from . import media, metrics, timing
+from .forms import CalcFloorForm, CalcWallForm
+from .kernels import count_floor, count_walls
+from .layout import LayoutError, Outline, floor_layout, walls_layout, merge_intervals, intersect_intervals, subtract_intervals, \
+    LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL
+from .management.commands.quote import quote_counts, quote_row
+from .models import Result
+from .offcuts import pack_pieces
+from .render_cache import floor_params, walls_params, plan_query, plan_url, render_floor, render_walls, \
+    render_filename, cached_plan_bytes, BytesCache, render_key, parse_plan_query
+from .writer import ResultWriter
+
+
+class BandsTestCase(SimpleTestCase):
+    def assertNoSlivers(self, layout):
+        for grid in layout.grids:
+            for bands in (grid.cols, grid.rows):
+                for start, end in zip(bands.start, bands.end):
+                    self.assertGreater(end - start, 1e-6)
+
+    def test_exact_fit_is_not_rounded_up(self):
+        # (6104.6 - 1.8) / (553 + 1.8) = 11 с точностью до округления
+        layout = floor_layout(6090, 6104.6, 181, 553, 1.8, LAYING_METHOD_DIRECT)
+        self.assertEqual(len(layout.grids[0].cols), 11)
+        self.assertEqual(layout.count(), 374)
+        self.assertNoSlivers(layout)
+
+    def test_center(self):
+        for width, length, tile, delimiter in ((3000, 3000, 300, 0), (6090, 6104.6, 181, 1.8), (1002, 3006, 300, 2)):
+            self.assertNoSlivers(floor_layout(width, length, tile, tile, delimiter, LAYING_METHOD_DIRECT_CENTER))
+
+    def test_pickle(self):
+        # раскладка уходит в процесс рисования вместе с задачей
+        layout = floor_layout(3000, 5000, 300, 300, 2, LAYING_METHOD_DIAGONAL,
+                              [(0, 0), (5000, 0), (5000, 2000), (2000, 3000), (0, 3000)])
+        counts = layout.count(), layout.cut_count()
+        copy = pickle.loads(pickle.dumps(layout))
+        self.assertEqual(copy._scans, {})
+        self.assertEqual((copy.count(), copy.cut_count()), counts)
+
+    def test_walls_exact_fit(self):
+        layout = walls_layout(5234.4, 670, 1501.2, 287, 246, 3.6)
+        self.assertEqual(layout.count(), 246)
+        self.assertNoSlivers(layout)
+
+
+class IntervalsTestCase(SimpleTestCase):
+    def test_merge(self):
+        self.assertEqual(merge_intervals([(5, 6), (0, 2), (1, 3), (3, 4), (7, 7), (8, 6)]), [(0, 4), (5, 6)])
+        self.assertEqual(merge_intervals([(0, 10), (2, 3)]), [(0, 10)])
+        self.assertEqual(merge_intervals([]), [])
+
+    def test_intersect(self):
+        first = [(0, 4), (6, 10)]
+        self.assertEqual(intersect_intervals(first, [(2, 7), (9, 12)]), [(2, 4), (6, 7), (9, 10)])
+        self.assertEqual(intersect_intervals(first, [(4, 6)]), [])
+        self.assertEqual(intersect_intervals(first, []), [])
+
+    def test_subtract(self):
+        first = [(0, 4), (6, 10)]
+        self.assertEqual(subtract_intervals(first, [(1, 2), (3, 7), (9, 12)]), [(0, 1), (2, 3), (7, 9)])
+        self.assertEqual(subtract_intervals(first, [(-1, 11)]), [])
+        self.assertEqual(subtract_intervals(first, [(4, 6)]), first)
+
+
+class OutlineTestCase(SimpleTestCase):
+    def test_spans(self):
+        room = Outline([(0, 0), (4000, 0), (4000, 2000), (2000, 2000), (2000, 3000), (0, 3000)])
+        self.assertEqual(room.spans(1000, 1500), ([(0, 4000)], [(0, 4000)]))
+        # полоса через внутренний угол: вся - только до 2000, частично - до 4000
+        self.assertEqual(room.spans(1500, 2500), ([(0, 2000)], [(0, 4000)]))
+        self.assertEqual(room.spans(2500, 3000), ([(0, 2000)], [(0, 2000)]))
+        self.assertEqual(room.spans(3000, 3500), ([], []))
+
+    def test_sloping_side(self):
+        triangle = Outline([(0, 0), (4000, 0), (0, 2000)])
+        self.assertEqual(triangle.spans(0, 1000), ([(0, 2000)], [(0, 4000)]))
+        self.assertEqual(triangle.area(), 4000000)
+
+    def test_invalid(self):
+        for vertices in ([(0, 0), (1, 1)], [(0, 0), (1, 1), (2, 2)]):
+            with self.assertRaises(LayoutError):
+                Outline(vertices)
+
+
+class LayoutBruteForceTestCase(SimpleTestCase):
+    """Layout.count() and cut_count() against the area of every tile in the room."""
+
+    def brute_force(self, layout, room, obstacles=()):
+        laid = whole = 0
+        for grid in layout.grids:
+            cols, rows = grid.cols, grid.rows
+            for c in range(len(cols)):
+                for r in range(len(rows)):
+                    x0, x1, y0, y1 = cols.start[c], cols.end[c], rows.start[r], rows.end[r]
+                    tile = Outline([(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
+                    area = room.overlap(tile) - sum(o.overlap(tile) for o in obstacles)
+                    if area > 1e-6:
+                        laid += 1
+                        whole += not cols.flags[c] and not rows.flags[r] and area > tile.area() - 1e-6
+        return laid, laid - whole
+
+    def assertBruteForce(self, layout, room, obstacles=()):
+        self.assertEqual((layout.count(), layout.cut_count()), self.brute_force(layout, room, obstacles))
+
+    def test_outline(self):
+        outlines = [
+            [(0, 0), (4000, 0), (4000, 2000), (2000, 2000), (2000, 3000), (0, 3000)],
+            [(0, 0), (3500, 0), (4100, 1300), (2200, 3100), (300, 2500)],
+            [(0, 1000), (1500, 0), (2900, 1700), (1200, 2600)],
+        ]
+        for vertices in outlines:
+            x1 = max(x for x, _y in vertices)
+            y1 = max(y for _x, y in vertices)
+            for method in (LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL):
+                layout = floor_layout(y1, x1, 300, 300, 2, method, vertices)
+                self.assertBruteForce(layout, Outline(vertices))
+
+    def test_obstacles(self):
+        rnd = random.Random(3)
+        for method in (LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL):
+            # препятствия не ближе плитки друг к другу
+            polygons = []
+            for x in range(200, 5500, 1300):
+                for y in range(200, 3500, 1300):
+                    x0, y0 = x + rnd.uniform(0, 300), y + rnd.uniform(0, 300)
+                    x1, y1 = x0 + rnd.uniform(100, 600), y0 + rnd.uniform(100, 600)
+                    polygons.append([(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
+            layout = floor_layout(4000, 6000, 250, 250, 1.5, method, obstacles=polygons)
+            room = Outline([(0, 0), (6000, 0), (6000, 4000), (0, 4000)])
+            self.assertBruteForce(layout, room, [Outline(p) for p in polygons])
+
+    def test_exact_fit_in_outline(self):
+        # регрессия: лишний ряд на краю, кончающемся ровно на плитке
+        vertices = [(0, 0), (6104.6, 0), (6104.6, 6090), (0, 6090)]
+        layout = floor_layout(6090, 6104.6, 181, 553, 1.8, LAYING_METHOD_DIRECT, vertices)
+        self.assertEqual(layout.count(), 374)
+        self.assertBruteForce(layout, Outline(vertices))
+
+
+class PackPiecesTestCase(SimpleTestCase):
+    def test_pieces_of_one_tile(self):
+        self.assertEqual(pack_pieces(Counter({(100000, 300000): 3}), 300000, 300000), 1)
+        self.assertEqual(pack_pieces(Counter({(200000, 300000): 3}), 300000, 300000), 3)
+
+    def test_degenerate_pieces(self):
+        pieces = Counter({(0, 100000): 3, (100000, 0): 2, (100000, 100000): 1, (50000, 50000): 0})
+        self.assertEqual(pack_pieces(pieces, 300000, 300000), 1)
+        self.assertEqual(pack_pieces(Counter({(0, 0): 1}), 300000, 300000), 0)
+
+
+class OffcutsFormTestCase(SimpleTestCase):
+    def test_float_slivers(self):
+        forms = [
+            CalcFloorForm({'width': 6.09, 'length': 6.1046, 'tile_width': 181, 'tile_length': 553,
+                           'delimiter': 1.8, 'method': LAYING_METHOD_DIRECT, 'reserve': 5}),
+            CalcWallForm({'length': 5.2344, 'width': 0.67, 'height': 1.5012, 'tile_length': 287, 'tile_width': 246,
+                          'delimiter': 3.6, 'reserve': 5}),
+        ]
+        for form in forms:
+            self.assertTrue(form.is_valid(), form.errors)
+            result, _cost, _img, _reserve, _area, cut, plan = form.calc(render=False)
+            self.assertLessEqual(plan.tiles, result)
+            self.assertEqual(plan.whole, result - cut)
+
+    def test_diamonds_in_outline(self):
+        data = {'width': 3, 'length': 5, 'tile_width': 400, 'tile_length': 400, 'delimiter': 1.5,
+                'method': LAYING_METHOD_DIAGONAL, 'reserve': 5}
+        results = []
+        for extra in ({}, {'outline': '0,0; 5000,0; 5000,3000; 0,3000'}, {'obstacles': '1000,1000; 1600,1600'}):
+            form = CalcFloorForm(dict(data, **extra))
+            self.assertTrue(form.is_valid(), form.errors)
+            results.append(form.results(render=False))
+        # контур совпадает с прямоугольником - те же куски
+        self.assertEqual([(r['buy'], r['waste_area']) for r in results[:2]], [(105, 0.82), (105, 0.82)])
+        # плитки под препятствием уходят в отходы
+        self.assertEqual(results[2]['buy'], 105)
+        self.assertAlmostEqual(results[2]['waste_area'] - results[0]['waste_area'], 0.36, delta=0.01)
+
+
+class ObstaclesTestCase(SimpleTestCase):
+    L_SHAPE = '0,0; 4000,0; 4000,2000; 2000,2000; 2000,3000; 0,3000'
+
+    def form(self, **data):
+        return CalcFloorForm(dict({'width': 3, 'length': 5, 'tile_width': 300, 'tile_length': 300, 'delimiter': 2,
+                                   'method': LAYING_METHOD_DIRECT, 'reserve': 5}, **data))
+
+    def test_overlap(self):
+        square = Outline([(0, 0), (2, 0), (2, 2), (0, 2)])
+        self.assertEqual(square.overlap(Outline([(1, 1), (3, 1), (3, 3), (1, 3)])), 1)
+        self.assertEqual(square.overlap(Outline([(2, 0), (4, 0), (4, 2), (2, 2)])), 0)
+        # ромб, вписанный в квадрат: ребра пересекаются между вершинами
+        self.assertAlmostEqual(square.overlap(Outline([(1, -0.5), (2.5, 1), (1, 2.5), (-0.5, 1)])), 3.5)
+        self.assertAlmostEqual(square.overlap(Outline([(0, 0), (2, 0), (0, 2)])), 2)
+
+    def test_invalid(self):
+        for data in (
+            {'obstacles': '-100,-100; 99999,99999'},
+            {'obstacles': '0,0; 600,600\n0,0; 600,600'},
+            {'obstacles': '3000,2200; 4000,3000', 'outline': self.L_SHAPE},
+            {'obstacles': '0,0; 2000,0; 0,2000\n1999,0; 2000,2000; 0,2000', 'outline': self.L_SHAPE},
+        ):
+            form = self.form(**data)
+            self.assertFalse(form.is_valid(), data)
+            self.assertEqual(list(form.errors), ['obstacles'])
+
+    def test_total_area(self):
+        for data, area in (
+            ({'obstacles': '0,0; 600,600\n600,0; 1200,600'}, 14.28),
+            ({'obstacles': '0,0; 2000,0; 0,2000\n2000,0; 2000,2000; 0,2000', 'outline': self.L_SHAPE}, 6.0),
+        ):
+            form = self.form(**data)
+            self.assertTrue(form.is_valid(), form.errors)
+            self.assertEqual(form.results(render=False)['total_area'], area)
+
+
+class OpeningsTestCase(SimpleTestCase):
+    def form(self, openings, **data):
+        return CalcWallForm(dict({'length': 3, 'width': 2.5, 'height': 2.5, 'tile_width': 300, 'tile_length': 300,
+                                  'delimiter': 2, 'reserve': 5, 'openings': openings}, **data))
+
+    def test_check_openings(self):
+        for openings in (
+            '1, 500, 1000, 0, 900',
+            '1, 500, 0, 1000, 900',
+            '1, 2500, 1000, 1000',
+            '2, 0, 1000, 1000, 2000',
+            '1, 0, 1000, 1000\n1, 500, 1000, 1000, 500',
+            '1, 0, 1000, 1000\n1, 999, 1000, 1000',
+        ):
+            form = self.form(openings)
+            self.assertFalse(form.is_valid(), openings)
+            self.assertEqual(list(form.errors), ['openings'])
+
+        # проем под дверью на третьей стене
+        form = self.form('3, 1000, 1000, 500', door_width=0.8, door_height=2)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(list(form.errors), ['openings'])
+
+        form = self.form('1, 0, 1000, 1000\n1, 1000, 1000, 1000, 1000\n4, 0, 2500, 2500')
+        self.assertTrue(form.is_valid(), form.errors)
+
+    def test_total_area(self):
+        form = self.form('1, 500, 1000, 1000, 900', door_width=0.8, door_height=2)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.results(render=False)['total_area'], 27.5 - 1 - 1.6)
+
+
+@override_settings(CALC_BATCH_TOKENS=['secret'], METRICS_DIR='')
+class BatchTestCase(SimpleTestCase):
+    def post(self, payload, token='secret'):
+        headers = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+        return self.client.post(reverse('batch'), json.dumps(payload), content_type='application/json', **headers)
+
+    def test_token(self):
+        self.assertEqual(self.post({'rooms': []}, token=None).status_code, 401)
+        self.assertEqual(self.post({'rooms': []}, token='wrong').status_code, 401)
+        self.assertEqual(self.post({'rooms': []}).status_code, 200)
+
+    def test_invalid_rooms(self):
+        response = self.post({'rooms': [{'name': 'floor', 'data': [1, 2]}, {'name': ['floor']}, 'floor']})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([list(r['errors']) for r in results], [['data'], ['name'], ['name']])
+
+
+class KernelsTestCase(SimpleTestCase):
+    def test_floor_equals_layout(self):
+        rnd = random.Random(1)
+        for _ in range(500):
+            method = rnd.choice((LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL))
+            tile_width = rnd.randint(50, 600)
+            tile_length = tile_width if method == LAYING_METHOD_DIAGONAL else rnd.randint(50, 600)
+            delimiter = round(rnd.uniform(0, 5), 1)
+            if rnd.random() < 0.5:
+                # ряд плиток кончается ровно у стены
+                length = delimiter + rnd.randint(1, 20) * (tile_length + delimiter)
+                width = delimiter + rnd.randint(1, 20) * (tile_width + delimiter)
+            else:
+                length, width = rnd.uniform(300, 8000), rnd.uniform(300, 8000)
+            args = (width, length, tile_width, tile_length, delimiter, method)
+            self.assertEqual(int(count_floor(*args)), floor_layout(*args).count(), args)
+
+    def test_walls_equals_layout(self):
+        rnd = random.Random(2)
+        for _ in range(500):
+            length, width, height = rnd.uniform(300, 6000), rnd.uniform(300, 6000), rnd.uniform(1000, 3000)
+            door = rnd.choice(((None, None), (rnd.uniform(300, min(1000, length)), rnd.uniform(500, height))))
+            args = (length, width, height, rnd.randint(50, 600), rnd.randint(50, 600), round(rnd.uniform(0, 5), 1))
+            self.assertEqual(int(count_walls(*args, *[v or 0 for v in door])), walls_layout(*args, *door).count(), args)
+
+    def test_walls_exact_fit(self):
+        rnd = random.Random(3)
+        for _ in range(500):
+            tile_length, tile_width, delimiter = rnd.randint(50, 600), rnd.randint(50, 600), round(rnd.uniform(0, 5), 1)
+            step_x, step_y = tile_length + delimiter, tile_width + delimiter
+            # высота и периметр кончаются ровно на плитке, края двери - на краях плиток
+            length = delimiter / 4 + rnd.randint(5, 20) * step_x / 2
+            width = delimiter / 4 + rnd.randint(5, 20) * step_x / 2
+            height = delimiter + rnd.randint(8, 20) * step_y
+            start = length + width + length / 2
+            k, n = int((start - delimiter) // step_x), rnd.randint(1, 3)
+            door_width = min(2 * (start - delimiter - (k - n) * step_x), length, width)
+            door_height = min(rnd.randint(3, 8) * step_y, height)
+            args = (length, width, height, tile_length, tile_width, delimiter)
+            for door in ((None, None), (door_width, door_height)):
+                self.assertEqual(int(count_walls(*args, *[v or 0 for v in door])), walls_layout(*args, *door).count(),
+                                 (args, door))
+
+    def test_door_at_tile_edges(self):
+        # край двери совпадает с краем плитки с точностью до округления
+        for args, door in (
+            ((4925, 4200, 2449, 85, 107, 3.7), (774, 1869)),
+            ((4070.3, 1742.8, 2252.3, 76, 122, 4.4), (544.3, 1264)),
+        ):
+            self.assertEqual(int(count_walls(*args, *door)), walls_layout(*args, *door).count(), args)
+
+
+class RasterTestCase(SimpleTestCase):
+    """The raster renderer draws the same pixels as PIL."""
+
+    def assertSamePixels(self, render, layout):
+        with override_settings(DRAWING_RENDERER='pil'):
+            expected = render(layout).convert('RGB')
+        with override_settings(DRAWING_RENDERER='raster'):
+            image = render(layout).convert('RGB')
+        self.assertEqual(image.size, expected.size)
+        # рамка отличающихся пикселей
+        self.assertIsNone(ImageChops.difference(image, expected).getbbox())
+
+    def test_walls(self):
+        for door in ((None, None), (800, 2000), (700, 2100, [(0, 500, 1000, 1200, 900), (3, 300, 600, 400, 1000)])):
+            for tile, delimiter in (((400, 400), 1.5), ((300, 200), 2), ((250, 100), 0)):
+                self.assertSamePixels(render_walls, walls_layout(3000, 2500, 2500, *tile, delimiter, *door))
+
+    def test_floor(self):
+        outline = [(0, 0), (4000, 0), (4000, 2000), (2000, 2000), (2000, 3000), (0, 3000)]
+        obstacles = [[(500, 500), (1100, 500), (1100, 900), (500, 900)]]
+        for method in (LAYING_METHOD_DIRECT, LAYING_METHOD_DIRECT_CENTER, LAYING_METHOD_DIAGONAL):
+            self.assertSamePixels(render_floor, floor_layout(3000, 5000, 400, 400, 1.5, method))
+            self.assertSamePixels(render_floor, floor_layout(3000, 4000, 300, 300, 2, method, outline))
+            self.assertSamePixels(render_floor, floor_layout(3000, 4000, 300, 300, 2, method, obstacles=obstacles))
+
+
+class QuoteTestCase(SimpleTestCase):
+    def test_quote_counts(self):
+        rows = [
+            (1, {'name': 'floor', 'width': '6.09', 'length': '6.1046', 'tile_width': '181', 'tile_length': '553',
+                 'delimiter': '1.8', 'method': '1', 'reserve': '5', 'price': '10'}),
+            (2, {'name': 'floor', 'width': '3', 'length': '4', 'tile_width': '300', 'tile_length': '300',
+                 'delimiter': '2', 'method': '3', 'reserve': '5', 'outline': '0,0; 4000,0; 0,3000'}),
+            (3, {'name': 'walls', 'width': '2.5', 'length': '3', 'height': '2.7', 'tile_width': '200',
+                 'tile_length': '300', 'delimiter': '2', 'reserve': '10', 'door_width': '0.8', 'door_height': '2'}),
+            (4, {'name': 'walls', 'width': '2.5', 'length': '3', 'height': '2.7', 'tile_width': '0',
+                 'tile_length': '300', 'delimiter': '2', 'reserve': '10'}),
+            (5, {'name': 'bath'}),
+        ]
+        fields = ['line', 'name', 'result', 'reserve', 'total', 'cost', 'total_area', 'errors']
+        for counted, row in zip(quote_counts(rows), rows):
+            quoted = quote_row(row)
+            self.assertEqual([counted.get(f) for f in fields], [quoted.get(f) for f in fields])
+
+    def test_failed_row(self):
+        row = (2, {'name': 'floor', 'width': '3', 'length': '4', 'tile_width': '300', 'tile_length': '300',
+                   'delimiter': '2', 'method': '1', 'reserve': '5'})
+        with mock.patch.object(CalcFloorForm, 'results', side_effect=ZeroDivisionError("division by zero")):
+            output = quote_row(row)
+        self.assertEqual(output['errors'], {'__all__': ["Calculation failed: ZeroDivisionError: division by zero"]})
+        self.assertNotIn('result', output)
+
+
+class ResultWriterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+        self.written = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        patcher = mock.patch.object(Result.objects, 'bulk_create', side_effect=self.bulk_create)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bulk_create(self, batch):
+        self.batches.append(list(batch))
+        self.written.set()
+        self.release.wait(5)
+
+    def writer(self, max_size=10, flush_size=100, flush_interval=60):
+        writer = ResultWriter(max_size, flush_size, flush_interval)
+        self.addCleanup(writer.stop)
+        return writer
+
+    def test_flush_size(self):
+        writer = self.writer(flush_size=2)
+        for result in (1, 2, 3):
+            writer.put(result)
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(self.batches, [[1, 2]])
+        writer.stop()
+        self.assertEqual(self.batches, [[1, 2], [3]])
+        self.assertEqual(writer.stats(), {'queued': 3, 'written': 3, 'dropped': 0, 'failed': 0, 'pending': 0})
+
+    def test_flush_interval(self):
+        writer = self.writer(flush_interval=0.05)
+        writer.put(1)
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(self.batches, [[1]])
+        writer.stop()
+        self.assertEqual(self.batches, [[1]])
+        self.assertEqual(writer.written, 1)
+
+    def test_queue_full(self):
+        writer = self.writer(max_size=1, flush_size=1)
+        self.release.clear()
+        self.assertTrue(writer.put(1))
+        # поток пишет первую запись, в очереди место для одной
+        self.assertTrue(self.written.wait(5))
+        self.assertTrue(writer.put(2))
+        self.assertFalse(writer.put(3))
+        self.release.set()
+        writer.stop()
+        self.assertEqual(self.batches, [[1], [2]])
+        self.assertEqual(writer.stats(), {'queued': 2, 'written': 2, 'dropped': 1, 'failed': 0, 'pending': 0})
+
+    def test_stop_flushes_queue(self):
+        writer = self.writer()
+        for result in (1, 2, 3):
+            writer.put(result)
+        writer.stop()
+        self.assertEqual(self.batches, [[1, 2, 3]])
+        self.assertEqual(writer.written, 3)
+
+
+class TimingTestCase(SimpleTestCase):
+    def test_stages_go_to_totals(self):
+        with mock.patch.object(timing.STAGE_SECONDS, 'observe') as observe:
+            timing.start()
+            for _ in range(2):
+                with timing.stage('draw'):
+                    pass
+            timings = timing.finish('job')
+        self.assertEqual([name for name, _seconds in timings], ['draw', 'job'])
+        self.assertEqual(sorted(call[2]['stage'] for call in observe.mock_calls), ['draw', 'job'])
+
+    def test_off(self):
+        self.assertIsNone(timing.finish())
+        with timing.stage('draw'):
+            pass
+        self.assertIsNone(timing.finish())
+
+
+@override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'], METRICS_TRUSTED_PROXIES=['10.0.0.1'], METRICS_DIR='')
+class MetricsTestCase(SimpleTestCase):
+    def get(self, remote_addr, forwarded=None):
+        headers = {'REMOTE_ADDR': remote_addr}
+        if forwarded:
+            headers['HTTP_X_FORWARDED_FOR'] = forwarded
+        return self.client.get(reverse('metrics'), **headers).status_code
+
+    def test_allowed_ips(self):
+        self.assertEqual(self.get('127.0.0.1'), 200)
+        self.assertEqual(self.get('8.8.8.8'), 403)
+        self.assertEqual(self.get('8.8.8.8', '127.0.0.1'), 403)
+        # через прокси клиент - последний адрес
+        self.assertEqual(self.get('10.0.0.1', '127.0.0.1'), 200)
+        self.assertEqual(self.get('10.0.0.1', '127.0.0.1, 8.8.8.8'), 403)
+
+    def test_lock_after_fork(self):
+        with metrics._lock:
+            pid = os.fork()
+            if pid == 0:
+                os._exit(0 if metrics._lock.acquire(timeout=5) else 1)
+        _pid, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+
+@override_settings(MEDIA_MAX_BYTES=0, MEDIA_MAX_FILES=3, MEDIA_MIN_AGE=3600, MEDIA_KEEP_REFERENCED_DAYS=0)
+class MediaTestCase(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.path = media_root.name
+
+    def write(self, name, age, size=10):
+        filename = os.path.join(self.path, name)
+        with open(filename, 'wb') as f:
+            f.write(b'x' * size)
+        mtime = time.time() - age
+        os.utime(filename, (mtime, mtime))
+
+    def test_select_victims(self):
+        images = [(50, 100, 'e.png'), (10, 100, 'a.png'), (30, 100, 'c.png'), (20, 100, 'b.png'), (40, 100, 'd.png')]
+        self.assertEqual([n for _m, _s, n in media.select_victims(images, 0, 3, set(), 100)], ['a.png', 'b.png'])
+        self.assertEqual([n for _m, _s, n in media.select_victims(images, 250, 0, set(), 100)], ['a.png', 'b.png', 'c.png'])
+        # файлы из keep пропускаются, вместо них удаляются следующие
+        self.assertEqual([n for _m, _s, n in media.select_victims(images, 0, 3, {'a.png'}, 100)], ['b.png', 'c.png'])
+        # недавно использованные не удаляются, даже если лимит превышен
+        self.assertEqual([n for _m, _s, n in media.select_victims(images, 0, 3, set(), 20)], ['a.png'])
+        self.assertEqual(media.select_victims(images, 0, 5, set(), 100), [])
+
+    def test_evict(self):
+        for i, name in enumerate(('a.png', 'b.svg', 'c.png', 'd.svg', 'e.png')):
+            self.write(name, 7200 - i * 1500)
+        self.write('old.tmp', media.TMP_MAX_AGE + 60)
+        self.write('new.tmp', 60)
+        self.write('notes.txt', 9000)
+
+        self.assertEqual(media.evict(self.path, dry_run=True), (2, 20, 3, 30))
+        self.assertEqual(len(os.listdir(self.path)), 8)
+
+        # d.svg и e.png использованы позже MEDIA_MIN_AGE
+        with override_settings(MEDIA_MAX_FILES=1):
+            self.assertEqual(media.evict(self.path, limit=2), (2, 20, 3, 30))
+        self.assertEqual(sorted(os.listdir(self.path)), ['c.png', 'd.svg', 'e.png', 'new.tmp', 'notes.txt'])
+        with override_settings(MEDIA_MAX_FILES=1):
+            self.assertEqual(media.evict(self.path), (1, 10, 2, 20))
+        self.assertEqual(sorted(os.listdir(self.path)), ['d.svg', 'e.png', 'new.tmp', 'notes.txt'])
+
+    def test_lru_hit_touches_file(self):
+        params = floor_params(3000, 5000, 300, 300, 2, LAYING_METHOD_DIRECT)
+        filename = render_filename('floor', params, 'svg')
+        self.write(filename, 7200)
+        lru = mock.patch('calc.render_cache.plan_bytes', BytesCache(10**6))
+        lru.start()
+        self.addCleanup(lru.stop)
+
+        def mtime():
+            return os.path.getmtime(os.path.join(self.path, filename))
+
+        self.assertIsNotNone(cached_plan_bytes('floor', params, 'svg', self.path))
+        self.assertGreater(mtime(), time.time() - 60)
+
+        # из LRU: файл не трогается чаще раза в MEDIA_MIN_AGE
+        os.utime(os.path.join(self.path, filename), (time.time() - 600, time.time() - 600))
+        cached_plan_bytes('floor', params, 'svg', self.path)
+        self.assertLess(mtime(), time.time() - 60)
+        with override_settings(MEDIA_MIN_AGE=0):
+            cached_plan_bytes('floor', params, 'svg', self.path)
+        self.assertGreater(mtime(), time.time() - 60)
+
+
+class RenderKeyTestCase(SimpleTestCase):
+    OUTLINE = [(0, 0), (4000, 0), (4000, 2000), (2000, 2000), (2000, 3000), (0, 3000)]
+
+    def assertSameKey(self, kind, params, other):
+        self.assertEqual(params, other)
+        for image_format in ('png', 'svg'):
+            self.assertEqual(render_key(kind, params, image_format), render_key(kind, other, image_format))
+
+    def test_floor_params(self):
+        self.assertSameKey('floor', floor_params(3000, 5000, 300, 300, 2, LAYING_METHOD_DIRECT),
+                           floor_params(3000.0, 5000.0000001, 300.0, 300, 2.0000001, float(LAYING_METHOD_DIRECT)))
+        # контур сдвинут к началу координат, повтор первой вершины отброшен
+        moved = [(x + 100.5, y + 200) for x, y in self.OUTLINE]
+        obstacle = [(500, 500), (1100, 500), (1100, 900)]
+        self.assertSameKey(
+            'floor',
+            floor_params(3000, 4000, 300, 300, 2, LAYING_METHOD_DIRECT, self.OUTLINE, [obstacle]),
+            floor_params(1, 1, 300, 300, 2, LAYING_METHOD_DIRECT, moved + moved[:1],
+                         [[(x + 100.5, y + 200) for x, y in obstacle]]),
+        )
+
+    def test_walls_params(self):
+        openings = [(0, 500, 1000, 1200, 900), (3, 0, 600, 400, 0)]
+        self.assertSameKey('walls', walls_params(3000, 2500, 2500, 300, 200, 1.5, openings=openings),
+                           walls_params(3000, 2500.0000001, 2500, 300, 200, 1.5, openings=openings[::-1]))
+        # дверь без высоты не учитывается
+        self.assertSameKey('walls', walls_params(3000, 2500, 2500, 300, 200, 1.5),
+                           walls_params(3000, 2500, 2500, 300, 200, 1.5, door_width=800))
+
+    def test_different_keys(self):
+        params = walls_params(3000, 2500, 2500, 300, 200, 1.5, 800, 2000)
+        keys = {
+            render_key('walls', params),
+            render_key('walls', params, 'svg'),
+            render_key('walls', walls_params(3000, 2500, 2500, 300, 200, 1.501, 800, 2000)),
+            render_key('walls', walls_params(3000, 2500, 2500, 300, 200, 1.5)),
+            render_key('floor', floor_params(3000, 2500, 300, 200, 1.5, LAYING_METHOD_DIRECT)),
+        }
+        self.assertEqual(len(keys), 5)
+
+    def test_query_round_trip(self):
+        for kind, params in (
+            ('floor', floor_params(3000, 5000, 300, 300, 2, LAYING_METHOD_DIRECT)),
+            ('floor', floor_params(3000.25, 4000.125, 250, 100, 1.5, LAYING_METHOD_DIAGONAL, self.OUTLINE,
+                                   [[(500.5, 500), (1100, 500), (1100, 900.75)]])),
+            ('walls', walls_params(3000, 2500, 2500, 300, 200, 1.5)),
+            ('walls', walls_params(3000.1, 2499.9, 2500, 300, 200, 0, 800, 2000.5,
+                                   [(3, 0, 600, 400, 0), (0, 500.25, 1000, 1200, 900)])),
+        ):
+            query = plan_query(params)
+            self.assertEqual(parse_plan_query(kind, QueryDict(query)), params, query)
+            self.assertEqual(plan_query(parse_plan_query(kind, QueryDict(query))), query)
+
+
+@override_settings(RENDER_WORKERS=0, METRICS_DIR='')
+class PlanImageTestCase(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        settings = override_settings(MEDIA_ROOT=self.media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def get(self, kind, params, **headers):
+        return self.client.get(reverse('plan_image', args=[kind, 'svg']) + '?' + plan_query(params), **headers)
+
+    def test_image(self):
+        params = floor_params(3000, 5000, 300, 300, 2, LAYING_METHOD_DIRECT)
+        response = self.get('floor', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+
+        etag = response['ETag']
+        self.assertEqual(self.get('floor', params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_canonical_redirect(self):
+        params = floor_params(3000, 5000, 300, 300, 2, LAYING_METHOD_DIRECT)
+        url = reverse('plan_image', args=['floor', 'svg'])
+        response = self.client.get(url, {'width': '3000', 'length': '5000', 'tile_width': '300',
+                                          'tile_length': '300', 'delimiter': '2', 'method': '1'})
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], plan_url('floor', params, 'svg'))
+
+    def test_invalid_params(self):
+        for kind, params in (
+            ('floor', floor_params(3000, 5000, 300, 0, 2, LAYING_METHOD_DIRECT)),
+            ('floor', floor_params(0, 5000, 300, 300, 2, LAYING_METHOD_DIRECT)),
+            ('floor', floor_params(3000, 5000, 300, 200, 2, LAYING_METHOD_DIAGONAL)),
+            ('walls', walls_params(3000, 2000, 0, 300, 300, 2)),
+            # проем выходит за стену, проемы пересекаются
+            ('walls', walls_params(3000, 2000, 2500, 300, 300, 2, openings=[(0, 2500, 1000, 1000, 0)])),
+            ('walls', walls_params(3000, 2000, 2500, 300, 300, 2, openings=[(0, 0, 1000, 1000, 0),
+                                                                           (0, 500, 1000, 1000, 500)])),
+        ):
+            response = self.get(kind, params)
+            self.assertEqual(response.status_code, 400, (kind, params))
+            self.assertFalse(os.listdir(self.media), (kind, params))
+
+    def test_drawn_image_is_not_checked_again(self):
+        params = walls_params(3000, 2000, 2500, 300, 300, 2, 800, 2000)
+        self.assertEqual(self.get('walls', params).status_code, 200)
+        with mock.patch.object(CalcWallForm, 'from_render_params') as from_render_params:
+            self.assertEqual(self.get('walls', params).status_code, 200)
+        from_render_params.assert_not_called()
@@ -0,0 +1,111 @@
+"""Timings of the stages of a request.
+
+ServerTimingMiddleware (cutter/middleware.py) starts collecting of timings
+for the request, the code marks its stages by stage() or @timed(). At the
+end of the request the timings go out in the Server-Timing header and are
+added to the totals of all processes: histogram cutter_stage_seconds of
+/metrics (calc/metrics.py).
+
+Plans drawn by the render pool (RENDER_WORKERS, calc/jobs.py) are timed
+by the job in its process: their stages (draw, wall, floor, watermark,
+font, encode, ...) are only in the totals, with the time of the whole job
+as 'job', and reach the Server-Timing header only when plans are drawn in
+the request (RENDER_WORKERS = 0).
+
+With SERVER_TIMING off and outside of a request or a job a stage costs
+one lookup of a thread local. Stages may be nested, times of the same
+stage in a request are summed.
+"""
+import threading
+import time
+from functools import wraps
+
+from .metrics import STAGE_SECONDS
+
+
+_local = threading.local()
+
+
+class _Stage:
+    __slots__ = ('name', 'timings', 'started')
+
+    def __init__(self, name, timings):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.append((self.name, time.perf_counter() - self.started))
+        return False
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """Context manager which times a stage of the current request.
+    :param name: name of the stage, a token of Server-Timing.
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return _NO_STAGE
+    return _Stage(name, timings)
+
+
+def timed(name):
+    """Decorator, the call of the function is the stage."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start():
+    """Start collecting of timings in the current thread."""
+    _local.timings = []
+    _local.started = time.perf_counter()
+
+
+def finish(total='total'):
+    """Stop collecting and add the timings to the totals.
+    :param total: name of the time since start().
+    :return: [(name, seconds), ...] in order of the first end of stages
+        and the total, None if not started.
+    """
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    if timings is None:
+        return None
+    timings.append((total, time.perf_counter() - _local.started))
+
+    summed = {}
+    for name, seconds in timings:
+        summed[name] = summed.get(name, 0.0) + seconds
+
+    for name, seconds in summed.items():
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+    return list(summed.items())
+
+
+def server_timing(timings):
+    """
+    :param timings: [(name, seconds), ...]
+    :return: value of the Server-Timing header.
+    """
+    return ", ".join("{};dur={:.1f}".format(name, seconds * 1000) for name, seconds in timings)
+
@@ -7,4 +7,7 @@ urlpatterns = [
     url(r"^floor/$", floor, name='floor'),
     url(r"^walls/$", walls, name='walls'),
     url(r"^one-tile-cost/$", one_tile_cost, name='one_tile_cost'),
+    url(r"^api/batch/$", batch, name='batch'),
+    url(r"^image/(?P<kind>floor|walls)\.(?P<image_format>png|svg)$", plan_image, name='plan_image'),
+    url(r"^plan/(?P<filename>[0-9a-f]{40}\.(?:png|svg))/$", plan_status, name='plan_status'),
 ]
\ No newline at end of file
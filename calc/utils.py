@@ -10,3 +10,17 @@ def get_client_ip(request):
     else:
         ip = request.META.get('REMOTE_ADDR')
     return ip
+
+
+def get_peer_ip(request, trusted_proxies=()):
+    """IP address of the client which the client can't forge: REMOTE_ADDR,
+    or the last address of X-Forwarded-For if the request came from a trusted proxy
+    (the proxy adds the address of its client at the end).
+    :param trusted_proxies: IP addresses of proxies in front of the application.
+    """
+    ip = request.META.get('REMOTE_ADDR')
+    if ip in trusted_proxies:
+        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if x_forwarded_for:
+            ip = x_forwarded_for.split(',')[-1].strip()
+    return ip
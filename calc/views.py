@@ -1,19 +1,64 @@
+import hmac
+import json
+import os
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden, HttpResponseBadRequest, \
+    HttpResponseNotModified, HttpResponsePermanentRedirect
 from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
+from django.utils.http import parse_etags, quote_etag
 
 from .forms import CalcFloorForm, CalcWallForm, CalcTileCostForm, LAYING_METHOD_DIRECT
+from .jobs import render_status, STATUS_READY, STATUS_PENDING
+from .metrics import observe_request, collect, exposition, DB_WRITE_SECONDS, RESULTS
 from .models import Result
-from .utils import get_client_ip
+from .render_cache import parse_plan_query, plan_query, plan_url, render_key, \
+    cached_plan_bytes, get_plan_bytes, CONTENT_TYPES
+from .timing import stage
+from .utils import get_client_ip, get_peer_ip
+from .writer import save_result
+
+
+# значения форм по умолчанию, их результаты готовятся заранее (calc/warmup.py)
+FLOOR_INITIAL = {
+    'method': LAYING_METHOD_DIRECT,
+    'width': 3.0, 'length': 5.0,
+    'tile_width': 400,
+    'tile_length': 400,
+    'delimiter': 1.5,
+    'reserve': 5.0
+}
+
+WALLS_INITIAL = {
+    'width': 2.5, 'length': 3.0, 'height': 2.5,
+    'tile_width': 400,
+    'tile_length': 400,
+    'delimiter': 1.5,
+    'reserve': 5.0
+}
+
+TILE_COST_INITIAL = {
+    'tile_width': 400, 'tile_length': 400, 'price': 500.0
+}
 
 
+def plan_context(form, image):
+    """Context of the plan image which may be rendered in background."""
+    if image is None:
+        return {'draw_busy': True}
+
+    filename = form.plan_filename
+    if render_status(filename) == STATUS_READY:
+        return {}
+    return {'draw_status': reverse('plan_status', args=[filename])}
+
+
+@observe_request('floor')
 def floor(request):
-    form = CalcFloorForm(initial={
-        'method': LAYING_METHOD_DIRECT,
-        'width': 3.0, 'length': 5.0,
-        'tile_width': 400,
-        'tile_length': 400,
-        'delimiter': 1.5,
-        'reserve': 5.0
-    })
+    form = CalcFloorForm(initial=FLOOR_INITIAL)
 
     context = {'form': form}
 
@@ -21,30 +66,23 @@ def floor(request):
         form = CalcFloorForm(request.POST)
         context['form'] = form
         if form.is_valid():
-            result, cost, image, reserve, total_area = form.calc()
-            results = {
-                'result': result, 'cost': cost, 'draw': image, 'reserve': reserve, 'total_area': total_area, 'total': result + reserve
-            }
+            results = form.results()
             context.update(results)
+            context.update(plan_context(form, results['draw']))
             result = Result(
                 name="floor",
                 data=form.get_data(),
                 result=results,
                 ip=get_client_ip(request)
             )
-            result.save()
+            save_result(result)
 
     return render(request, 'calc-floor.html', context)
 
 
+@observe_request('walls')
 def walls(request):
-    form = CalcWallForm(initial={
-        'width': 2.5, 'length': 3.0, 'height': 2.5,
-        'tile_width': 400,
-        'tile_length': 400,
-        'delimiter': 1.5,
-        'reserve': 5.0
-    })
+    form = CalcWallForm(initial=WALLS_INITIAL)
 
     context = {'form': form}
 
@@ -52,27 +90,23 @@ def walls(request):
         form = CalcWallForm(request.POST)
         context['form'] = form
         if form.is_valid():
-            result, cost, image, reserve, total_area = form.calc()
-            results = {
-                'result': result, 'cost': cost, 'draw': image, 'reserve': reserve, 'total_area': total_area,
-                'total': result + reserve
-            }
+            results = form.results()
             context.update(results)
+            context.update(plan_context(form, results['draw']))
             result = Result(
                 name="walls",
                 data=form.get_data(),
                 result=results,
                 ip=get_client_ip(request)
             )
-            result.save()
+            save_result(result)
 
     return render(request, 'calc-walls.html', context)
 
 
+@observe_request('one-tile-cost')
 def one_tile_cost(request):
-    form = CalcTileCostForm(initial={
-        'tile_width': 400, 'tile_length': 400, 'price': 500.0
-    })
+    form = CalcTileCostForm(initial=TILE_COST_INITIAL)
 
     context = {'form': form}
 
@@ -89,6 +123,152 @@ def one_tile_cost(request):
                 result=results,
                 ip=get_client_ip(request)
             )
-            result.save()
+            save_result(result)
 
     return render(request, "calc-tile-cost.html", context)
+
+
+def plan_status(request, filename):
+    """Status of the plan image for the page which waits for it."""
+    status = render_status(filename)
+    data = {'status': status}
+    if status == STATUS_READY:
+        data['url'] = os.path.join(settings.MEDIA_URL, filename)
+        return JsonResponse(data)
+    return JsonResponse(data, status=202 if status == STATUS_PENDING else 404)
+
+
+PLAN_FORMS = {
+    'floor': CalcFloorForm,
+    'walls': CalcWallForm,
+}
+
+
+def form_errors(form):
+    """Errors of the form in one line."""
+    return '; '.join(
+        "{}: {}".format(field, ' '.join(str(e) for e in errors)) for field, errors in sorted(form.errors.items())
+    )
+
+
+@require_safe
+def plan_image(request, kind, image_format):
+    """Plan image by its parameters (render_cache.plan_url()).
+    The image is drawn if it is not drawn yet or was deleted, the URL
+    always gives the same image, so it's cached by browsers and proxies.
+    Parameters of a plan which is not drawn are checked by the form of
+    the calculator, as if they were its input.
+    """
+    try:
+        params = parse_plan_query(kind, request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest("Invalid parameters: {}".format(e))
+
+    if request.META.get('QUERY_STRING', '') != plan_query(params):
+        # у одной схемы один адрес
+        return HttpResponsePermanentRedirect(plan_url(kind, params, image_format))
+
+    etag = quote_etag(render_key(kind, params, image_format))
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        content = cached_plan_bytes(kind, params, image_format)
+        if content is None:
+            form = PLAN_FORMS[kind].from_render_params(params)
+            if not form.is_valid():
+                return HttpResponseBadRequest("Invalid parameters: {}".format(form_errors(form)))
+            # раскладка формы посчитана по тем же параметрам, если они не изменились при проверке
+            layout = form.layout if form.render_params == params else None
+            content = get_plan_bytes(kind, params, image_format, layout=layout)
+        response = HttpResponse(content, content_type=CONTENT_TYPES[image_format])
+
+    response['ETag'] = etag
+    response['Cache-Control'] = "public, max-age={}, immutable".format(settings.PLAN_CACHE_MAX_AGE)
+    return response
+
+
+BATCH_FORMS = {
+    'floor': CalcFloorForm,
+    'walls': CalcWallForm,
+    'one-tile-cost': CalcTileCostForm,
+}
+
+
+def batch_authorized(request):
+    """The request has one of CALC_BATCH_TOKENS in the header 'Authorization: Token <token>'."""
+    if settings.CALC_BATCH_TOKENS is None:
+        return True
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme != 'Token' or not token:
+        return False
+    return any(hmac.compare_digest(token.encode('utf-8'), t.encode('utf-8')) for t in settings.CALC_BATCH_TOKENS)
+
+
+@csrf_exempt
+@require_POST
+@observe_request('batch')
+def batch(request):
+    """Calculation of many rooms in one request.
+
+    Request: {"render": false, "rooms": [{"name": "floor", "data": {<fields of the form>}}, ...]}
+    Response: {"results": [{"result": {...}} or {"errors": {<field>: [<message>, ...]}}, ...]}
+    Plans are drawn only if "render" is true, valid rooms are saved by one query.
+    Clients are authorized by tokens (settings.CALC_BATCH_TOKENS).
+    """
+    if not batch_authorized(request):
+        return JsonResponse({'error': "Invalid token"}, status=401)
+
+    try:
+        payload = json.loads(request.body.decode('utf-8'))
+        rooms = payload['rooms']
+        render_plans = bool(payload.get('render', False))
+        if not isinstance(rooms, list):
+            raise ValueError("rooms must be a list")
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return JsonResponse({'error': "Invalid request: {}".format(e)}, status=400)
+
+    if len(rooms) > settings.CALC_BATCH_MAX:
+        return JsonResponse({'error': "Too many rooms, max {}".format(settings.CALC_BATCH_MAX)}, status=400)
+
+    ip = get_client_ip(request)
+    response = []
+    to_save = []
+    for room in rooms:
+        name = room.get('name') if isinstance(room, dict) else None
+        form_class = BATCH_FORMS.get(name) if isinstance(name, str) else None
+        if form_class is None:
+            response.append({'errors': {'name': ["Unknown calculation, one of: {}".format(', '.join(sorted(BATCH_FORMS)))]}})
+            continue
+
+        data = room.get('data') or {}
+        if not isinstance(data, dict):
+            response.append({'errors': {'data': ["Fields of the form must be an object"]}})
+            continue
+
+        form = form_class(data)
+        if not form.is_valid():
+            response.append({'errors': {field: [str(e) for e in errors] for field, errors in form.errors.items()}})
+            continue
+
+        if form_class is CalcTileCostForm:
+            tile_area_m, cost = form.calc()
+            results = {'tile_area_m': tile_area_m, 'cost': cost}
+        else:
+            results = form.results(render=render_plans)
+
+        response.append({'result': results})
+        to_save.append(Result(name=room['name'], data=form.get_data(), result=results, ip=ip))
+
+    with stage('db'), DB_WRITE_SECONDS.time(mode='batch'):
+        Result.objects.bulk_create(to_save)
+    RESULTS.inc(len(to_save), status='written')
+
+    return JsonResponse({'results': response})
+
+
+def metrics(request):
+    """Metrics of all processes in Prometheus text format (calc/metrics.py)."""
+    # первый адрес X-Forwarded-For задает сам клиент, ему верить нельзя
+    if get_peer_ip(request, settings.METRICS_TRUSTED_PROXIES) not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,68 @@
+"""Warm-up of the application in the gunicorn master before the workers are forked.
+
+With preload_app the master imports Django and the calc modules, then
+warmup() (when_ready hook of cutter/gunicorn.conf.py) does what the first
+request of every worker would do:
+
+- compiles the templates of the calculator pages;
+- loads the watermark font and finds its sizes, prepares watermark patches;
+- draws the plans (PNG and SVG) of the default values of the forms and
+  keeps them in the LRU of plan bytes; the results are not kept, a page
+  calculates them again.
+
+The workers get all of it from the master copy-on-write. Connections to
+the database are closed before forking, every worker opens its own.
+"""
+import gc
+import logging
+import time
+
+from django.db import connections
+from django.test import RequestFactory
+
+from .forms import CalcFloorForm, CalcWallForm
+from .render_cache import get_plan_bytes, IMAGE_FORMATS
+
+
+logger = logging.getLogger(__name__)
+
+
+def warm_pages():
+    from . import views
+
+    factory = RequestFactory()
+    for view in (views.floor, views.walls, views.one_tile_cost):
+        view(factory.get('/'))
+
+
+def warm_plans():
+    from .views import FLOOR_INITIAL, WALLS_INITIAL
+
+    for form_class, initial in ((CalcFloorForm, FLOOR_INITIAL), (CalcWallForm, WALLS_INITIAL)):
+        form = form_class(initial)
+        if not form.is_valid():
+            logger.warning("Initial values of %s are not valid: %s", form_class.__name__, form.errors)
+            continue
+        for image_format in IMAGE_FORMATS:
+            get_plan_bytes(form.render_kind, form.render_params, image_format, layout=form.layout)
+
+
+def warmup():
+    """Warm up the process, errors are logged: the server starts anyway."""
+    for step in (warm_pages, warm_plans):
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception("Warm-up step %s failed", step.__name__)
+        else:
+            logger.info("Warm-up step %s: %.1f ms", step.__name__, (time.perf_counter() - started) * 1000)
+
+    # соединения не должны достаться воркерам
+    connections.close_all()
+
+    # объекты прогрева не меняются: сборщик мусора воркеров не будет их трогать
+    # и копировать страницы памяти (Python 3.7+)
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
@@ -0,0 +1,133 @@
+"""Text watermark of plan images.
+
+Fonts are loaded once per process and size, the font size is found by
+bisection instead of stepping down from the largest one. Only the box of
+the text is drawn (a patch) and blended into the image in place, ready
+patches are kept in LRU by canvas size.
+"""
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+from .metrics import FONT_SEARCHES, FONT_ITERATIONS
+from .timing import timed
+
+
+WATERMARK_FONT_SIZE_MAX = 60
+WATERMARK_FONT_SIZE_MIN = 2
+WATERMARK_FONT_SIZE_STEP = 2
+WATERMARK_PADDING = 10
+WATERMARK_FILL = (0, 0, 0, 128)
+
+WATERMARK_LAYERS_CACHE_SIZE = 32
+# запас вокруг текста: глифы могут выходить за font.getsize()
+WATERMARK_PATCH_MARGIN = 4
+
+
+@lru_cache(maxsize=None)
+def get_font(path, size):
+    """
+    :param path: path to TrueType font file.
+    :param size: font size.
+    :rtype: ImageFont.FreeTypeFont
+    """
+    return ImageFont.truetype(path, size=size)
+
+
+def _fits(text, path, size, width, height):
+    tw, th = get_font(path, size).getsize(text)
+    return tw + WATERMARK_PADDING < width and th + WATERMARK_PADDING < height
+
+
+@lru_cache(maxsize=1024)
+@timed('font')
+def fit_font_size(text, path, width, height):
+    """Find the largest font size (60, 58, ... 2) the text fits with into the image.
+    Text size grows with font size, so bisection needs ~5 measurements instead of ~30.
+    :param width: image width (px)
+    :param height: image height (px)
+    :return: font size, the smallest one if nothing fits.
+    """
+    sizes = list(range(WATERMARK_FONT_SIZE_MAX, WATERMARK_FONT_SIZE_MIN - 1, -WATERMARK_FONT_SIZE_STEP))
+
+    # sizes[lo] may fit, sizes[hi] fits or hi is out of list
+    lo, hi = 0, len(sizes)
+    iterations = 0
+    while lo < hi:
+        iterations += 1
+        mid = (lo + hi) // 2
+        if _fits(text, path, sizes[mid], width, height):
+            hi = mid
+        else:
+            lo = mid + 1
+
+    FONT_SEARCHES.inc()
+    FONT_ITERATIONS.inc(iterations)
+    return sizes[min(lo, len(sizes) - 1)]
+
+
+@lru_cache(maxsize=WATERMARK_LAYERS_CACHE_SIZE)
+def get_watermark_patch(text, path, size):
+    """Part of the image covered by the text in the center, transparent around the text.
+    NOTE: the patch is shared between requests, don't modify it.
+    :param size: (width, height) of the image.
+    :return: ((x, y) of the patch on the image, RGBA patch),
+        the patch is None if the text is out of the image.
+    """
+    width, height = size
+    font = get_font(path, fit_font_size(text, path, width, height))
+    tw, th = font.getsize(text)
+    x, y = width / 2 - tw / 2, height / 2 - th / 2
+
+    # кусок сдвинут на целое число пикселей, дробная часть координат текста
+    # та же, что и на целой картинке, поэтому пиксели текста не меняются
+    x0 = max(int(x) - WATERMARK_PATCH_MARGIN, 0)
+    y0 = max(int(y) - WATERMARK_PATCH_MARGIN, 0)
+    x1 = min(int(x) + tw + WATERMARK_PATCH_MARGIN, width)
+    y1 = min(int(y) + th + WATERMARK_PATCH_MARGIN, height)
+    if x1 <= x0 or y1 <= y0:
+        return (0, 0), None
+
+    patch = Image.new('RGBA', size=(x1 - x0, y1 - y0), color=0)
+    draw = ImageDraw.Draw(patch)
+    draw.text(
+        (x - x0, y - y0),
+        text,
+        fill=WATERMARK_FILL,
+        font=font
+    )
+
+    bbox = patch.getbbox()
+    if bbox is None:
+        return (0, 0), None
+    return (x0 + bbox[0], y0 + bbox[1]), patch.crop(bbox)
+
+
+def apply_watermark(image, text, path):
+    """Blends the watermark into the image in place,
+    only the box of the text is allocated and composited.
+    :param image: RGBA image.
+    :type image: PIL.Image
+    :return: the image.
+    :rtype: PIL.Image
+    """
+    pos, patch = get_watermark_patch(text, path, image.size)
+    if patch is not None:
+        image.alpha_composite(patch, dest=pos)
+    return image
+
+
+@lru_cache(maxsize=WATERMARK_LAYERS_CACHE_SIZE)
+def get_watermark_alpha(text, path, size):
+    """Alpha channel of the watermark patch, for images without alpha.
+    NOTE: the array is shared between requests, don't modify it.
+    :param size: (width, height) of the image.
+    :return: ((x, y) of the patch on the image, numpy.ndarray of uint8, shape (patch height, patch width)),
+        the array is None if the text is out of the image.
+    """
+    import numpy as np
+    pos, patch = get_watermark_patch(text, path, size)
+    if patch is None:
+        return pos, None
+    alpha = np.asarray(patch.getchannel('A'))
+    alpha.setflags(write=False)
+    return pos, alpha
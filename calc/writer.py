@@ -0,0 +1,155 @@
+"""Write-behind of Result records.
+
+Views put results into a bounded queue and return at once, a background
+thread of the worker saves them by bulk_create() when RESULTS_FLUSH_SIZE
+records are collected or RESULTS_FLUSH_INTERVAL seconds have passed.
+Records which don't fit into the queue are dropped and counted: the
+results are statistics, the request must not wait for the database.
+The queue is flushed at exit of the worker.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import DB_WRITE_SECONDS, RESULTS
+from .models import Result
+from .timing import stage
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ResultWriter:
+    """
+    :ivar queued: records put into the queue.
+    :ivar written: records saved.
+    :ivar dropped: records not saved: the queue was full.
+    :ivar failed: records not saved: database error.
+    """
+
+    def __init__(self, max_size, flush_size, flush_interval):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self.queued = self.written = self.dropped = self.failed = 0
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def _start(self):
+        """Thread of the current process, a forked process starts its own one."""
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=self.max_size)
+            self._thread = threading.Thread(target=self._run, name="ResultWriter", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def put(self, result):
+        """Put the record into the queue, never blocks.
+        :type result: Result
+        :return: False if the record is dropped.
+        """
+        self._start()
+        try:
+            self._queue.put_nowait(result)
+        except queue.Full:
+            self.dropped += 1
+            RESULTS.inc(status='dropped')
+            return False
+        self.queued += 1
+        return True
+
+    def _run(self):
+        batch = []
+        deadline = None
+        stop = False
+
+        while not stop:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stop = True
+            elif item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.time() + self.flush_interval
+
+            if batch and (stop or len(batch) >= self.flush_size or time.time() >= deadline):
+                self._write(batch)
+                batch = []
+                deadline = None
+
+        connection.close()
+
+    def _write(self, batch):
+        try:
+            with DB_WRITE_SECONDS.time(mode='bulk'):
+                Result.objects.bulk_create(batch)
+            self.written += len(batch)
+            RESULTS.inc(len(batch), status='written')
+        except Exception:
+            self.failed += len(batch)
+            RESULTS.inc(len(batch), status='failed')
+            logger.exception("Can't save %d results", len(batch))
+            # соединение могло остаться в сломанной транзакции
+            connection.close()
+
+    def stop(self, timeout=10):
+        """Flush the queue and stop the thread (at exit of the worker)."""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                return
+            thread = self._thread
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error("Results queue is full at exit, %d results may be lost", self._queue.qsize())
+            return
+        thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'pending': self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+writer = ResultWriter(
+    settings.RESULTS_QUEUE_SIZE,
+    settings.RESULTS_FLUSH_SIZE,
+    settings.RESULTS_FLUSH_INTERVAL,
+)
+atexit.register(writer.stop)
+
+
+def save_result(result):
+    """Save the record in background or at once if RESULTS_ASYNC is off.
+    :type result: Result
+    """
+    with stage('db'):
+        if not settings.RESULTS_ASYNC:
+            with DB_WRITE_SECONDS.time(mode='sync'):
+                result.save()
+            RESULTS.inc(status='written')
+            return
+        writer.put(result)
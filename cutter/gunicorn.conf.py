@@ -1,3 +1,30 @@
 bind = '127.0.0.1:8000'
 workers = 3
 user = "root"
+
+# приложение загружается и прогревается в мастере (calc/warmup.py),
+# воркеры получают готовые модули, шрифты и схемы по умолчанию copy-on-write.
+# NOTE: новый код подхватывается только полным перезапуском, не HUP
+preload_app = True
+
+
+def worker_exit(server, worker):
+    # сохраняем накопленные результаты расчетов
+    from calc.writer import writer
+    writer.stop()
+
+
+def on_starting(server):
+    # метрики прошлого запуска (calc/metrics.py), pid процессов могут повториться
+    import os
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cutter.settings")
+    from django.conf import settings
+    if settings.METRICS_DIR and os.path.isdir(settings.METRICS_DIR):
+        for filename in os.listdir(settings.METRICS_DIR):
+            if filename.endswith('.db'):
+                os.remove(os.path.join(settings.METRICS_DIR, filename))
+
+
+def when_ready(server):
+    from calc.warmup import warmup
+    warmup()
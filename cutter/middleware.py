@@ -1,11 +1,30 @@
 #from django.contrib.sessions.middleware import SessionMiddleware
 
 from django.conf import settings
-from calc.models import Result
+from django.utils.deprecation import MiddlewareMixin
+from calc import timing
+from calc.counter import results_count
 
 
 def cutter_context(request):
     context_data = dict()
-    context_data['results_count'] = request.results_count = int(
-            Result.objects.all().count() + settings.CUTTER_FAKE_RESULTS_NUMBER)
+    with timing.stage('count'):
+        context_data['results_count'] = request.results_count = int(
+                results_count() + settings.CUTTER_FAKE_RESULTS_NUMBER)
     return context_data
+
+
+class ServerTimingMiddleware(MiddlewareMixin):
+    """Times of the stages of the request (calc/timing.py) in the Server-Timing header.
+    Should be the first middleware, so 'total' includes the other ones.
+    """
+
+    def process_request(self, request):
+        if settings.SERVER_TIMING:
+            timing.start()
+
+    def process_response(self, request, response):
+        timings = timing.finish()
+        if timings:
+            response['Server-Timing'] = timing.server_timing(timings)
+        return response
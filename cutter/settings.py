@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'cutter.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -171,5 +172,69 @@ SITE_ID = 1
 # DRAWING
 DRAWING_WATERMARK_TEXT = "www.tcutter.ru"
 DRAWING_WATERMARK_FONT = "/root/webapps/cutter/static/fonts/arial.ttf"
+# 'pil' - ImageDraw per tile, 'raster' - NumPy compositor (calc/raster.py),
+# 'palette' - NumPy compositor with indexed (P) images, 1 byte per pixel
+DRAWING_RENDERER = 'palette'
+# PNG encoding: compress level 0-9 (zlib), optimize - smaller files, slower encoding
+DRAWING_PNG_COMPRESS_LEVEL = 6
+DRAWING_PNG_OPTIMIZE = False
+
+# Background rendering of plans (calc/jobs.py), processes per request worker.
+# 0 - draw in the request.
+RENDER_WORKERS = 2
+# Max number of pending renders per request worker, new plans are not drawn above it
+RENDER_QUEUE_MAX = 16
+# Lock of a render older than this (seconds) is considered dead
+RENDER_JOB_TIMEOUT = 60
+
+# Max number of rooms in one request of the batch API (/calc/api/batch/)
+CALC_BATCH_MAX = 500
+# Tokens of clients of the batch API (header 'Authorization: Token <token>'), empty - nobody,
+# None - any client without a token.
+CALC_BATCH_TOKENS = []
+
+# Results are saved by a background thread of the worker (calc/writer.py)
+RESULTS_ASYNC = True
+# Max number of results waiting for saving, new ones are dropped above it
+RESULTS_QUEUE_SIZE = 10000
+# Results are saved when so many are collected or after the interval (seconds)
+RESULTS_FLUSH_SIZE = 100
+RESULTS_FLUSH_INTERVAL = 2.0
+
+# Number of results on pages (calc/counter.py): cached for TTL seconds,
+# estimated by PostgreSQL statistics if the table has more rows than RESULTS_COUNT_EXACT_BELOW
+RESULTS_COUNT_TTL = 30
+RESULTS_COUNT_EXACT_BELOW = 100000
+
+# manage.py archive_results: results older than the days are moved into the directory
+RESULTS_RETENTION_DAYS = 365
+RESULTS_ARCHIVE_DIR = "/root/webapps/cutter/archive/"
+
+# Plan images served by /calc/image/: bytes kept in memory of a worker, Cache-Control max-age (seconds)
+PLAN_CACHE_BYTES = 32 * 1024**2
+PLAN_CACHE_MAX_AGE = 365 * 24 * 3600
+
+# Size limit of plan images in MEDIA_ROOT (calc/media.py), 0 - no limit.
+# Least recently used images are deleted, except the ones used during MEDIA_MIN_AGE seconds
+# and the images of the results of the last MEDIA_KEEP_REFERENCED_DAYS days.
+MEDIA_MAX_BYTES = 2 * 1024**3
+MEDIA_MAX_FILES = 100000
+MEDIA_MIN_AGE = 3600
+MEDIA_KEEP_REFERENCED_DAYS = 7
+# Background eviction: every interval (seconds, 0 - off) at most the batch of files is deleted
+MEDIA_EVICT_INTERVAL = 300
+MEDIA_EVICT_BATCH = 1000
+
+# Files of metrics of the processes (calc/metrics.py), empty - metrics are off.
+# The directory is cleared at the start of gunicorn.
+METRICS_DIR = "/root/webapps/cutter/metrics/"
+# Clients allowed to read /metrics
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+# Proxies in front of gunicorn: for requests from them the client is the last address of X-Forwarded-For
+METRICS_TRUSTED_PROXIES = ['127.0.0.1']
+
+# Times of the stages of requests in the Server-Timing header and in /metrics (calc/timing.py),
+# stages of render jobs of the pool are only in /metrics
+SERVER_TIMING = False
 
 CUTTER_FAKE_RESULTS_NUMBER = 1000
@@ -20,6 +20,7 @@ from django.contrib import admin
 from django.contrib.sitemaps.views import sitemap
 from django.conf import settings
 from .views import index, about
+from calc.views import metrics
 from .sitemaps import StaticViewSitemap
 
 
@@ -33,6 +34,7 @@ urlpatterns = [
     url(r'^$', index, name='main'),
     url(r'^calc/', include('calc.urls')),
     url(r'^about/', about, name='about'),
+    url(r'^metrics$', metrics, name='metrics'),
 
     url(r'^sitemap\.xml$', sitemap, {'sitemaps': sitemaps},
         name='django.contrib.sitemaps.views.sitemap')